@@ -7,11 +7,16 @@ import os
 import json
 import logging
 from datetime import datetime
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, ParseMode
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import CallbackContext
+try:
+    from telegram import ParseMode
+except ImportError:  # python-telegram-bot 20+ (BOT_RUNTIME=async)
+    from telegram.constants import ParseMode
 
 import json
 from config import ADMIN_USER_ID, DISCOUNT_PERCENTAGE
+from callback_ack import acknowledge
 from data_manager import get_all_orders, get_countries, get_gift_cards_for_country, update_order_status, cancel_order
 
 logger = logging.getLogger(__name__)
@@ -55,11 +60,11 @@ def admin_button_callback(update: Update, context: CallbackContext) -> None:
     
     # Verify the user is an admin
     if user_id != ADMIN_USER_ID:
-        query.answer("You are not authorized to use the admin panel.")
+        acknowledge(update, "You are not authorized to use the admin panel.")
         return
     
-    # Provide response feedback
-    query.answer()
+    # Stop the button's spinner (the dispatcher usually has already)
+    acknowledge(update)
     
     # Get callback data
     data = query.data
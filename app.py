@@ -4,11 +4,16 @@
 Flask web application for the Gift Card Store Bot
 """
 import os
+import hmac
 import logging
 from flask import Flask, render_template, jsonify, request, redirect, url_for
 from dotenv import load_dotenv
 from models import db, Country, GiftCard, Denomination, Order, User, CryptoPayment
 from flask_migrate import Migrate
+import metrics
+from deadline import install_statement_timeout
+from config import WEBHOOK_PATH, METRICS_TOKEN
+from webhook import SECRET_HEADER, webhook_enabled, secret_is_valid, enqueue_update
 
 # Load environment variables
 load_dotenv()
@@ -39,6 +44,8 @@ migrate = Migrate(app, db)
 # Create tables if they don't exist
 with app.app_context():
     db.create_all()
+    # Statements run while handling a bot update stop at the update's deadline
+    install_statement_timeout(db.engine)
 
 # Routes
 @app.route('/')
@@ -65,6 +72,36 @@ def bot_status():
     
     return jsonify(status)
 
+@app.route('/api/metrics')
+def get_metrics():
+    """Get in-process metrics (cache hit rates, queue depths, etc.); requires METRICS_TOKEN as a bearer token"""
+    supplied = request.headers.get('Authorization', '')
+    expected = f"Bearer {METRICS_TOKEN}"
+    if not METRICS_TOKEN or not hmac.compare_digest(supplied.encode(), expected.encode()):
+        return jsonify({"error": "Forbidden"}), 403
+    return jsonify(metrics.snapshot())
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    """Receive a Telegram update and hand it to the bot's dispatcher"""
+    if not webhook_enabled():
+        return jsonify({"error": "Webhook mode is disabled"}), 404
+    if not secret_is_valid(request.headers.get(SECRET_HEADER)):
+        metrics.increment("webhook_rejected")
+        logger.warning(f"Rejected webhook request from {request.remote_addr}: bad secret token")
+        return jsonify({"error": "Forbidden"}), 403
+    
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({"error": "Invalid update"}), 400
+    try:
+        enqueue_update(data)
+    except Exception as e:
+        # An error response makes Telegram deliver the update again
+        logger.error(f"Error queueing webhook update: {e}")
+        return jsonify({"error": "Update not queued"}), 500
+    return jsonify({"ok": True})
+
 # Admin API routes
 @app.route('/api/admin/countries', methods=['GET'])
 def get_countries():
@@ -0,0 +1,517 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Asyncio bot runtime on python-telegram-bot's Application (PTB 20+)
+
+Selected with BOT_RUNTIME=async and installed with the "async" dependency
+group (uv sync --no-group threaded --group async); the threaded Updater in
+bot.py stays the default. Updates are processed concurrently
+(ASYNC_CONCURRENT_UPDATES at a time), so a user waiting on I/O costs a
+coroutine rather than a worker thread. One user's updates still run one at a
+time, in the order they arrived (in_user_order), as they do on the threaded
+runtime's lanes.
+
+The commands, button presses and text replies have native async handlers.
+Database, explorer and QR rendering calls run on the loop's ASYNC_IO_THREADS
+worker threads with asyncio.to_thread, and messages go out through the outbox
+like the rest of the bot. A settlement pushed to a waiting invoice is shown in
+the user's update order too. Only the admin panel still runs its blocking
+PTB 13 style handlers. They use per-user lanes (ASYNC_HANDLER_THREADS threads)
+through bridge(), which turns every coroutine returned by a PTB 20 method into
+a blocking call on the event loop.
+"""
+import os
+import asyncio
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    ASYNC_CONCURRENT_UPDATES, ASYNC_HANDLER_THREADS, ASYNC_IO_THREADS, UPDATE_DEADLINE, UPDATE_LANE_DEPTH
+)
+from deadline import deadline
+from lanes import UserLanes, update_lane_key, answer_busy
+from outbox import OUTBOX
+from callback_ack import acknowledge_async
+from webhook import check_deployment
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lanes for bridged handlers, created with the application
+_lanes = None
+# User key -> future resolved when that user's latest update is done (event loop thread only)
+_tails = {}
+# Tasks started with _spawn, referenced until they finish
+_background = set()
+
+
+def _require_async_ptb():
+    """Fail with a clear message when the installed python-telegram-bot predates the Application API."""
+    import telegram
+    major = int(telegram.__version__.split(".")[0])
+    if major < 20:
+        raise RuntimeError(
+            f"BOT_RUNTIME=async needs python-telegram-bot>=20, but {telegram.__version__} is installed; "
+            f"upgrade it or use BOT_RUNTIME=threaded"
+        )
+
+
+class _BlockingProxy:
+    """Give thread-bound code the blocking PTB 13 calling convention over PTB 20 objects."""
+
+    def __init__(self, target, loop):
+        self._target = target
+        self._loop = loop
+
+    def __getattr__(self, name):
+        return _wrap(getattr(self._target, name), self._loop)
+
+    def __bool__(self):
+        return bool(self._target)
+
+
+def _wrap(value, loop):
+    if callable(value) and not isinstance(value, type):
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            if asyncio.iscoroutine(result):
+                try:
+                    running = asyncio.get_running_loop()
+                except RuntimeError:
+                    running = None
+                if running is loop:
+                    result.close()
+                    raise RuntimeError("Blocking Telegram call made from the event loop thread")
+                result = asyncio.run_coroutine_threadsafe(result, loop).result()
+            return _wrap(result, loop)
+        return call
+    # Telegram objects (Update, Message, Bot, ...) and the callback context get proxied too
+    if value is not None and (hasattr(value, "to_dict") or hasattr(value, "bot_data")):
+        return _BlockingProxy(value, loop)
+    return value
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def _spawn(coroutine):
+    """Run coroutine as a task of its own, keeping a reference until it finishes."""
+    task = asyncio.get_running_loop().create_task(coroutine)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _after_users_updates(key, handler, *args):
+    """Await handler(*args) once the user's earlier updates are done."""
+    # Updates start in arrival order, so each one queues behind the user's previous one
+    previous = _tails.get(key)
+    done = _tails[key] = asyncio.get_running_loop().create_future()
+    try:
+        if previous is not None:
+            await previous
+        return await handler(*args)
+    finally:
+        _resolve(done)
+        if _tails.get(key) is done:
+            del _tails[key]
+
+
+def in_user_order(handler, acknowledge=True):
+    """
+    Wrap an async handler so each user's updates run one at a time, in the order they arrived.
+
+    Callback queries are answered on arrival unless acknowledge is False, e.g. for
+    bridged handlers, which answer "busy" themselves when their lanes are full.
+    """
+    async def run(update, context):
+        if acknowledge and getattr(update, "callback_query", None):
+            # Stop the button's spinner right away, as the threaded dispatcher does on admission
+            _spawn(acknowledge_async(update))
+        key = update_lane_key(update)
+        if key is None:
+            return await handler(update, context)
+        return await _after_users_updates(key, handler, update, context)
+    run.__name__ = getattr(handler, "__name__", "ordered_handler")
+    return run
+
+
+def _user_order_lane(loop):
+    """A run_in_user_lane for other threads: func runs off the loop once the user's queued updates are done."""
+    def run_in_lane(user_id, func, *args):
+        def schedule():
+            _spawn(_after_users_updates(user_id, asyncio.to_thread, func, *args))
+        loop.call_soon_threadsafe(schedule)
+        return True
+    return run_in_lane
+
+
+def bridge(handler):
+    """Run a blocking PTB 13 style handler from the async Application, on its user's lane."""
+    async def run(update, context):
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        blocking_update = _BlockingProxy(update, loop)
+
+        def call():
+            try:
+                handler(blocking_update, _BlockingProxy(context, loop))
+            finally:
+                loop.call_soon_threadsafe(_resolve, finished)
+
+        if _lanes.submit(update_lane_key(update), contextvars.copy_context().run, call) is None:
+            metrics.increment("updates_shed", reason="busy")
+            answer_busy(blocking_update)
+            return
+        await finished
+    run.__name__ = getattr(handler, "__name__", "bridged_handler")
+    return run
+
+
+def _outbox_bot(context):
+    """The context's bot with blocking calls, for the outbox's sender threads."""
+    return _BlockingProxy(context.bot, asyncio.get_running_loop())
+
+
+async def start_command(update, context):
+    """Async /start: reset the user's flow and show the countries."""
+    from telegram.constants import ParseMode
+    from constants import WELCOME_MESSAGE
+    from keyboards import get_countries_keyboard
+    from conversation_store import CONVERSATIONS
+
+    with deadline(UPDATE_DEADLINE):
+        user_id = update.effective_user.id
+        logger.info(f"User {user_id} started the bot")
+        await asyncio.to_thread(CONVERSATIONS.reset, user_id, "country_selection")
+
+        keyboard = await asyncio.to_thread(get_countries_keyboard)
+        OUTBOX.send_message(
+            _outbox_bot(context),
+            chat_id=update.message.chat_id,
+            text=WELCOME_MESSAGE,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+
+async def language_command(update, context):
+    """Async /language."""
+    from telegram.constants import ParseMode
+    from constants import LANGUAGE_MESSAGE
+
+    OUTBOX.send_message(
+        _outbox_bot(context), chat_id=update.message.chat_id, text=LANGUAGE_MESSAGE, parse_mode=ParseMode.MARKDOWN
+    )
+
+
+async def help_command(update, context):
+    """Async /help."""
+    from telegram.constants import ParseMode
+    from constants import HELP_MESSAGE
+
+    OUTBOX.send_message(
+        _outbox_bot(context), chat_id=update.message.chat_id, text=HELP_MESSAGE, parse_mode=ParseMode.MARKDOWN
+    )
+
+
+async def history_command(update, context):
+    """Async /history: load the user's orders off the event loop."""
+    from telegram.constants import ParseMode
+    from constants import NO_HISTORY_MESSAGE
+    from data_manager import get_user_orders
+    from handlers import format_history
+
+    with deadline(UPDATE_DEADLINE):
+        orders = await asyncio.to_thread(get_user_orders, update.effective_user.id)
+        text = format_history(orders) if orders else NO_HISTORY_MESSAGE
+        OUTBOX.send_message(
+            _outbox_bot(context), chat_id=update.message.chat_id, text=text, parse_mode=ParseMode.MARKDOWN
+        )
+
+
+def _edit_text(bot, query, **kwargs):
+    """Queue an edit of the text of the message whose button was pressed."""
+    return OUTBOX.edit_message_text(bot, query.message.chat_id, query.message.message_id, **kwargs)
+
+
+def _edit_caption(bot, query, **kwargs):
+    """Queue an edit of the caption of the message whose button was pressed."""
+    return OUTBOX.edit_message_caption(bot, query.message.chat_id, query.message.message_id, **kwargs)
+
+
+def _delete_message(bot, query):
+    """Queue deletion of the message whose button was pressed."""
+    return OUTBOX.delete_message(bot, query.message.chat_id, query.message.message_id)
+
+
+async def button_callback(update, context):
+    """Async button presses: handlers.button_callback's flow, with database, explorer and QR work off the event loop."""
+    from conversation_store import CONVERSATIONS
+
+    with deadline(UPDATE_DEADLINE):
+        conversation = await asyncio.to_thread(CONVERSATIONS.load, update.effective_user.id)
+        try:
+            await _handle_button(update, context, conversation)
+        finally:
+            await asyncio.to_thread(CONVERSATIONS.save, conversation)
+
+
+async def _handle_button(update, context, conversation):
+    """Handle a button press within the user's conversation (already acknowledged by in_user_order)."""
+    from telegram.constants import ParseMode
+    from constants import EXPIRED_MENU_MESSAGE
+    from keyboards import (
+        get_countries_keyboard, get_gift_cards_keyboard, get_denominations_keyboard,
+        get_crypto_keyboard, get_check_payment_keyboard
+    )
+    from data_manager import get_order
+    from payment import check_payment_cached
+    from qr_cache import QR_CODES
+    from settlement_events import SETTLEMENT_EVENTS
+    from handlers import (
+        _start_invoice, _unpaid_receipt_text, _payment_is_confirmed, _confirmed_gift_card_code,
+        _payment_confirmed_text, _pending_payment_text, _awaiting_payment_text, _push_settlement_to_invoice
+    )
+
+    query = update.callback_query
+    user_id = update.effective_user.id
+    bot = _outbox_bot(context)
+    data = query.data
+
+    in_lane = _user_order_lane(asyncio.get_running_loop())
+
+    def push_settlement(message, order_id):
+        # The receipt is shown in order with the user's updates on this loop
+        _push_settlement_to_invoice(bot, user_id, message, order_id, run_in_lane=in_lane)
+
+    async def send_qr_invoice(qr_code_text, caption, show_qr):
+        # Reuse the earlier upload of the same QR code if there is one
+        photo = await asyncio.to_thread(QR_CODES.photo, qr_code_text)
+        invoice_sent = OUTBOX.send_photo(
+            bot,
+            chat_id=user_id,
+            photo=photo,
+            caption=caption,
+            reply_markup=get_check_payment_keyboard(show_qr=show_qr),
+            parse_mode=ParseMode.MARKDOWN
+        )
+        QR_CODES.track_upload(qr_code_text, invoice_sent)
+        return invoice_sent
+
+    # Back buttons
+    if data == "back_to_countries":
+        conversation.state = "country_selection"
+        keyboard = await asyncio.to_thread(get_countries_keyboard)
+        _edit_text(bot, query, text="Please select a country:", reply_markup=keyboard)
+        return
+
+    if data == "back_to_gift_cards":
+        if "country" not in conversation.selections:
+            OUTBOX.send_message(bot, chat_id=user_id, text=EXPIRED_MENU_MESSAGE)
+            return
+        conversation.state = "gift_card_selection"
+        country = conversation.selections.get("country", "")
+        keyboard = await asyncio.to_thread(get_gift_cards_keyboard, country)
+        _edit_text(bot, query, text=f"Choose a gift card for {country}:", reply_markup=keyboard)
+        return
+
+    if data == "back_to_denominations":
+        if "gift_card" not in conversation.selections:
+            OUTBOX.send_message(bot, chat_id=user_id, text=EXPIRED_MENU_MESSAGE)
+            return
+        conversation.state = "denomination_selection"
+        country = conversation.selections.get("country", "")
+        gift_card = conversation.selections.get("gift_card", "")
+        keyboard = await asyncio.to_thread(get_denominations_keyboard, country, gift_card)
+        _edit_text(bot, query, text=f"Choose a denomination for {gift_card}:", reply_markup=keyboard)
+        return
+
+    if data == "back_to_crypto":
+        if "denomination" not in conversation.selections:
+            OUTBOX.send_message(bot, chat_id=user_id, text=EXPIRED_MENU_MESSAGE)
+            return
+        conversation.state = "crypto_selection"
+        text = f"You selected {conversation.selections.get('denomination', '')}. Now choose a cryptocurrency for payment:"
+        if query.message and query.message.photo:
+            # A photo (QR code) can't become a text message, so replace it
+            _delete_message(bot, query)
+            OUTBOX.send_message(bot, chat_id=query.message.chat_id, text=text, reply_markup=get_crypto_keyboard())
+        else:
+            _edit_text(bot, query, text=text, reply_markup=get_crypto_keyboard())
+        return
+
+    # Catalog steps
+    if conversation.state == "country_selection":
+        conversation.selections["country"] = data
+        conversation.state = "gift_card_selection"
+        keyboard = await asyncio.to_thread(get_gift_cards_keyboard, data)
+        _edit_text(bot, query, text=f"You selected {data}. Now choose a gift card:", reply_markup=keyboard)
+
+    elif conversation.state == "gift_card_selection":
+        conversation.selections["gift_card"] = data
+        conversation.state = "denomination_selection"
+        keyboard = await asyncio.to_thread(get_denominations_keyboard, conversation.selections["country"], data)
+        _edit_text(bot, query, text=f"You selected {data}. Now choose a denomination:", reply_markup=keyboard)
+
+    elif conversation.state == "denomination_selection":
+        conversation.selections["denomination"] = data
+        conversation.state = "crypto_selection"
+        _edit_text(
+            bot, query,
+            text=f"You selected {data}. Now choose a cryptocurrency for payment:",
+            reply_markup=get_crypto_keyboard()
+        )
+
+    # Payment
+    elif conversation.state == "crypto_selection":
+        payment_text = await asyncio.to_thread(_start_invoice, user_id, conversation, data)
+        _edit_text(
+            bot, query,
+            text=payment_text,
+            reply_markup=get_check_payment_keyboard(show_qr=False),
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    elif conversation.state == "payment" and data in ("show_qr_code", "hide_qr_code"):
+        show_qr = conversation.show_qr = data == "show_qr_code"
+        qr_code_text = conversation.selections.get("qr_code_text", "")
+        order = await asyncio.to_thread(get_order, conversation.selections["order_id"])
+        if not order:
+            _edit_text(
+                bot, query, text="Error: Order not found. Please start again with /start", parse_mode=ParseMode.MARKDOWN
+            )
+            return
+
+        payment_text = _unpaid_receipt_text(order)
+        if show_qr and qr_code_text:
+            _delete_message(bot, query)
+            await send_qr_invoice(qr_code_text, payment_text, show_qr)
+        elif query.message.photo:
+            _delete_message(bot, query)
+            OUTBOX.send_message(
+                bot,
+                chat_id=user_id,
+                text=payment_text,
+                reply_markup=get_check_payment_keyboard(show_qr=show_qr),
+                parse_mode=ParseMode.MARKDOWN
+            )
+        else:
+            _edit_text(
+                bot, query,
+                text=payment_text,
+                reply_markup=get_check_payment_keyboard(show_qr=show_qr),
+                parse_mode=ParseMode.MARKDOWN
+            )
+
+    elif conversation.state == "payment" and data == "check_payment":
+        order_id = conversation.selections["order_id"]
+
+        # This check shows its own outcome; a push left from the last check would repeat it
+        SETTLEMENT_EVENTS.unsubscribe(order_id, user_id)
+        payment_status = await asyncio.to_thread(check_payment_cached, order_id)
+
+        if _payment_is_confirmed(payment_status):
+            gift_card_code = await asyncio.to_thread(_confirmed_gift_card_code, order_id, payment_status)
+            success_text = _payment_confirmed_text(order_id, conversation.selections, gift_card_code)
+            if conversation.show_qr and query.message and query.message.photo:
+                _delete_message(bot, query)
+                OUTBOX.send_message(bot, chat_id=user_id, text=success_text, parse_mode=ParseMode.MARKDOWN)
+            else:
+                _edit_text(bot, query, text=success_text, parse_mode=ParseMode.MARKDOWN)
+            conversation.clear()
+
+        elif isinstance(payment_status, dict) and payment_status.get("status") == "pending":
+            _edit_text(
+                bot, query,
+                text=_pending_payment_text(order_id, conversation.selections, payment_status),
+                parse_mode=ParseMode.MARKDOWN,
+                reply_markup=get_check_payment_keyboard(show_qr=False)
+            )
+            push_settlement(query.message, order_id)
+
+        else:
+            show_qr = conversation.show_qr if conversation.show_qr is not None else True
+            order = await asyncio.to_thread(get_order, order_id)
+            payment_text, qr_code_text = _awaiting_payment_text(order_id, order, conversation.selections, show_qr)
+            if show_qr and query.message and query.message.photo:
+                _edit_caption(
+                    bot, query,
+                    caption=payment_text,
+                    reply_markup=get_check_payment_keyboard(show_qr=True),
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                push_settlement(query.message, order_id)
+            elif show_qr:
+                if query.message:
+                    _delete_message(bot, query)
+                invoice_sent = await send_qr_invoice(qr_code_text, payment_text, True)
+
+                # Listen for the settlement once the new invoice message exists
+                def on_invoice_sent(sent):
+                    if not sent.exception():
+                        push_settlement(sent.result(), order_id)
+                invoice_sent.add_done_callback(on_invoice_sent)
+            else:
+                _edit_text(
+                    bot, query,
+                    text=payment_text,
+                    reply_markup=get_check_payment_keyboard(show_qr=False),
+                    parse_mode=ParseMode.MARKDOWN
+                )
+                push_settlement(query.message, order_id)
+
+    # Nothing in progress: the conversation expired or was started in another session
+    elif conversation.state is None:
+        OUTBOX.send_message(bot, chat_id=user_id, text=EXPIRED_MENU_MESSAGE)
+
+
+async def text_message(update, context):
+    """Async reply to plain text: point the user at the commands."""
+    from constants import TEXT_REPLY_MESSAGE
+
+    OUTBOX.send_message(_outbox_bot(context), chat_id=update.message.chat_id, text=TEXT_REPLY_MESSAGE)
+
+
+async def _size_io_threads(application):
+    """Give asyncio.to_thread ASYNC_IO_THREADS threads, since payment checks can hold one for seconds."""
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_IO_THREADS, thread_name_prefix="async-io")
+    )
+
+
+def create_application():
+    """Create the async Application with the same handlers as bot.create_bot."""
+    global _lanes
+    _require_async_ptb()
+    from telegram.ext import ApplicationBuilder, CommandHandler, CallbackQueryHandler, MessageHandler, filters
+    from admin_handlers import admin_command, admin_button_callback
+    from tx_ledger import load_processed_transactions
+
+    application = ApplicationBuilder().token(os.getenv("TELEGRAM_BOT_TOKEN")).concurrent_updates(
+        ASYNC_CONCURRENT_UPDATES
+    ).post_init(_size_io_threads).build()
+
+    _lanes = UserLanes("async", ASYNC_HANDLER_THREADS, UPDATE_LANE_DEPTH)
+
+    application.add_handler(CommandHandler("start", in_user_order(start_command)))
+    application.add_handler(CommandHandler("language", in_user_order(language_command)))
+    application.add_handler(CommandHandler("history", in_user_order(history_command)))
+    application.add_handler(CommandHandler("help", in_user_order(help_command)))
+    application.add_handler(CommandHandler("admin", in_user_order(bridge(admin_command))))
+
+    application.add_handler(CallbackQueryHandler(in_user_order(button_callback), pattern="^(?!admin_).*"))
+    application.add_handler(CallbackQueryHandler(in_user_order(bridge(admin_button_callback), acknowledge=False), pattern="^admin_.*"))
+
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, in_user_order(text_message)))
+
+    load_processed_transactions()
+    return application
+
+
+def run_application(application):
+    """Poll for updates until interrupted. Webhook mode is served by the threaded runtime only."""
+    check_deployment()
+    logger.info(f"Starting async bot ({ASYNC_CONCURRENT_UPDATES} concurrent updates)...")
+    application.run_polling()
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+One-off script to seed the processed-transaction ledger from existing settlements
+
+Orders settled before the ledger existed have their transaction only on the
+crypto_payments row. Run this once after deploying the ledger so those
+transactions can't settle another order, and so reconcile.py sees them as
+claimed.
+"""
+import logging
+from data_manager import backfill_processed_transactions
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+def main():
+    """Run the ledger backfill."""
+    added = backfill_processed_transactions()
+    if added is None:
+        logger.error("Ledger backfill failed")
+    else:
+        logger.info(f"Added {added} historical transactions to the ledger")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Benchmark the payment QR renderers
+
+Compares utils.generate_qr_code_image (qrcode + Pillow, RGB PNG) with
+qr_render (direct 1-bit palette PNG): time per render on one thread, PNG
+size, and throughput when several handler threads render at once, inline
+and through the qr_render process pool.
+
+Usage: python benchmark_qr.py [--iterations N] [--threads T]
+"""
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from utils import generate_qr_code_image
+from qr_render import render_qr_png, render_qr
+from config import QR_RENDER_PROCESSES
+
+# A typical invoice payload; the amount varies so no run reuses another's work
+ADDRESS = "bc1qxy2kgdygjrsqtzq2n0yrf2493p83kkfjhx0wlh"
+
+
+def payload(i):
+    return f"{ADDRESS}?amount=0.{i:08d}"
+
+
+def pillow_png(data):
+    return generate_qr_code_image(data).getvalue()
+
+
+def time_serial(render, iterations):
+    """Seconds per render on one thread, and the last PNG's size."""
+    started = time.perf_counter()
+    for i in range(iterations):
+        png = render(payload(i))
+    return (time.perf_counter() - started) / iterations, len(png)
+
+
+def time_threaded(render, iterations, threads):
+    """Renders per second with `threads` callers at once."""
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(render, (payload(i) for i in range(iterations))))
+    return iterations / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the payment QR renderers")
+    parser.add_argument("--iterations", type=int, default=200, help="renders per measurement")
+    parser.add_argument("--threads", type=int, default=8, help="concurrent callers for the throughput runs")
+    args = parser.parse_args()
+
+    # Start the pool before timing so worker start-up isn't measured
+    render_qr(payload(0))
+
+    print(f"{args.iterations} renders per measurement\n")
+    print(f"{'renderer':<32}{'ms/render':>10}{'PNG bytes':>11}")
+    for name, render in [("pillow (generate_qr_code_image)", pillow_png), ("1-bit (render_qr_png)", render_qr_png)]:
+        seconds, size = time_serial(render, args.iterations)
+        print(f"{name:<32}{seconds * 1000:>10.2f}{size:>11}")
+
+    print(f"\n{'renderer, ' + str(args.threads) + ' threads':<32}{'renders/s':>10}")
+    runs = [("pillow, inline", pillow_png), ("1-bit, inline", render_qr_png)]
+    if QR_RENDER_PROCESSES > 0:
+        runs.append((f"1-bit, {QR_RENDER_PROCESSES}-process pool", render_qr))
+    for name, render in runs:
+        print(f"{name:<32}{time_threaded(render, args.iterations, args.threads):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -26,6 +26,10 @@ from admin_handlers import (
     admin_command,
     admin_button_callback
 )
+from tx_ledger import load_processed_transactions
+from webhook import webhook_enabled, set_webhook
+from lanes import install_user_lanes
+from config import UPDATE_LANES, UPDATE_LANE_DEPTH, PAYMENT_LANES, PAYMENT_LANE_DEPTH
 
 # Create data directory if it doesn't exist
 Path("data").mkdir(exist_ok=True)
@@ -60,10 +64,24 @@ def create_bot():
     # Add message handler for text messages
     dispatcher.add_handler(MessageHandler(Filters.text & ~Filters.command, handle_text))
     
+    # Keep each user's updates in order while different users are handled in parallel,
+    # with slow payment taps in their own pool so browsing isn't stuck behind them
+    install_user_lanes(dispatcher, UPDATE_LANES, UPDATE_LANE_DEPTH, PAYMENT_LANES, PAYMENT_LANE_DEPTH)
+    
+    # Warm the settled-transaction prefilter so verifiers can skip known transactions
+    load_processed_transactions()
+    
     return updater
 
 def run_bot(updater):
     """Run the bot"""
+    if webhook_enabled():
+        # Updates reach the web app's webhook route; polling as well would fail with a conflict
+        logger.info("Webhook mode: updates are handled by the web app, not polled")
+        set_webhook(updater.bot)
+        updater.idle()
+        return
+    
     # Start the Bot
     logger.info("Starting bot...")
     updater.start_polling()
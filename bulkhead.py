@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-chain bulkheads: bounded thread pools that keep one slow explorer from starving the rest
+
+Explorer calls run on their chain's own small pool instead of the caller's
+thread. A chain can have at most max_workers calls running and max_queue
+waiting; further calls are rejected at once. Callers wait on the returned
+futures no longer than their deadline, so a hung provider can tie up its own
+pool, but the dispatcher threads it was called from get control back.
+
+Metrics (labelled with chain): bulkhead_calls and bulkhead_rejected counters,
+bulkhead_active and bulkhead_queued gauges, and a bulkhead_seconds summary of
+completed call durations.
+"""
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from config import BULKHEAD_MAX_WORKERS, BULKHEAD_MAX_QUEUE
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BulkheadFull(Exception):
+    """The chain already has max_workers calls running and max_queue waiting."""
+
+
+class Bulkhead:
+    """A bounded executor for the calls of one chain."""
+
+    def __init__(self, chain, max_workers=BULKHEAD_MAX_WORKERS, max_queue=BULKHEAD_MAX_QUEUE):
+        self.chain = chain
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"bulkhead-{chain}")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._active = 0
+
+    def _update_gauges(self):
+        metrics.set_gauge("bulkhead_active", self._active, chain=self.chain)
+        metrics.set_gauge("bulkhead_queued", self._pending - self._active, chain=self.chain)
+
+    def _run(self, func, args, kwargs):
+        with self._lock:
+            self._active += 1
+            self._update_gauges()
+        started = time.monotonic()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            metrics.observe("bulkhead_seconds", time.monotonic() - started, chain=self.chain)
+            with self._lock:
+                self._active -= 1
+                self._pending -= 1
+                self._update_gauges()
+            self._slots.release()
+
+    def submit(self, func, *args, **kwargs):
+        """
+        Queue func on this chain's pool, or raise BulkheadFull if the pool and its queue are full.
+
+        func runs in a copy of the caller's context, so the caller's deadline still applies.
+        """
+        if not self._slots.acquire(blocking=False):
+            metrics.increment("bulkhead_rejected", chain=self.chain)
+            raise BulkheadFull(f"{self.chain} bulkhead is full")
+        with self._lock:
+            self._pending += 1
+            self._update_gauges()
+        metrics.increment("bulkhead_calls", chain=self.chain)
+        return self._executor.submit(contextvars.copy_context().run, self._run, func, args, kwargs)
+
+
+_bulkheads = {}
+_bulkheads_lock = threading.Lock()
+
+
+def get_bulkhead(chain):
+    """Get the shared bulkhead for a chain, creating it on first use."""
+    with _bulkheads_lock:
+        bulkhead = _bulkheads.get(chain)
+        if bulkhead is None:
+            bulkhead = _bulkheads[chain] = Bulkhead(chain)
+        return bulkhead
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fast acknowledgement of callback queries
+
+Telegram shows a spinner on a pressed button until its callback query is
+answered, and a query can only be answered once. The dispatcher acknowledges
+each callback as soon as it's admitted, before the handler is queued on its
+lane, with the toast registered for its data (e.g. "Checking payment
+status..."). The handlers then do the slow work on their lane and deliver the
+outcome by editing the message.
+
+Answers are sent from a small thread pool so a slow answer never holds up
+the dispatcher; the async runtime awaits acknowledge_async() on its event loop
+instead. Either only answers a query the first time it is called for it, so
+handlers can call them unconditionally.
+
+Metrics: callback_ack_seconds summary (admission to answered) and a
+callback_ack_errors counter.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import ADMIN_USER_ID, CRYPTOCURRENCIES, CALLBACK_ACK_THREADS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Toasts shown while the work behind a button runs
+CALLBACK_TOASTS = {
+    "check_payment": "🔄 Checking payment status... This invoice updates by itself once your payment confirms.",
+    "show_qr_code": "Generating QR code...",
+}
+INVOICE_TOAST = "🧾 Creating your invoice..."
+UNAUTHORIZED_TOAST = "You are not authorized to use the admin panel."
+
+# Recently acknowledged query IDs kept to make acknowledge() idempotent
+MAX_REMEMBERED = 10000
+
+_executor = ThreadPoolExecutor(max_workers=CALLBACK_ACK_THREADS, thread_name_prefix="callback-ack")
+_lock = threading.Lock()
+_answered = OrderedDict()
+
+
+def callback_toast(update):
+    """The toast to acknowledge an update's callback query with, or None for a silent answer."""
+    query = update.callback_query
+    data = query.data or ""
+    if data.startswith("admin_") and update.effective_user.id != ADMIN_USER_ID:
+        return UNAUTHORIZED_TOAST
+    if data in CRYPTOCURRENCIES:
+        return INVOICE_TOAST
+    return CALLBACK_TOASTS.get(data)
+
+
+def acknowledge(update, text=None):
+    """
+    Answer the update's callback query unless it was already answered.
+
+    Args:
+        text (str): Toast to show instead of the one registered for the callback data.
+
+    Returns:
+        bool: True if this call sent the answer.
+    """
+    query = getattr(update, "callback_query", None)
+    if not query or not _claim(query):
+        return False
+    if text is None:
+        text = callback_toast(update)
+    _executor.submit(_answer, query, text, time.monotonic())
+    return True
+
+
+async def acknowledge_async(update, text=None):
+    """acknowledge() for the async runtime: the answer is awaited on the event loop instead of sent from the pool."""
+    query = getattr(update, "callback_query", None)
+    if not query or not _claim(query):
+        return False
+    if text is None:
+        text = callback_toast(update)
+    acknowledged_at = time.monotonic()
+    try:
+        await query.answer(text)
+        metrics.observe("callback_ack_seconds", time.monotonic() - acknowledged_at)
+    except Exception as e:
+        metrics.increment("callback_ack_errors")
+        logger.warning(f"Could not answer callback query {query.id}: {e}")
+    return True
+
+
+def _claim(query):
+    """Record that query is being answered. Returns False if it already was."""
+    with _lock:
+        if query.id in _answered:
+            return False
+        _answered[query.id] = True
+        while len(_answered) > MAX_REMEMBERED:
+            _answered.popitem(last=False)
+    return True
+
+
+def _answer(query, text, acknowledged_at):
+    try:
+        query.answer(text)
+        metrics.observe("callback_ack_seconds", time.monotonic() - acknowledged_at)
+    except Exception as e:
+        metrics.increment("callback_ack_errors")
+        logger.warning(f"Could not answer callback query {query.id}: {e}")
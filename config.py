@@ -12,31 +12,88 @@ load_dotenv()
 # Bot configuration
 ADMIN_USER_ID = int(os.getenv("ADMIN_USER_ID", "0"))  # Admin Telegram ID
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
+BOT_RUNTIME = os.getenv("BOT_RUNTIME", "threaded")  # "threaded" (PTB 13 Updater) or "async" (PTB 20+ Application)
+ASYNC_CONCURRENT_UPDATES = int(os.getenv("ASYNC_CONCURRENT_UPDATES", "256"))  # Updates processed at once by the async runtime
+ASYNC_HANDLER_THREADS = int(os.getenv("ASYNC_HANDLER_THREADS", "32"))  # Per-user lanes (threads) for the admin handlers, which still block
+ASYNC_IO_THREADS = int(os.getenv("ASYNC_IO_THREADS", "32"))  # Threads for the database, explorer and QR calls of async handlers
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # Public base URL of the web app; set to receive updates by webhook instead of polling
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Echoed by Telegram in X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_PATH = "/telegram/webhook"  # Flask route Telegram posts updates to
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")  # Bearer token required by /api/metrics; unset keeps the route closed
+UPDATE_LANES = int(os.getenv("UPDATE_LANES", "8"))  # Per-user ordered worker lanes for catalog and UI updates (0 handles all updates one at a time)
+UPDATE_LANE_DEPTH = int(os.getenv("UPDATE_LANE_DEPTH", "100"))  # Updates queued per lane before more are shed
+PAYMENT_LANES = int(os.getenv("PAYMENT_LANES", "4"))  # Separate lanes for payment taps (0 shares the catalog lanes)
+PAYMENT_LANE_DEPTH = int(os.getenv("PAYMENT_LANE_DEPTH", "50"))  # Payment updates queued per lane before more are shed
+CATALOG_ADMISSION_LIMIT = int(os.getenv("CATALOG_ADMISSION_LIMIT", "400"))  # Catalog updates queued or running before new ones get "busy, retry"
+PAYMENT_ADMISSION_LIMIT = int(os.getenv("PAYMENT_ADMISSION_LIMIT", "100"))  # Payment updates queued or running before new ones get "busy, retry"
+LOW_PRIORITY_ADMISSION_LIMIT = int(os.getenv("LOW_PRIORITY_ADMISSION_LIMIT", "100"))  # Catalog load above which /history is shed
+OUTBOX_GLOBAL_RATE = 30  # Telegram calls per second across all chats
+OUTBOX_CHAT_RATE = 1.0  # Telegram calls per second to one chat, sustained
+OUTBOX_CHAT_BURST = 3  # Calls a chat may receive back to back before OUTBOX_CHAT_RATE applies
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "8"))  # Threads making outbound Telegram calls
+CALLBACK_ACK_THREADS = 4  # Threads answering callback queries as soon as they're admitted
+QR_CACHE_SIZE = int(os.getenv("QR_CACHE_SIZE", "1000"))  # Payment QR codes (PNG and Telegram file_id) kept in memory
+QR_RENDER_PROCESSES = int(os.getenv("QR_RENDER_PROCESSES", "2"))  # Worker processes rendering QR codes (0 renders on the handler thread)
+QR_RENDER_TIMEOUT = 5  # seconds to wait for the render pool before rendering inline
+QR_BOX_SIZE = 8  # Pixels per QR module
+QR_BORDER = 4  # Light modules around the QR code
 
 # Payment configuration
 PAYMENT_CHECK_INTERVAL = 60  # seconds
+PAYMENT_CHECK_CACHE_TTL = float(os.getenv("PAYMENT_CHECK_CACHE_TTL", "10"))  # seconds a check_payment result is reused
+PAYMENT_WATCHER_ENABLED = os.getenv("PAYMENT_WATCHER_ENABLED", "true").lower() == "true"  # Background sweeps of pending orders
+ADDRESS_BATCH_SIZE = int(os.getenv("ADDRESS_BATCH_SIZE", "20"))  # Addresses per batched explorer request
+EXPLORER_TIMEOUT = 30  # seconds
+PAYMENT_TIME_GRACE = int(os.getenv("PAYMENT_TIME_GRACE", "7200"))  # Seconds a transfer's block time may precede its order (block timestamps can lag)
 PAYMENT_CONFIRMATIONS_REQUIRED = 1  # Minimum confirmations needed to consider payment successful
+ADDRESS_RESERVATION_ATTEMPTS = 5  # Retries when concurrent invoices race for the same derivation index
+ADDRESS_GAP_LIMIT = 20  # BIP44 gap limit: wallets stop scanning after this many unused addresses in a row
+ADDRESS_REUSE_HOURS = int(os.getenv("ADDRESS_REUSE_HOURS", "24"))  # Unpaid invoices older than this give up their derived address
+PAYMENT_JOB_VISIBILITY_TIMEOUT = 120  # seconds a claimed job stays invisible to other workers
+PAYMENT_JOB_MAX_ATTEMPTS = 5  # Failed runs before a job is dead-lettered
+PAYMENT_JOB_MAX_AGE_HOURS = 24  # Stop polling orders that stay unpaid this long
+PAYMENT_WORKER_CONCURRENCY = int(os.getenv("PAYMENT_WORKER_CONCURRENCY", "4"))  # Job queue worker threads per process (0 disables)
+SETTLEMENT_WAIT_SECONDS = int(os.getenv("SETTLEMENT_WAIT_SECONDS", "600"))  # How long a checked invoice keeps listening for its settlement
+UPDATE_DEADLINE = 10  # seconds a bot update may spend before falling back to cached or default values
+PRICE_API_TIMEOUT = 5  # seconds
+BULKHEAD_MAX_WORKERS = int(os.getenv("BULKHEAD_MAX_WORKERS", "4"))  # Concurrent explorer calls per chain
+BULKHEAD_MAX_QUEUE = int(os.getenv("BULKHEAD_MAX_QUEUE", "16"))  # Explorer calls allowed to wait per chain before rejecting
+BULKHEAD_TIMEOUT = 20  # seconds a payment check waits for the explorers on its chain's bulkhead
+HEDGE_DELAY_DEFAULT = 2.0  # seconds before hedging to the next provider when there's no latency history yet
+HEDGE_DELAY_MIN = 0.25  # Lower bound on the p95-based hedge delay
+PROVIDER_STATS_WINDOW = 100  # Recent calls per provider kept for latency and error stats
+LEADER_RENEW_INTERVAL = 10  # seconds between leader lease checks and standby retries
+PROCESSED_TX_CACHE_SIZE = int(os.getenv("PROCESSED_TX_CACHE_SIZE", "100000"))  # Settled tx hashes kept in memory
+CONVERSATION_BACKEND = os.getenv("CONVERSATION_BACKEND", "memory")  # "memory", or "database" when several bot processes share users
+CONVERSATION_CACHE_SIZE = int(os.getenv("CONVERSATION_CACHE_SIZE", "10000"))  # Conversations kept in memory per process
+CONVERSATION_TTL = int(os.getenv("CONVERSATION_TTL", "86400"))  # seconds an idle conversation is kept
+CONVERSATION_PURGE_INTERVAL = 3600  # seconds between deletions of expired conversation rows
 
 # Available cryptocurrencies for payment
+# Setting <CRYPTO>_XPUB derives a fresh receiving address per order instead of reusing "address"
 CRYPTOCURRENCIES = {
     "BTC": {
         "name": "Bitcoin",
         "address": os.getenv("BTC_ADDRESS", ""),
+        "xpub": os.getenv("BTC_XPUB", ""),
         "explorer_api": "https://blockchain.info/rawaddr/"
     },
     "ETH": {
         "name": "Ethereum",
         "address": os.getenv("ETH_ADDRESS", ""),
+        "xpub": os.getenv("ETH_XPUB", ""),
         "explorer_api": "https://api.etherscan.io/api?module=account&action=txlist&address="
     },
     "USDT": {
         "name": "Tether (USDT)",
         "address": os.getenv("USDT_ADDRESS", ""),
+        "xpub": os.getenv("USDT_XPUB", ""),
         "explorer_api": "https://api.etherscan.io/api?module=account&action=tokentx&address="
     },
     "BNB": {
         "name": "Binance Coin",
         "address": os.getenv("BNB_ADDRESS", ""),
+        "xpub": os.getenv("BNB_XPUB", ""),
         "explorer_api": "https://api.bscscan.com/api?module=account&action=txlist&address="
     },
     "SOL": {
@@ -52,6 +109,7 @@ CRYPTOCURRENCIES = {
     "USDC": {
         "name": "USD Coin",
         "address": os.getenv("USDC_ADDRESS", ""),
+        "xpub": os.getenv("USDC_XPUB", ""),
         "explorer_api": "https://api.etherscan.io/api?module=account&action=tokentx&address="
     },
     "ADA": {
@@ -62,21 +120,25 @@ CRYPTOCURRENCIES = {
     "DOGE": {
         "name": "Dogecoin",
         "address": os.getenv("DOGE_ADDRESS", ""),
+        "xpub": os.getenv("DOGE_XPUB", ""),
         "explorer_api": "https://dogechain.info/api/v1/address/"
     },
     "TRX": {
         "name": "Tron",
         "address": os.getenv("TRX_ADDRESS", ""),
+        "xpub": os.getenv("TRX_XPUB", ""),
         "explorer_api": "https://apilist.tronscan.org/api/account?address="
     },
     "LTC": {
         "name": "Litecoin",
         "address": os.getenv("LTC_ADDRESS", ""),
+        "xpub": os.getenv("LTC_XPUB", ""),
         "explorer_api": "https://api.blockcypher.com/v1/ltc/main/addrs/"
     },
     "BCH": {
         "name": "Bitcoin Cash",
         "address": os.getenv("BCH_ADDRESS", ""),
+        "xpub": os.getenv("BCH_XPUB", ""),
         "explorer_api": "https://rest.bitcoin.com/v2/address/details/"
     },
     "TON": {
@@ -86,6 +148,40 @@ CRYPTOCURRENCIES = {
     }
 }
 
+# JSON-RPC endpoints for EVM log scanning (any Ethereum-compatible node or a local stand-in)
+EVM_RPC_URLS = {
+    "ETH": os.getenv("ETH_RPC_URL", ""),
+    "BSC": os.getenv("BSC_RPC_URL", "")
+}
+EVM_LOG_WINDOW = int(os.getenv("EVM_LOG_WINDOW", "2000"))  # Blocks per eth_getLogs call
+
+# Explorer providers per chain in order of preference; override with e.g. BTC_EXPLORER_PROVIDERS=mempool.space,blockchain.info
+_DEFAULT_EXPLORER_PROVIDERS = {
+    "BTC": "blockchain.info,mempool.space,blockstream.info",
+    "LTC": "blockcypher,litecoinspace",
+    "DOGE": "blockcypher,dogechain",
+    "BCH": "bitcoin.com",
+    "ETH": "etherscan",
+    "USDT": "etherscan",
+    "USDC": "etherscan",
+    "BNB": "bscscan",
+    "SOL": "solscan",
+    "XRP": "xrpscan",
+    "ADA": "cardanoscan",
+    "TRX": "tronscan",
+    "TON": "toncenter"
+}
+EXPLORER_PROVIDERS = {
+    crypto: [name.strip() for name in os.getenv(f"{crypto}_EXPLORER_PROVIDERS", default).split(",") if name.strip()]
+    for crypto, default in _DEFAULT_EXPLORER_PROVIDERS.items()
+}
+
+# Token contracts whose Transfer events settle orders, keyed by the order's crypto code
+EVM_TOKEN_CONTRACTS = {
+    "USDT": {"chain": "ETH", "contract": "0xdac17f958d2ee523a2206206994597c13d831ec7", "decimals": 6},
+    "USDC": {"chain": "ETH", "contract": "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48", "decimals": 6}
+}
+
 # Default language
 DEFAULT_LANGUAGE = "en"
 
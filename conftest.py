@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Shared test setup: point the app at a throwaway SQLite database
+"""
+import os
+import tempfile
+import pytest
+
+# Must happen before app is imported; never let tests touch DATABASE_URL from .env
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="giftcard-tests-"), "test.db")
+
+
+@pytest.fixture
+def database():
+    """An empty schema for each test."""
+    from app import app
+    from models import db
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield db
+    with app.app_context():
+        db.session.remove()
@@ -82,3 +82,9 @@ We haven't received your payment yet. Please send the exact amount to the provid
 
 If you've already sent the payment, please wait for network confirmations and try again.
 """
+
+# Reply to plain text messages
+TEXT_REPLY_MESSAGE = "Please use the /start command to begin shopping for gift cards or /help for assistance."
+
+# Reply to a button press whose conversation was lost or expired
+EXPIRED_MENU_MESSAGE = "This menu has expired. Please use /start to begin again."
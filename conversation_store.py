@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Conversation state store: where each user is in the purchase flow
+
+Conversations live in a bounded in-memory LRU whose entries expire after
+CONVERSATION_TTL seconds idle; loading or saving one counts as activity.
+With CONVERSATION_BACKEND=database every load reads the user's row from the
+conversation_states table and every change is written through, so any bot
+process (polling, webhook workers or replicas) can serve the user's next
+update and nothing is lost on restart; the memory copy then only stands in
+while the database can't be read.
+
+Handlers load a Conversation once per update, change it, and save it once.
+A conversation with no state and no selections is deleted rather than stored.
+"""
+import time
+import logging
+import threading
+from collections import OrderedDict
+from config import CONVERSATION_BACKEND, CONVERSATION_CACHE_SIZE, CONVERSATION_TTL, CONVERSATION_PURGE_INTERVAL
+from data_manager import load_conversation, save_conversation, delete_conversation, purge_conversations
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Conversation:
+    """One user's place in the purchase flow."""
+
+    __slots__ = ("user_id", "state", "selections", "show_qr", "_saved")
+
+    def __init__(self, user_id, state=None, selections=None, show_qr=None):
+        self.user_id = user_id
+        self.state = state  # country_selection, gift_card_selection, ..., payment; None when idle
+        self.selections = selections if selections is not None else {}
+        self.show_qr = show_qr  # Whether the invoice shows its QR code; None until the user chooses
+        self._saved = self.to_record()
+
+    def to_record(self):
+        """Compact JSON-able form that leaves out unset fields."""
+        record = {}
+        if self.state:
+            record["s"] = self.state
+        if self.selections:
+            record["c"] = dict(self.selections)
+        if self.show_qr is not None:
+            record["q"] = self.show_qr
+        return record
+
+    @classmethod
+    def from_record(cls, user_id, record):
+        record = record or {}
+        return cls(user_id, record.get("s"), dict(record.get("c", {})), record.get("q"))
+
+    def changed(self):
+        return self.to_record() != self._saved
+
+    def clear(self):
+        """End the conversation; saving it then deletes it."""
+        self.state = None
+        self.selections = {}
+        self.show_qr = None
+
+
+class ConversationStore:
+    """LRU and TTL bounded conversations with optional database backing."""
+
+    def __init__(self, max_size, ttl, backend="memory"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self._entries = OrderedDict()  # user_id -> (record, expires_at)
+        self._lock = threading.Lock()
+        self._next_purge = 0
+
+    def _cached(self, user_id, now):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            record, expires_at = entry
+            if expires_at <= now:
+                del self._entries[user_id]
+                metrics.increment("conversation_evictions", reason="expired")
+                return None
+            # Being read counts as activity, so an active conversation doesn't expire between saves
+            self._entries[user_id] = (record, now + self.ttl)
+            self._entries.move_to_end(user_id)
+            return record
+
+    def _remember(self, user_id, record, now):
+        with self._lock:
+            if record:
+                self._entries[user_id] = (record, now + self.ttl)
+                self._entries.move_to_end(user_id)
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+                    metrics.increment("conversation_evictions", reason="size")
+            else:
+                self._entries.pop(user_id, None)
+            metrics.set_gauge("conversation_cache_size", len(self._entries))
+
+    def load(self, user_id):
+        """The user's current conversation, or a new idle one."""
+        now = time.monotonic()
+        record = None
+        if self.backend == "database":
+            try:
+                record = load_conversation(user_id, self.ttl)
+                self._remember(user_id, record, now)
+            except Exception as e:
+                logger.error(f"Error loading conversation of user {user_id}, using the local copy: {e}")
+                record = self._cached(user_id, now)
+        else:
+            record = self._cached(user_id, now)
+        metrics.increment("conversation_loads", found="yes" if record else "no")
+        return Conversation.from_record(user_id, record)
+
+    def save(self, conversation):
+        """Store the conversation if it changed since it was loaded or last saved."""
+        if not conversation.changed():
+            return
+        now = time.monotonic()
+        record = conversation.to_record()
+        self._remember(conversation.user_id, record, now)
+        if self.backend == "database":
+            if record:
+                save_conversation(conversation.user_id, record)
+            else:
+                delete_conversation(conversation.user_id)
+        conversation._saved = record
+        self._purge_expired(now)
+
+    def reset(self, user_id, state=None):
+        """Start the user over with no selections, saved right away."""
+        conversation = self.load(user_id)
+        conversation.clear()
+        conversation.state = state
+        self.save(conversation)
+        return conversation
+
+    def evict_expired(self):
+        """Drop expired entries from memory. Returns how many were dropped."""
+        now = time.monotonic()
+        with self._lock:
+            expired = [user_id for user_id, (_, expires_at) in self._entries.items() if expires_at <= now]
+            for user_id in expired:
+                del self._entries[user_id]
+            metrics.set_gauge("conversation_cache_size", len(self._entries))
+        if expired:
+            metrics.increment("conversation_evictions", len(expired), reason="expired")
+        return len(expired)
+
+    def _purge_expired(self, now):
+        """Now and then, delete expired rows and memory entries."""
+        if now < self._next_purge:
+            return
+        self._next_purge = now + CONVERSATION_PURGE_INTERVAL
+        self.evict_expired()
+        if self.backend == "database":
+            deleted = purge_conversations(self.ttl)
+            if deleted:
+                logger.info(f"Deleted {deleted} expired conversations")
+
+    def __len__(self):
+        return len(self._entries)
+
+
+CONVERSATIONS = ConversationStore(CONVERSATION_CACHE_SIZE, CONVERSATION_TTL, CONVERSATION_BACKEND)
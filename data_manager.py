@@ -9,7 +9,8 @@ import logging
 import uuid
 import datetime
 from flask import current_app
-from models import db, Country, GiftCard, Denomination, Order, User, CryptoPayment
+from sqlalchemy.exc import IntegrityError
+from models import db, Country, GiftCard, Denomination, Order, User, CryptoPayment, ProcessedTransaction, PaymentAddress, ChainCursor, ConversationState
 from app import app
 from config import DISCOUNT_PERCENTAGE
 
@@ -387,6 +388,35 @@ def get_order(order_id):
         logger.error(f"Error getting order: {e}")
         return None
 
+def _payment_status_dict(order, payment):
+    """Build the payment status dict returned by get_payment_status and settle_payment."""
+    result = {
+        "order_id": order.order_id,
+        "status": order.status,
+        "crypto": order.crypto,
+        "amount": order.crypto_amount,
+        "address": order.payment_address,
+        "created_at": order.created_at.isoformat() if order.created_at else None,
+        "updated_at": order.updated_at.isoformat() if order.updated_at else None,
+    }
+    
+    # Add payment details if available
+    if payment:
+        result.update({
+            "transaction_id": payment.transaction_id,
+            "confirmations": payment.confirmations,
+            "payment_status": payment.status,
+            "confirmed_at": payment.confirmed_at.isoformat() if payment.confirmed_at else None
+        })
+    else:
+        result.update({
+            "transaction_id": None,
+            "confirmations": 0,
+            "payment_status": "pending",
+            "confirmed_at": None
+        })
+    return result
+
 def get_payment_status(order_id):
     """
     Get detailed payment status for an order.
@@ -405,37 +435,101 @@ def get_payment_status(order_id):
                 
             # Get payment information if it exists
             payment = CryptoPayment.query.filter_by(order_id=order_id).first()
+            return _payment_status_dict(order, payment)
             
-            result = {
-                "order_id": order_id,
-                "status": order.status,
-                "crypto": order.crypto,
-                "amount": order.crypto_amount,
-                "address": order.payment_address,
-                "created_at": order.created_at.isoformat() if order.created_at else None,
-                "updated_at": order.updated_at.isoformat() if order.updated_at else None,
-            }
+    except Exception as e:
+        logger.error(f"Error getting payment status for order {order_id}: {e}")
+        return None
+
+def settle_payment(order_id, tx, gift_card_code=None):
+    """
+    Record a payment transaction for an order and, once it is confirmed, complete
+    the order, all in one database transaction.
+    
+    The order row is locked (SELECT ... FOR UPDATE) so concurrent checks of the
+    same order serialize. The transaction is claimed in the processed-transaction
+    ledger in the same database transaction, as soon as it is recorded, even while
+    it is still pending: a mempool transaction then shows as detected on one
+    order only, and the order can't be completed without its ledger entry.
+    
+    Args:
+        order_id (str): The order ID.
+        tx (dict): transaction_id, confirmations and status ("pending" or "confirmed").
+        gift_card_code (str): Code to store on the order when it completes.
+    
+    Only pending orders are changed; for any other order the current status is
+    returned as it is.
+    
+    Returns:
+        dict or bool or None: The final payment status (as get_payment_status returns it),
+                              False if the transaction is already claimed by another order,
+                              None if the order doesn't exist or on error.
+    """
+    try:
+        with app.app_context():
+            order = Order.query.filter_by(order_id=order_id).with_for_update().first()
+            if not order:
+                db.session.rollback()
+                logger.error(f"Order {order_id} not found.")
+                return None
             
-            # Add payment details if available
-            if payment:
-                result.update({
-                    "transaction_id": payment.transaction_id,
-                    "confirmations": payment.confirmations,
-                    "payment_status": payment.status,
-                    "confirmed_at": payment.confirmed_at.isoformat() if payment.confirmed_at else None
-                })
-            else:
-                result.update({
-                    "transaction_id": None,
-                    "confirmations": 0,
-                    "payment_status": "pending",
-                    "confirmed_at": None
-                })
-                
-            return result
+            payment = CryptoPayment.query.filter_by(order_id=order_id).first()
+            if order.status != "pending":
+                # Already settled, or cancelled: don't overwrite its payment or reopen it
+                result = _payment_status_dict(order, payment)
+                db.session.rollback()
+                return result
+            
+            now = datetime.datetime.utcnow()
+            confirmed = tx.get("status") == "confirmed"
             
+            owner = ProcessedTransaction.query.filter_by(chain=order.crypto, tx_hash=tx["transaction_id"]).first()
+            if owner and owner.order_id != order_id:
+                db.session.rollback()
+                logger.warning(f"{order.crypto} transaction {tx['transaction_id']} is already claimed by order {owner.order_id}")
+                return False
+            if not owner:
+                db.session.add(ProcessedTransaction(chain=order.crypto, tx_hash=tx["transaction_id"], order_id=order_id))
+            
+            if confirmed:
+                order.status = "completed"
+                if gift_card_code:
+                    order.gift_card_code = gift_card_code
+                order.updated_at = now
+            
+            if not payment:
+                payment = CryptoPayment(
+                    order_id=order_id,
+                    crypto=order.crypto,
+                    amount=order.crypto_amount,
+                    status="pending"
+                )
+                db.session.add(payment)
+            
+            payment.transaction_id = tx["transaction_id"]
+            payment.confirmations = tx.get("confirmations", 0)
+            if confirmed:
+                payment.status = "confirmed"
+                if not payment.confirmed_at:
+                    payment.confirmed_at = now
+            
+            # Build the result before committing; committing expires the loaded rows
+            result = _payment_status_dict(order, payment)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another process claimed the transaction between our check and insert
+                db.session.rollback()
+                logger.warning(f"{result['crypto']} transaction {tx['transaction_id']} was claimed concurrently")
+                return False
+            return result
     except Exception as e:
-        logger.error(f"Error getting payment status for order {order_id}: {e}")
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error settling payment for order {order_id}: {e}")
         return None
 
 def get_user_orders(user_id):
@@ -458,6 +552,19 @@ def get_all_orders():
         logger.error(f"Error getting all orders: {e}")
         return []
 
+def get_pending_orders(crypto=None):
+    """Get all orders still awaiting payment, oldest first, optionally for one cryptocurrency."""
+    try:
+        with app.app_context():
+            query = Order.query.filter_by(status="pending")
+            if crypto:
+                query = query.filter_by(crypto=crypto)
+            orders = query.order_by(Order.created_at.asc()).all()
+            return [order.to_dict() for order in orders]
+    except Exception as e:
+        logger.error(f"Error getting pending orders: {e}")
+        return []
+
 def save_crypto_payment(order_id, tx_data):
     """
     Save or update a cryptocurrency payment transaction.
@@ -508,6 +615,324 @@ def save_crypto_payment(order_id, tx_data):
         logger.error(f"Error saving crypto payment: {e}")
         return False
 
+def get_processed_transactions(limit=None):
+    """
+    Get the most recently recorded settlement transactions.
+    
+    Args:
+        limit (int): Maximum number of rows to return (newest first), or None for all.
+    
+    Returns:
+        list: (chain, tx_hash, order_id) tuples, newest first.
+    """
+    try:
+        with app.app_context():
+            query = db.session.query(
+                ProcessedTransaction.chain,
+                ProcessedTransaction.tx_hash,
+                ProcessedTransaction.order_id
+            ).order_by(ProcessedTransaction.id.desc())
+            if limit:
+                query = query.limit(limit)
+            return [tuple(row) for row in query.all()]
+    except Exception as e:
+        logger.error(f"Error loading processed transactions: {e}")
+        return []
+
+def backfill_processed_transactions():
+    """
+    Add ledger rows for settlements recorded before the ledger existed.
+    
+    Every transaction id on a confirmed payment row or a completed order's payment
+    row that the ledger doesn't know yet is recorded against its order, so it can
+    never settle a second order. Safe to run more than once.
+    
+    Returns:
+        int or None: Number of rows added, or None on error.
+    """
+    try:
+        with app.app_context():
+            rows = db.session.query(Order.crypto, CryptoPayment.transaction_id, Order.order_id).join(
+                CryptoPayment, CryptoPayment.order_id == Order.order_id
+            ).outerjoin(
+                ProcessedTransaction,
+                (ProcessedTransaction.chain == Order.crypto) & (ProcessedTransaction.tx_hash == CryptoPayment.transaction_id)
+            ).filter(
+                CryptoPayment.transaction_id.isnot(None),
+                CryptoPayment.transaction_id != "",
+                (CryptoPayment.status == "confirmed") | (Order.status == "completed"),
+                ProcessedTransaction.id.is_(None)
+            ).order_by(CryptoPayment.id.asc()).all()
+            
+            added = {}
+            for chain, tx_hash, order_id in rows:
+                if (chain, tx_hash) in added:
+                    # Double settlement from before the ledger; reconcile.py reports it
+                    logger.warning(f"{chain} transaction {tx_hash} is recorded for orders {added[(chain, tx_hash)]} and {order_id}")
+                    continue
+                added[(chain, tx_hash)] = order_id
+                db.session.add(ProcessedTransaction(chain=chain, tx_hash=tx_hash, order_id=order_id))
+            db.session.commit()
+            return len(added)
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error backfilling processed transactions: {e}")
+        return None
+
+def load_conversation(user_id, max_age):
+    """
+    Load a user's stored conversation record.
+    
+    Loading a record more than half of max_age old refreshes its timestamp, so a
+    conversation that is read but not changed doesn't expire while in use, at
+    the cost of at most one write per half max_age.
+    
+    Args:
+        user_id (int): The user's Telegram ID.
+        max_age (int): Seconds since the last update after which the record counts as expired.
+    
+    Returns:
+        dict or None: The record, None if there is none or it expired.
+    
+    Raises:
+        Exception: The database could not be read, so callers can tell errors from missing records.
+    """
+    with app.app_context():
+        row = db.session.get(ConversationState, user_id)
+        if not row:
+            return None
+        now = datetime.datetime.utcnow()
+        if row.updated_at and row.updated_at < now - datetime.timedelta(seconds=max_age):
+            return None
+        if not row.updated_at or row.updated_at < now - datetime.timedelta(seconds=max_age / 2):
+            row.updated_at = now
+            data = row.data
+            db.session.commit()
+            return data
+        return row.data
+
+def save_conversation(user_id, record):
+    """Store a user's conversation record, replacing any earlier one. Returns True on success."""
+    try:
+        with app.app_context():
+            row = db.session.get(ConversationState, user_id)
+            if row:
+                row.data = record
+                row.updated_at = datetime.datetime.utcnow()
+                db.session.commit()
+                return True
+            
+            db.session.add(ConversationState(user_id=user_id, data=record))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another process stored this user's first record between our check and insert
+                db.session.rollback()
+                row = db.session.get(ConversationState, user_id)
+                row.data = record
+                row.updated_at = datetime.datetime.utcnow()
+                db.session.commit()
+            return True
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error saving conversation of user {user_id}: {e}")
+        return False
+
+def delete_conversation(user_id):
+    """Delete a user's conversation record. Returns True on success."""
+    try:
+        with app.app_context():
+            ConversationState.query.filter_by(user_id=user_id).delete()
+            db.session.commit()
+            return True
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error deleting conversation of user {user_id}: {e}")
+        return False
+
+def purge_conversations(max_age):
+    """Delete conversation records not updated for max_age seconds. Returns how many were deleted."""
+    try:
+        with app.app_context():
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=max_age)
+            deleted = ConversationState.query.filter(ConversationState.updated_at < cutoff).delete()
+            db.session.commit()
+            return deleted
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error purging expired conversations: {e}")
+        return 0
+
+def get_next_derivation_index(xpub_id):
+    """Get the next unused address index for an xpub (0 if none have been reserved)."""
+    try:
+        with app.app_context():
+            highest = db.session.query(db.func.max(PaymentAddress.derivation_index)).filter_by(xpub_id=xpub_id).scalar()
+            return 0 if highest is None else highest + 1
+    except Exception as e:
+        logger.error(f"Error getting next derivation index: {e}")
+        return None
+
+def get_last_paid_derivation_index(xpub_id):
+    """Get the highest address index of an xpub whose order was paid, or -1 if none was."""
+    try:
+        with app.app_context():
+            highest = db.session.query(db.func.max(PaymentAddress.derivation_index)).join(
+                Order, Order.order_id == PaymentAddress.order_id
+            ).filter(PaymentAddress.xpub_id == xpub_id, Order.status == "completed").scalar()
+            return -1 if highest is None else highest
+    except Exception as e:
+        logger.error(f"Error getting last paid derivation index: {e}")
+        return None
+
+def reuse_payment_address(crypto, xpub_id, order_id, max_age_hours):
+    """
+    Hand a derived address that was never paid over to a new order.
+    
+    An address qualifies when its order was cancelled, is still pending after
+    max_age_hours, or was never saved, and no transaction was ever claimed for
+    it. A pending order giving up its address is cancelled in the same
+    transaction, so a late payment can't settle it as well. Reusing addresses
+    keeps abandoned invoices from opening a gap of unused addresses that the
+    wallet would stop scanning at.
+    
+    Returns:
+        tuple or None: (address, derivation_index) now reserved for order_id, or None if none qualifies.
+    """
+    try:
+        with app.app_context():
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(hours=max_age_hours)
+            claimed = db.session.query(ProcessedTransaction.id).filter(
+                ProcessedTransaction.order_id == PaymentAddress.order_id
+            ).exists()
+            row = PaymentAddress.query.outerjoin(Order, Order.order_id == PaymentAddress.order_id).filter(
+                PaymentAddress.crypto == crypto,
+                PaymentAddress.xpub_id == xpub_id,
+                PaymentAddress.created_at < cutoff,
+                (Order.status == "cancelled") | (Order.status == "pending") | Order.id.is_(None),
+                ~claimed
+            ).order_by(PaymentAddress.derivation_index.asc()).with_for_update(skip_locked=True).first()
+            if not row:
+                db.session.rollback()
+                return None
+            
+            previous = Order.query.filter_by(order_id=row.order_id).with_for_update().first()
+            if previous and previous.status == "pending":
+                previous.status = "cancelled"
+                previous.updated_at = datetime.datetime.utcnow()
+            
+            result = (row.address, row.derivation_index)
+            logger.info(f"Reusing {crypto} address index {row.derivation_index} of order {row.order_id} for order {order_id}")
+            row.order_id = order_id
+            row.created_at = datetime.datetime.utcnow()
+            db.session.commit()
+            return result
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error reusing a {crypto} payment address: {e}")
+        return None
+
+def save_payment_address(crypto, address, xpub_id, derivation_index, order_id):
+    """
+    Reserve a derived address for an order.
+    
+    Returns:
+        bool: True if reserved, False if the index or address was already taken
+              (e.g. by a concurrent invoice) or on error.
+    """
+    try:
+        with app.app_context():
+            db.session.add(PaymentAddress(
+                crypto=crypto,
+                address=address,
+                xpub_id=xpub_id,
+                derivation_index=derivation_index,
+                order_id=order_id
+            ))
+            db.session.commit()
+            return True
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.warning(f"Could not reserve {crypto} address index {derivation_index}: {e}")
+        return False
+
+def get_order_id_for_address(crypto, address):
+    """Look up the order a derived payment address belongs to, or None."""
+    try:
+        with app.app_context():
+            row = PaymentAddress.query.filter_by(crypto=crypto, address=address).first()
+            return row.order_id if row else None
+    except Exception as e:
+        logger.error(f"Error looking up order for {crypto} address {address}: {e}")
+        return None
+
+def get_address_owners(crypto, addresses):
+    """Map each of the given addresses that is reserved for an order to that order's ID."""
+    try:
+        with app.app_context():
+            rows = db.session.query(PaymentAddress.address, PaymentAddress.order_id).filter(
+                PaymentAddress.crypto == crypto,
+                PaymentAddress.address.in_(list(set(addresses)))
+            ).all()
+            return {address: order_id for address, order_id in rows}
+    except Exception as e:
+        logger.error(f"Error looking up orders for {crypto} addresses: {e}")
+        return {}
+
+def get_chain_cursor(chain):
+    """Get the last block scanned on a chain, or None if it has never been scanned."""
+    try:
+        with app.app_context():
+            cursor = db.session.get(ChainCursor, chain)
+            return cursor.last_block if cursor else None
+    except Exception as e:
+        logger.error(f"Error getting {chain} scan cursor: {e}")
+        return None
+
+def save_chain_cursor(chain, last_block):
+    """Store the last block scanned on a chain."""
+    try:
+        with app.app_context():
+            cursor = db.session.get(ChainCursor, chain)
+            if cursor:
+                cursor.last_block = last_block
+            else:
+                db.session.add(ChainCursor(chain=chain, last_block=last_block))
+            db.session.commit()
+            return True
+    except Exception as e:
+        try:
+            with app.app_context():
+                db.session.rollback()
+        except:
+            pass
+        logger.error(f"Error saving {chain} scan cursor: {e}")
+        return False
+
 def update_order_status(order_id, status, gift_card_code=None):
     """Update the status of an order."""
     try:
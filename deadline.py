@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-update deadlines carried in a context variable
+
+A handler sets a time budget with `with deadline(seconds):` (or the
+@with_deadline decorator) and everything it calls can ask how much of it is
+left: HTTP calls use request_timeout() instead of a fixed value, the database gets a
+matching statement_timeout, and loops call check_deadline() between steps.
+Work that would run past the deadline raises DeadlineExceeded so callers can
+fall back to cached or default values.
+
+Context variables don't follow work handed to a thread pool on their own;
+submit through copy_context().run (as the bulkheads do) to keep the deadline.
+"""
+import time
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+import metrics
+
+logger = logging.getLogger(__name__)
+
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The current update's time budget is used up."""
+
+
+@contextmanager
+def deadline(seconds):
+    """Limit the enclosed work to seconds, or to the enclosing deadline if that is sooner."""
+    expires_at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(expires_at if current is None else min(current, expires_at))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(seconds):
+    """Decorator running a handler under deadline(seconds)."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with deadline(seconds):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def remaining():
+    """Seconds left before the current deadline, or None when there is none."""
+    expires_at = _deadline.get()
+    if expires_at is None:
+        return None
+    return expires_at - time.monotonic()
+
+
+def check_deadline():
+    """Raise DeadlineExceeded if the current deadline has passed."""
+    left = remaining()
+    if left is not None and left <= 0:
+        metrics.increment("deadline_exceeded")
+        raise DeadlineExceeded("Deadline exceeded")
+
+
+def request_timeout(default):
+    """A timeout in seconds for the next blocking call: default, capped by what's left of the deadline."""
+    check_deadline()
+    left = remaining()
+    return default if left is None else min(default, left)
+
+
+def install_statement_timeout(engine):
+    """
+    Give each PostgreSQL transaction run under a deadline a matching statement_timeout.
+
+    The timeout is set once, before the transaction's first statement, from
+    what is left of the deadline then; later statements only check that the
+    deadline hasn't passed, without another round trip. SET LOCAL only lasts
+    until the end of the transaction, so transactions run without a deadline
+    keep the server default.
+    """
+    from sqlalchemy import event
+
+    if engine.dialect.name != "postgresql":
+        return
+
+    @event.listens_for(engine, "begin")
+    def reset_statement_timeout(conn):
+        conn.info.pop("statement_timeout_set", None)
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def set_statement_timeout(conn, cursor, statement, parameters, context, executemany):
+        left = remaining()
+        if left is None:
+            return
+        if left <= 0:
+            metrics.increment("deadline_exceeded")
+            raise DeadlineExceeded("Deadline exceeded before database statement")
+        if not conn.info.get("statement_timeout_set"):
+            cursor.execute(f"SET LOCAL statement_timeout = {max(1, int(left * 1000))}")
+            conn.info["statement_timeout_set"] = True
@@ -0,0 +1,786 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Block explorer clients returning normalized incoming transfers
+
+Every fetcher returns a list of transfer dicts with the same shape, whatever
+explorer it talks to:
+
+    {"tx_hash": str, "address": str, "amount": float, "confirmations": int, "time": float or None}
+
+where amount is in whole coins and confirmations is 0 for mempool transactions.
+time is the block (or first-seen) time in Unix seconds, None when the explorer
+doesn't report one. Explorers that only list settled transactions and don't
+count confirmations add "final": True instead.
+
+Explorers that return history a page at a time are paged back to `since`
+(Unix seconds; None pages through the whole history), so transfers aren't
+missed just because newer ones filled the first page.
+
+Single-address lookups (ADDRESS_PROVIDERS) are generators that fetch the next
+page only once the caller has read the previous one, so a payment check that
+stops at its match skips the rest. The batch fetchers build full lists and are
+meant for the watcher's sweeps and reconcile.
+"""
+import os
+import logging
+import datetime
+import requests
+from functools import partial
+from config import (
+    ADDRESS_BATCH_SIZE, EXPLORER_TIMEOUT, EVM_RPC_URLS, EVM_TOKEN_CONTRACTS, EXPLORER_PROVIDERS, PAYMENT_TIME_GRACE
+)
+from json_stream import iter_json_array
+from deadline import request_timeout
+
+logger = logging.getLogger(__name__)
+
+
+class ExplorerError(Exception):
+    """An explorer answered with an error status or an error payload."""
+
+# UTXO chains that support querying many addresses in one request
+UTXO_BATCH_CHAINS = ["BTC", "LTC", "DOGE", "BCH"]
+
+# keccak256("Transfer(address,address,uint256)"), topic0 of ERC-20/BEP-20 transfers
+TRANSFER_EVENT_TOPIC = "0xddf252ad1be2c89b69c2b068fc378daa952ba7f163c4a11628f55a4df523b3ef"
+
+# Transactions per page of the paged history endpoints
+MULTIADDR_PAGE_SIZE = 100   # blockchain.info multiaddr maximum
+BLOCKCYPHER_PAGE_SIZE = 50  # BlockCypher txrefs per address
+ESPLORA_PAGE_SIZE = 25      # Confirmed transactions per Esplora page
+
+# Hard per-request address limits of the batch endpoints
+_BATCH_LIMITS = {
+    "BTC": 100,   # blockchain.info multiaddr
+    "LTC": 100,   # BlockCypher batch
+    "DOGE": 100,  # BlockCypher batch
+    "BCH": 20,    # rest.bitcoin.com bulk endpoints
+}
+
+
+def chunk_addresses(crypto, addresses, batch_size=ADDRESS_BATCH_SIZE):
+    """Split addresses into request-sized chunks for a chain's batch endpoint."""
+    size = max(1, min(batch_size, _BATCH_LIMITS.get(crypto, batch_size)))
+    addresses = list(dict.fromkeys(addresses))  # De-duplicate, keep order
+    return [addresses[i:i + size] for i in range(0, len(addresses), size)]
+
+
+def _add_transfer(transfers, tx_hash, address, amount, confirmations, time=None):
+    """Merge outputs of the same transaction to the same address into one transfer."""
+    key = (tx_hash, address)
+    if key in transfers:
+        transfers[key]["amount"] += amount
+    else:
+        transfers[key] = {
+            "tx_hash": tx_hash,
+            "address": address,
+            "amount": amount,
+            "confirmations": confirmations,
+            "time": time,
+        }
+
+
+def _timestamp(value, scale=1):
+    """Unix seconds from an explorer's numeric (in 1/scale seconds) or ISO 8601 time, or None."""
+    if value in (None, ""):
+        return None
+    try:
+        return float(value) / scale
+    except (TypeError, ValueError):
+        pass
+    try:
+        parsed = datetime.datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed.timestamp()
+
+
+def unix_time(created_at):
+    """Unix seconds of an order's created_at (naive UTC datetime, or ISO 8601 as in Order.to_dict)."""
+    if isinstance(created_at, str):
+        created_at = datetime.datetime.fromisoformat(created_at)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    return created_at.timestamp()
+
+
+def sent_after(transfer, created_at, grace=PAYMENT_TIME_GRACE):
+    """
+    Whether a transfer can be the payment for an order created at created_at.
+
+    A payment can only be sent once its invoice exists, so transfers from before
+    the order (less grace for block timestamps that lag real time) are history
+    at the address, not payments for it. A transfer without a time counts as new
+    only while it is unconfirmed, i.e. seen in the mempool now.
+
+    Args:
+        created_at (datetime or str): The order's creation time (naive UTC, or ISO 8601 as in Order.to_dict)
+    """
+    if not created_at:
+        return False
+    sent = transfer.get("time")
+    if sent is None:
+        return not transfer.get("final") and not transfer.get("confirmations")
+    return sent >= unix_time(created_at) - grace
+
+
+def _reached(times, since):
+    """Whether a page with these transaction times goes back to since, so no older page is needed."""
+    return since is not None and any(time is not None and time < since for time in times)
+
+
+def get_btc_block_height():
+    """Get the current Bitcoin chain tip from blockchain.info."""
+    response = requests.get("https://blockchain.info/q/getblockcount", timeout=request_timeout(EXPLORER_TIMEOUT))
+    response.raise_for_status()
+    return int(response.text)
+
+
+def _fetch_btc_batch(addresses, since=None):
+    """Query blockchain.info multiaddr for up to 100 addresses at once, paging back to since."""
+    wanted = set(addresses)
+    found = {}
+    heights = {}
+    tip = None
+    offset = 0
+    while True:
+        response = requests.get(
+            "https://blockchain.info/multiaddr",
+            params={"active": "|".join(addresses), "n": MULTIADDR_PAGE_SIZE, "offset": offset},
+            timeout=request_timeout(EXPLORER_TIMEOUT),
+            stream=True
+        )
+        if response.status_code != 200:
+            response.close()
+            logger.error(f"Error from blockchain.info multiaddr API: {response.status_code}")
+            return None
+
+        header = {}
+        times = []
+        for tx in iter_json_array(response, "txs", header):
+            times.append(_timestamp(tx.get("time")))
+            for output in tx.get("out", []):
+                if output.get("addr") in wanted:
+                    _add_transfer(found, tx.get("hash", ""), output["addr"], float(output.get("value", 0)) / 1e8, 0,
+                                  times[-1])
+                    heights[tx.get("hash", "")] = tx.get("block_height")
+        if tip is None:
+            tip = header.get("info", {}).get("latest_block", {}).get("height")
+
+        # Transactions come newest first across all the addresses
+        if len(times) < MULTIADDR_PAGE_SIZE or _reached(times, since):
+            break
+        offset += len(times)
+
+    # multiaddr reports heights rather than confirmations
+    if tip is None and any(heights.values()):
+        tip = get_btc_block_height()
+
+    for transfer in found.values():
+        height = heights.get(transfer["tx_hash"])
+        if height and tip:
+            transfer["confirmations"] = tip - height + 1
+    return list(found.values())
+
+
+def _fetch_blockcypher_page(coin, addresses, before=None):
+    params = {"limit": BLOCKCYPHER_PAGE_SIZE}
+    if before is not None:
+        params["before"] = before
+    response = requests.get(
+        f"https://api.blockcypher.com/v1/{coin}/main/addrs/{';'.join(addresses)}",
+        params=params,
+        timeout=request_timeout(EXPLORER_TIMEOUT)
+    )
+    if response.status_code != 200:
+        logger.error(f"Error from BlockCypher batch API: {response.status_code}")
+        return None
+
+    data = response.json()
+    # A single address comes back as an object rather than a one-element list
+    return [data] if isinstance(data, dict) else data
+
+
+def _blockcypher_refs(found, address, entry, seen, tx_heights):
+    """Add one page of a BlockCypher address entry to found. Returns the page's block heights and times."""
+    heights = []
+    times = []
+    for tx in entry.get("txrefs", []) + entry.get("unconfirmed_txrefs", []):
+        key = (tx.get("tx_hash", ""), tx.get("tx_input_n", -1), tx.get("tx_output_n", -1))
+        if key in seen:
+            continue
+        seen.add(key)
+        times.append(_timestamp(tx.get("confirmed") or tx.get("received")))
+        if tx.get("block_height", -1) >= 0:
+            heights.append(tx["block_height"])
+        # Negative output indexes are spends from the address, not payments to it
+        if tx.get("tx_output_n", -1) >= 0:
+            _add_transfer(found, tx.get("tx_hash", ""), address, float(tx.get("value", 0)) / 1e8,
+                          int(tx.get("confirmations", 0)), times[-1])
+            tx_heights[tx.get("tx_hash", "")] = tx.get("block_height", -1)
+    return heights, times
+
+
+def _fetch_blockcypher_batch(crypto, addresses, since=None):
+    """Query BlockCypher's batch address endpoint (LTC, DOGE), paging each address with more history back to since."""
+    coin = crypto.lower()
+    entries = _fetch_blockcypher_page(coin, addresses)
+    if entries is None:
+        return None
+
+    found = {}
+    for entry in entries:
+        address = entry.get("address")
+        seen = set()
+        while True:
+            heights, times = _blockcypher_refs(found, address, entry, seen, {})
+
+            # A page of only already-seen refs means no progress is possible
+            if not entry.get("hasMore") or not heights or _reached(times, since):
+                break
+            # "before" is exclusive; asking up to the lowest block again picks up the rest of a block
+            # split across pages, and the refs already seen are skipped
+            before = min(heights) + 1
+            page = _fetch_blockcypher_page(coin, [address], before)
+            if not page:
+                logger.error(f"Stopped paging {crypto} history of {address} at block {before}")
+                return None
+            entry = page[0]
+    return list(found.values())
+
+
+def _bch_outputs(found, address, entry):
+    """Add one page of a bitcoin.com history entry to found. Returns the page's transaction times."""
+    names = {address, entry.get("legacyAddress"), entry.get("cashAddress")} - {None}
+    times = []
+    for tx in entry.get("txs", []):
+        times.append(_timestamp(tx.get("blocktime") or tx.get("time")))
+        for output in tx.get("vout", []):
+            if names & set(output.get("scriptPubKey", {}).get("addresses", [])):
+                _add_transfer(found, tx.get("txid", ""), address, float(output.get("value", 0)),
+                              int(tx.get("confirmations", 0)), times[-1])
+    return times
+
+
+def _fetch_bch_batch(addresses, since=None):
+    """
+    Query rest.bitcoin.com's bulk transaction history endpoint for up to 20 addresses at once.
+
+    The history includes outputs that were spent since, unlike the UTXO
+    endpoint, so a payment the wallet has moved on is still found. Addresses
+    with more than one page of history are paged one at a time back to since.
+    """
+    response = requests.post(
+        "https://rest.bitcoin.com/v2/address/transactions",
+        json={"addresses": addresses},
+        timeout=request_timeout(EXPLORER_TIMEOUT)
+    )
+    if response.status_code != 200:
+        logger.error(f"Error from Bitcoin.com bulk API: {response.status_code}")
+        return None
+
+    found = {}
+    # Results come back in request order; outputs may name the address in legacy or CashAddr format
+    for address, entry in zip(addresses, response.json()):
+        times = _bch_outputs(found, address, entry)
+        for page in range(1, int(entry.get("pagesTotal") or 1)):
+            if _reached(times, since):
+                break
+            page_response = requests.get(
+                f"https://rest.bitcoin.com/v2/address/transactions/{address}",
+                params={"page": page},
+                timeout=request_timeout(EXPLORER_TIMEOUT)
+            )
+            if page_response.status_code != 200:
+                logger.error(f"Error from Bitcoin.com address API: {page_response.status_code}")
+                return None
+            times = _bch_outputs(found, address, page_response.json())
+    return list(found.values())
+
+
+def _fetch_utxo_chunk(crypto, addresses, since=None):
+    """Fetch one request-sized chunk of addresses from the chain's batch endpoint."""
+    if crypto == "BTC":
+        return _fetch_btc_batch(addresses, since)
+    if crypto in ("LTC", "DOGE"):
+        return _fetch_blockcypher_batch(crypto, addresses, since)
+    if crypto == "BCH":
+        return _fetch_bch_batch(addresses, since)
+    raise ValueError(f"Batched address queries are not supported for {crypto}")
+
+
+def fetch_utxo_transfers_batch(crypto, addresses, since=None):
+    """
+    Fetch incoming transfers for many addresses of one UTXO chain, one request per chunk.
+
+    Args:
+        crypto (str): One of UTXO_BATCH_CHAINS
+        addresses (list): Receiving addresses to query
+        since (float): Unix time to page the history back to, or None for all of it
+
+    Returns:
+        list: Normalized transfers. Chunks whose request failed are logged and skipped.
+    """
+    if crypto not in UTXO_BATCH_CHAINS:
+        logger.error(f"Batched address queries are not supported for {crypto}")
+        return []
+
+    transfers = []
+    for chunk in chunk_addresses(crypto, addresses):
+        try:
+            result = _fetch_utxo_chunk(crypto, chunk, since)
+        except Exception as e:
+            logger.error(f"Error fetching batched {crypto} transfers: {e}")
+            result = None
+
+        if result:
+            transfers.extend(result)
+    return transfers
+
+
+def _evm_rpc(chain, method, params):
+    """Make a JSON-RPC call to the configured node for an EVM chain."""
+    url = EVM_RPC_URLS.get(chain)
+    if not url:
+        raise ValueError(f"No JSON-RPC endpoint configured for {chain}")
+
+    response = requests.post(
+        url,
+        json={"jsonrpc": "2.0", "id": 1, "method": method, "params": params},
+        timeout=request_timeout(EXPLORER_TIMEOUT)
+    )
+    response.raise_for_status()
+    data = response.json()
+    if data.get("error"):
+        raise RuntimeError(f"{chain} {method} error: {data['error'].get('message')}")
+    return data["result"]
+
+
+def get_evm_block_number(chain):
+    """Get the current chain tip of an EVM chain."""
+    return int(_evm_rpc(chain, "eth_blockNumber", []), 16)
+
+
+def _address_topic(address):
+    """Left-pad a 20-byte address into a 32-byte log topic."""
+    return "0x" + "0" * 24 + address.lower()[2:]
+
+
+def fetch_token_transfer_logs(chain, tokens, addresses, from_block, to_block, tip):
+    """
+    Fetch ERC-20/BEP-20 Transfer events to any of our addresses in a block range with one eth_getLogs call.
+
+    Args:
+        chain (str): EVM chain key in EVM_RPC_URLS (ETH, BSC)
+        tokens (dict): Crypto code -> {"contract": address, "decimals": int} for tokens on this chain
+        addresses (list): Receiving addresses to filter on (the Transfer "to" topic)
+        from_block (int): First block of the window (inclusive)
+        to_block (int): Last block of the window (inclusive)
+        tip (int): Current chain tip, used to compute confirmations
+
+    Returns:
+        list: Normalized transfers, each with an extra "crypto" key naming the token
+    """
+    contracts = {token["contract"].lower(): (crypto, token["decimals"]) for crypto, token in tokens.items()}
+    logs = _evm_rpc(chain, "eth_getLogs", [{
+        "fromBlock": hex(from_block),
+        "toBlock": hex(to_block),
+        "address": list(contracts),
+        "topics": [TRANSFER_EVENT_TOPIC, None, [_address_topic(a) for a in dict.fromkeys(addresses)]]
+    }])
+
+    transfers = []
+    block_times = {}
+    for log in logs:
+        token = contracts.get(log.get("address", "").lower())
+        if not token or log.get("removed") or len(log.get("topics", [])) < 3:
+            continue
+        crypto, decimals = token
+        block = log["blockNumber"]
+        if block not in block_times:
+            # Newer nodes put the block time on the log; otherwise look the block up once
+            block_time = log.get("blockTimestamp") or _evm_rpc(chain, "eth_getBlockByNumber", [block, False])["timestamp"]
+            block_times[block] = int(block_time, 16)
+        transfers.append({
+            "crypto": crypto,
+            "tx_hash": log["transactionHash"],
+            "address": "0x" + log["topics"][2][-40:],
+            "amount": int(log["data"], 16) / 10 ** decimals,
+            "confirmations": tip - int(block, 16) + 1,
+            "time": block_times[block]
+        })
+    return transfers
+
+
+# Etherscan-compatible account APIs: crypto -> (API URL, API key variable, explorer name)
+_ETHERSCAN_APIS = {
+    "ETH": ("https://api.etherscan.io/api", "ETHERSCAN_API_KEY", "Etherscan"),
+    "USDT": ("https://api.etherscan.io/api", "ETHERSCAN_API_KEY", "Etherscan"),
+    "USDC": ("https://api.etherscan.io/api", "ETHERSCAN_API_KEY", "Etherscan"),
+    "BNB": ("https://api.bscscan.com/api", "BSCSCAN_API_KEY", "BscScan"),
+}
+
+
+def _iter_blockchain_info_transfers(address, since=None):
+    """
+    Incoming transfers to one BTC address from blockchain.info, decoded a transaction at a time.
+
+    Pages are only requested once the previous one has been read, back to
+    since, and the chain tip only once a confirmed payment to the address turns
+    up, so a caller that stops at its match saves the rest.
+    """
+    tip = None
+    offset = 0
+    while True:
+        response = requests.get(
+            "https://blockchain.info/multiaddr",
+            params={"active": address, "n": MULTIADDR_PAGE_SIZE, "offset": offset},
+            timeout=request_timeout(EXPLORER_TIMEOUT),
+            stream=True
+        )
+        if response.status_code != 200:
+            response.close()
+            raise ExplorerError(f"Error from blockchain.info multiaddr API: {response.status_code}")
+
+        times = []
+        try:
+            for tx in iter_json_array(response, "txs"):
+                times.append(_timestamp(tx.get("time")))
+                found = {}
+                for output in tx.get("out", []):
+                    if output.get("addr") == address:
+                        _add_transfer(found, tx.get("hash", ""), address, float(output.get("value", 0)) / 1e8, 0,
+                                      times[-1])
+                height = tx.get("block_height")
+                for transfer in found.values():
+                    # multiaddr reports heights rather than confirmations
+                    if height:
+                        if tip is None:
+                            tip = get_btc_block_height()
+                        transfer["confirmations"] = tip - height + 1
+                    yield transfer
+        finally:
+            response.close()
+
+        # Transactions come newest first
+        if len(times) < MULTIADDR_PAGE_SIZE or _reached(times, since):
+            return
+        offset += len(times)
+
+
+def _iter_blockcypher_transfers(crypto, address, since=None):
+    """
+    Incoming transfers to one LTC or DOGE address from BlockCypher, a page at a time back to since.
+
+    A transaction in a page's lowest block may have more outputs to the address
+    on the next page, so its transfer is held back until that page is read.
+    """
+    coin = crypto.lower()
+    found = {}
+    seen = set()
+    tx_heights = {}
+    yielded = set()
+    before = None
+    while True:
+        page = _fetch_blockcypher_page(coin, [address], before)
+        if page is None:
+            raise ExplorerError(f"{crypto} BlockCypher request failed")
+        entry = page[0] if page else {}
+        heights, times = _blockcypher_refs(found, address, entry, seen, tx_heights)
+
+        more = bool(entry.get("hasMore") and heights and not _reached(times, since))
+        boundary = min(heights) if more else None
+        for key, transfer in found.items():
+            if key in yielded or (boundary is not None and tx_heights.get(transfer["tx_hash"]) == boundary):
+                continue
+            yielded.add(key)
+            yield transfer
+        if not more:
+            return
+        # "before" is exclusive; asking up to the lowest block again picks up the rest of it
+        before = boundary + 1
+
+
+def _iter_bch_transfers(address, since=None):
+    """Incoming transfers to one BCH address from rest.bitcoin.com's history, a page at a time back to since."""
+    page = 0
+    pages = 1
+    while page < pages:
+        response = requests.get(
+            f"https://rest.bitcoin.com/v2/address/transactions/{address}",
+            params={"page": page},
+            timeout=request_timeout(EXPLORER_TIMEOUT)
+        )
+        if response.status_code != 200:
+            raise ExplorerError(f"Error from Bitcoin.com address API: {response.status_code}")
+        entry = response.json()
+        pages = int(entry.get("pagesTotal") or 1)
+
+        found = {}
+        times = _bch_outputs(found, address, entry)
+        yield from found.values()
+        if _reached(times, since):
+            return
+        page += 1
+
+
+def _iter_esplora_transfers(api_url, address, since=None):
+    """
+    Incoming transfers to a UTXO address from an Esplora API (mempool.space, blockstream.info, ...).
+
+    The first page holds the mempool and the newest confirmed transactions; older
+    confirmed ones are paged in lazily, after the last one seen, back to since.
+    """
+    url = f"{api_url}/address/{address}/txs"
+    tip = None
+    while True:
+        response = requests.get(url, timeout=request_timeout(EXPLORER_TIMEOUT))
+        if response.status_code != 200:
+            raise ExplorerError(f"Error from {api_url}: {response.status_code}")
+
+        found = {}
+        heights = {}
+        times = []
+        last_confirmed = None
+        confirmed = 0
+        for tx in response.json():
+            status = tx.get("status", {})
+            times.append(_timestamp(status.get("block_time")))
+            if status.get("confirmed"):
+                confirmed += 1
+                last_confirmed = tx.get("txid", "")
+            for output in tx.get("vout", []):
+                if output.get("scriptpubkey_address") == address:
+                    _add_transfer(found, tx.get("txid", ""), address, float(output.get("value", 0)) / 1e8, 0, times[-1])
+                    heights[tx.get("txid", "")] = status.get("block_height")
+
+        if tip is None and any(heights.values()):
+            tip_response = requests.get(f"{api_url}/blocks/tip/height", timeout=request_timeout(EXPLORER_TIMEOUT))
+            tip_response.raise_for_status()
+            tip = int(tip_response.text)
+        for transfer in found.values():
+            height = heights.get(transfer["tx_hash"])
+            if height:
+                transfer["confirmations"] = tip - height + 1
+        yield from found.values()
+
+        if confirmed < ESPLORA_PAGE_SIZE or _reached(times, since):
+            return
+        url = f"{api_url}/address/{address}/txs/chain/{last_confirmed}"
+
+
+def _iter_dogechain_transfers(address, since=None):
+    """Incoming DOGE transactions to an address from Dogechain."""
+    response = requests.get(f"https://dogechain.info/api/v1/address/transactions/{address}",
+                            timeout=request_timeout(EXPLORER_TIMEOUT))
+    if response.status_code != 200:
+        raise ExplorerError(f"Error from Dogechain API: {response.status_code}")
+
+    data = response.json()
+    if data.get("success") != 1:
+        raise ExplorerError(f"Dogechain API error: {data.get('error')}")
+
+    for tx in data.get("transactions", []):
+        if tx.get("direction") == "incoming":
+            yield {
+                "tx_hash": tx.get("hash", ""),
+                "address": address,
+                "amount": float(tx.get("value", 0)),
+                "confirmations": int(tx.get("confirmations", 0)),
+                "time": _timestamp(tx.get("time"))
+            }
+
+
+def _iter_etherscan_transfers(crypto, address, since=None):
+    """Stream native (txlist) or ERC-20 (tokentx) transfers to an address from an Etherscan-style API."""
+    api_url, key_variable, explorer = _ETHERSCAN_APIS[crypto]
+    token = EVM_TOKEN_CONTRACTS.get(crypto)
+    params = {
+        "module": "account",
+        "action": "tokentx" if token else "txlist",
+        "address": address,
+        "apikey": os.getenv(key_variable, "")
+    }
+    if token:
+        params["contractaddress"] = token["contract"]
+    decimals = token["decimals"] if token else 18
+
+    response = requests.get(api_url, params=params, timeout=request_timeout(EXPLORER_TIMEOUT), stream=True)
+    if response.status_code != 200:
+        response.close()
+        raise ExplorerError(f"Error from {explorer} API: {response.status_code}")
+
+    # "status" and "message" precede "result" in the body
+    header = {}
+    for tx in iter_json_array(response, "result", header):
+        if tx.get("to", "").lower() == address.lower():
+            yield {
+                "tx_hash": tx.get("hash", ""),
+                "address": address,
+                "amount": float(tx.get("value", 0)) / 10 ** decimals,
+                "confirmations": int(tx.get("confirmations", 0)),
+                "time": _timestamp(tx.get("timeStamp"))
+            }
+
+    if header.get("status") != "1" and header.get("message") != "No transactions found":
+        raise ExplorerError(f"{explorer} API error: {header.get('message')}")
+
+
+def _iter_sol_transfers(address, since=None):
+    """Successful SOL transfers to an address from Solscan."""
+    response = requests.get("https://api.solscan.io/account/transactions",
+                            params={"account": address}, timeout=request_timeout(EXPLORER_TIMEOUT))
+    if response.status_code != 200:
+        raise ExplorerError(f"Error from Solscan API: {response.status_code}")
+
+    for tx in response.json().get("data", []):
+        if tx.get("status") == "Success" and tx.get("type") == "SOL_TRANSFER" and tx.get("dstAddress") == address:
+            yield {
+                "tx_hash": tx.get("txHash", ""),
+                "address": address,
+                "amount": float(tx.get("lamport", 0)) / 1e9,  # Lamports to SOL
+                "confirmations": 1,
+                "time": _timestamp(tx.get("blockTime")),
+                "final": True
+            }
+
+
+def _iter_xrp_transfers(address, since=None):
+    """Successful XRP payments to an address from XRPScan."""
+    response = requests.get(f"https://api.xrpscan.com/api/v1/account/{address}/transactions",
+                            timeout=request_timeout(EXPLORER_TIMEOUT))
+    if response.status_code != 200:
+        raise ExplorerError(f"Error from XRP API: {response.status_code}")
+
+    for tx in response.json():
+        if tx.get("type") == "Payment" and tx.get("status") == "tesSUCCESS" and tx.get("Destination") == address:
+            yield {
+                "tx_hash": tx.get("hash", ""),
+                "address": address,
+                "amount": float(tx.get("Amount", 0)) / 1e6,  # Drops to XRP
+                "confirmations": 1,
+                "time": _timestamp(tx.get("date")),
+                "final": True
+            }
+
+
+def _iter_ada_transfers(address, since=None):
+    """ADA outputs to an address from Cardanoscan."""
+    response = requests.get(f"https://cardanoscan.io/api/transaction/{address}", timeout=request_timeout(EXPLORER_TIMEOUT))
+    if response.status_code != 200:
+        raise ExplorerError(f"Error from Cardanoscan API: {response.status_code}")
+
+    for tx in response.json().get("transactions", []):
+        for output in tx.get("outputs", []):
+            if output.get("address") == address:
+                yield {
+                    "tx_hash": tx.get("hash", ""),
+                    "address": address,
+                    "amount": float(output.get("value", 0)) / 1e6,  # Lovelace to ADA
+                    "confirmations": 1,
+                    "time": _timestamp(tx.get("timestamp")),
+                    "final": True
+                }
+
+
+def _iter_trx_transfers(address, since=None):
+    """Incoming TRX transfers to an address from Tronscan; unconfirmed ones have 0 confirmations."""
+    response = requests.get("https://apilist.tronscan.org/api/transaction",
+                            params={"address": address, "direction": "in"}, timeout=request_timeout(EXPLORER_TIMEOUT))
+    if response.status_code != 200:
+        raise ExplorerError(f"Error from Tronscan API: {response.status_code}")
+
+    for tx in response.json().get("data", []):
+        if tx.get("toAddress") == address:
+            yield {
+                "tx_hash": tx.get("hash", ""),
+                "address": address,
+                "amount": float(tx.get("amount", 0)) / 1e6,  # Sun to TRX
+                "confirmations": 1 if tx.get("confirmed") else 0,
+                "time": _timestamp(tx.get("timestamp"), 1000),  # Milliseconds
+                "final": bool(tx.get("confirmed"))
+            }
+
+
+def _iter_ton_transfers(address, since=None):
+    """Incoming TON messages to an address from Toncenter."""
+    api_key = os.getenv("TONCENTER_API_KEY", "")
+    response = requests.get("https://toncenter.com/api/v2/getTransactions",
+                            params={"address": address, "limit": 10},
+                            headers={"X-API-Key": api_key} if api_key else {},
+                            timeout=request_timeout(EXPLORER_TIMEOUT))
+    if response.status_code != 200:
+        raise ExplorerError(f"Error from Toncenter API: {response.status_code}")
+
+    data = response.json()
+    if not data.get("ok", False):
+        raise ExplorerError(f"Toncenter API error: {data.get('error')}")
+
+    for tx in data.get("result", []):
+        in_msg = tx.get("in_msg", {})
+        if in_msg.get("destination") == address:
+            yield {
+                "tx_hash": tx.get("transaction_id", {}).get("hash", ""),
+                "address": address,
+                "amount": float(in_msg.get("value", 0)) / 1e9,  # Nanotons to TON
+                "confirmations": 1,
+                "time": _timestamp(tx.get("utime")),
+                "final": True
+            }
+
+
+# Single-address adapters per chain and provider name; config.EXPLORER_PROVIDERS picks and orders them.
+# Each takes (address, since); the ones over paged explorers page back to since
+ADDRESS_PROVIDERS = {
+    "BTC": {
+        "blockchain.info": _iter_blockchain_info_transfers,
+        "mempool.space": partial(_iter_esplora_transfers, "https://mempool.space/api"),
+        "blockstream.info": partial(_iter_esplora_transfers, "https://blockstream.info/api"),
+    },
+    "LTC": {
+        "blockcypher": partial(_iter_blockcypher_transfers, "LTC"),
+        "litecoinspace": partial(_iter_esplora_transfers, "https://litecoinspace.org/api"),
+    },
+    "DOGE": {
+        "blockcypher": partial(_iter_blockcypher_transfers, "DOGE"),
+        "dogechain": _iter_dogechain_transfers,
+    },
+    "BCH": {"bitcoin.com": _iter_bch_transfers},
+    "ETH": {"etherscan": partial(_iter_etherscan_transfers, "ETH")},
+    "USDT": {"etherscan": partial(_iter_etherscan_transfers, "USDT")},
+    "USDC": {"etherscan": partial(_iter_etherscan_transfers, "USDC")},
+    "BNB": {"bscscan": partial(_iter_etherscan_transfers, "BNB")},
+    "SOL": {"solscan": _iter_sol_transfers},
+    "XRP": {"xrpscan": _iter_xrp_transfers},
+    "ADA": {"cardanoscan": _iter_ada_transfers},
+    "TRX": {"tronscan": _iter_trx_transfers},
+    "TON": {"toncenter": _iter_ton_transfers},
+}
+
+
+def supports_address_lookup(crypto):
+    """Whether any explorer provider is known for this cryptocurrency."""
+    return bool(ADDRESS_PROVIDERS.get(crypto))
+
+
+def iter_address_transfers(crypto, address, provider=None, since=None):
+    """
+    Yield normalized incoming transfers to a single address, newest first where the explorer allows.
+
+    Uses the named provider, or the chain's first configured one. Streaming
+    explorers are decoded lazily, so a caller that stops at the first matching
+    transfer doesn't download the rest of the history. Paged explorers go back
+    to since (Unix seconds), or through the whole history when it is None.
+
+    Raises:
+        ExplorerError: The provider answered with an error.
+    """
+    providers = ADDRESS_PROVIDERS.get(crypto)
+    if not providers:
+        raise ValueError(f"No explorer configured for {crypto}")
+    if provider is None:
+        provider = next((name for name in EXPLORER_PROVIDERS.get(crypto, []) if name in providers), next(iter(providers)))
+    return providers[provider](address, since=since)
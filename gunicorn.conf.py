@@ -0,0 +1,11 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Gunicorn settings, loaded automatically from the working directory
+"""
+
+
+def on_starting(server):
+    """Refuse to start webhook workers that can't share users' conversations."""
+    from webhook import check_deployment
+    check_deployment(server.cfg.workers)
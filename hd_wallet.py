@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Watch-only BIP32 address derivation from extended public keys (xpub)
+
+Addresses are computed locally with pure Python so no node or wallet service is
+needed. Only non-hardened public derivation is possible from an xpub, which is
+all a receiving wallet needs: the xpub should be the account-level key
+(e.g. m/44'/0'/0') and addresses are derived on its external chain, .../0/index.
+"""
+import hmac
+import hashlib
+
+# secp256k1 curve parameters
+_P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+_N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+_G = (
+    0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+    0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8
+)
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+
+# Extended key version bytes that mean "derive native SegWit (P2WPKH) addresses"
+_SEGWIT_VERSIONS = {
+    bytes.fromhex("04b24746"),  # zpub
+    bytes.fromhex("04b5257b"),  # vpub (testnet)
+}
+
+# Address formats per supported cryptocurrency
+ADDRESS_FORMATS = {
+    "BTC": {"type": "utxo", "p2pkh": 0x00, "hrp": "bc"},
+    "LTC": {"type": "utxo", "p2pkh": 0x30, "hrp": "ltc"},
+    "DOGE": {"type": "utxo", "p2pkh": 0x1E, "hrp": None},
+    "BCH": {"type": "utxo", "p2pkh": 0x00, "hrp": None},  # Legacy format, accepted by BCH explorers
+    "ETH": {"type": "evm"},
+    "USDT": {"type": "evm"},
+    "USDC": {"type": "evm"},
+    "BNB": {"type": "evm"},
+    "TRX": {"type": "tron"},
+}
+
+
+def supports_derivation(crypto):
+    """Return True if per-order addresses can be derived for the cryptocurrency."""
+    return crypto in ADDRESS_FORMATS
+
+
+# --- secp256k1 point arithmetic (affine coordinates, None is the point at infinity) ---
+
+def _point_add(p1, p2):
+    if p1 is None:
+        return p2
+    if p2 is None:
+        return p1
+    if p1[0] == p2[0] and (p1[1] + p2[1]) % _P == 0:
+        return None
+    if p1 == p2:
+        slope = 3 * p1[0] * p1[0] * pow(2 * p1[1], -1, _P) % _P
+    else:
+        slope = (p2[1] - p1[1]) * pow(p2[0] - p1[0], -1, _P) % _P
+    x = (slope * slope - p1[0] - p2[0]) % _P
+    y = (slope * (p1[0] - x) - p1[1]) % _P
+    return (x, y)
+
+
+def _point_multiply(point, scalar):
+    result = None
+    addend = point
+    while scalar:
+        if scalar & 1:
+            result = _point_add(result, addend)
+        addend = _point_add(addend, addend)
+        scalar >>= 1
+    return result
+
+
+def _decompress(public_key):
+    if len(public_key) != 33 or public_key[0] not in (2, 3):
+        raise ValueError("Invalid compressed public key")
+    x = int.from_bytes(public_key[1:], "big")
+    y = pow((pow(x, 3, _P) + 7) % _P, (_P + 1) // 4, _P)
+    if y % 2 != public_key[0] % 2:
+        y = _P - y
+    return (x, y)
+
+
+def _compress(point):
+    return bytes([2 + (point[1] & 1)]) + point[0].to_bytes(32, "big")
+
+
+# --- Encodings ---
+
+def _hash160(data):
+    return hashlib.new("ripemd160", hashlib.sha256(data).digest()).digest()
+
+
+def base58check_encode(payload):
+    """Encode bytes as Base58Check."""
+    data = payload + hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4]
+    number = int.from_bytes(data, "big")
+    encoded = ""
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = _BASE58_ALPHABET[remainder] + encoded
+    leading_zeros = len(data) - len(data.lstrip(b"\0"))
+    return "1" * leading_zeros + encoded
+
+
+def base58check_decode(text):
+    """Decode a Base58Check string, verifying its checksum."""
+    number = 0
+    for char in text:
+        number = number * 58 + _BASE58_ALPHABET.index(char)
+    leading_zeros = len(text) - len(text.lstrip("1"))
+    data = b"\0" * leading_zeros + number.to_bytes((number.bit_length() + 7) // 8, "big")
+    payload, checksum = data[:-4], data[-4:]
+    if hashlib.sha256(hashlib.sha256(payload).digest()).digest()[:4] != checksum:
+        raise ValueError("Invalid Base58Check checksum")
+    return payload
+
+
+def _bech32_polymod(values):
+    generator = [0x3B6A57B2, 0x26508E6D, 0x1EA119FA, 0x3D4233DD, 0x2A1462B3]
+    checksum = 1
+    for value in values:
+        top = checksum >> 25
+        checksum = (checksum & 0x1FFFFFF) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                checksum ^= generator[i]
+    return checksum
+
+
+def _segwit_v0_address(hrp, program):
+    # Regroup 8-bit bytes into 5-bit words
+    words = [0]
+    accumulator = 0
+    bits = 0
+    for byte in program:
+        accumulator = (accumulator << 8) | byte
+        bits += 8
+        while bits >= 5:
+            bits -= 5
+            words.append((accumulator >> bits) & 31)
+    if bits:
+        words.append((accumulator << (5 - bits)) & 31)
+
+    expanded_hrp = [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+    polymod = _bech32_polymod(expanded_hrp + words + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp + "1" + "".join(_BECH32_CHARSET[w] for w in words + checksum)
+
+
+_KECCAK_ROUND_CONSTANTS = [
+    0x0000000000000001, 0x0000000000008082, 0x800000000000808A, 0x8000000080008000,
+    0x000000000000808B, 0x0000000080000001, 0x8000000080008081, 0x8000000000008009,
+    0x000000000000008A, 0x0000000000000088, 0x0000000080008009, 0x000000008000000A,
+    0x000000008000808B, 0x800000000000008B, 0x8000000000008089, 0x8000000000008003,
+    0x8000000000008002, 0x8000000000000080, 0x000000000000800A, 0x800000008000000A,
+    0x8000000080008081, 0x8000000000008080, 0x0000000080000001, 0x8000000080008008,
+]
+_KECCAK_ROTATIONS = [
+    [0, 36, 3, 41, 18], [1, 44, 10, 45, 2], [62, 6, 43, 15, 61],
+    [28, 55, 25, 21, 56], [27, 20, 39, 8, 14],
+]
+_MASK64 = (1 << 64) - 1
+
+
+def _keccak_f(state):
+    for round_constant in _KECCAK_ROUND_CONSTANTS:
+        c = [state[x][0] ^ state[x][1] ^ state[x][2] ^ state[x][3] ^ state[x][4] for x in range(5)]
+        d = [c[(x - 1) % 5] ^ (((c[(x + 1) % 5] << 1) | (c[(x + 1) % 5] >> 63)) & _MASK64) for x in range(5)]
+        state = [[state[x][y] ^ d[x] for y in range(5)] for x in range(5)]
+        b = [[0] * 5 for _ in range(5)]
+        for x in range(5):
+            for y in range(5):
+                r = _KECCAK_ROTATIONS[x][y]
+                b[y][(2 * x + 3 * y) % 5] = ((state[x][y] << r) | (state[x][y] >> (64 - r))) & _MASK64 if r else state[x][y]
+        state = [[b[x][y] ^ (~b[(x + 1) % 5][y] & b[(x + 2) % 5][y]) for y in range(5)] for x in range(5)]
+        state[0][0] ^= round_constant
+    return state
+
+
+def keccak256(data):
+    """Ethereum's Keccak-256 (original Keccak padding, not NIST SHA3-256)."""
+    rate = 136
+    padded = bytearray(data) + b"\x01" + b"\0" * ((-len(data) - 2) % rate) + b"\x80"
+    state = [[0] * 5 for _ in range(5)]
+    for offset in range(0, len(padded), rate):
+        block = padded[offset:offset + rate]
+        for i in range(rate // 8):
+            state[i % 5][i // 5] ^= int.from_bytes(block[i * 8:i * 8 + 8], "little")
+        state = _keccak_f(state)
+    return b"".join(state[i % 5][i // 5].to_bytes(8, "little") for i in range(4))
+
+
+def _evm_account(point):
+    return keccak256(point[0].to_bytes(32, "big") + point[1].to_bytes(32, "big"))[-20:]
+
+
+def _eip55(account):
+    hex_address = account.hex()
+    digest = keccak256(hex_address.encode()).hex()
+    return "0x" + "".join(c.upper() if int(digest[i], 16) >= 8 else c for i, c in enumerate(hex_address))
+
+
+# --- BIP32 ---
+
+def parse_extended_public_key(xpub):
+    """
+    Parse a Base58Check extended public key.
+
+    Returns:
+        dict: version, chain_code and point of the key
+    """
+    data = base58check_decode(xpub.strip())
+    if len(data) != 78:
+        raise ValueError("Extended public key must be 78 bytes")
+    return {
+        "version": data[:4],
+        "chain_code": data[13:45],
+        "point": _decompress(data[45:]),
+    }
+
+
+def _derive_child(chain_code, point, index):
+    if index >= 0x80000000:
+        raise ValueError("Hardened derivation is not possible from a public key")
+    digest = hmac.new(chain_code, _compress(point) + index.to_bytes(4, "big"), hashlib.sha512).digest()
+    tweak = int.from_bytes(digest[:32], "big")
+    if tweak >= _N:
+        raise ValueError(f"Invalid child key at index {index}")
+    child = _point_add(_point_multiply(_G, tweak), point)
+    if child is None:
+        raise ValueError(f"Invalid child key at index {index}")
+    return digest[32:], child
+
+
+def derive_public_point(xpub, index, change=0):
+    """Derive the public key point at xpub/change/index."""
+    key = parse_extended_public_key(xpub)
+    chain_code, point = _derive_child(key["chain_code"], key["point"], change)
+    return key["version"], _derive_child(chain_code, point, index)[1]
+
+
+def derive_address(crypto, xpub, index):
+    """
+    Derive the receiving address at xpub/0/index for a cryptocurrency.
+
+    Args:
+        crypto (str): The cryptocurrency code (BTC, ETH, etc.)
+        xpub (str): Account-level extended public key
+        index (int): Address index on the external chain
+
+    Returns:
+        str: The derived address
+    """
+    address_format = ADDRESS_FORMATS.get(crypto)
+    if not address_format:
+        raise ValueError(f"Address derivation is not supported for {crypto}")
+
+    version, point = derive_public_point(xpub, index)
+
+    if address_format["type"] == "evm":
+        return _eip55(_evm_account(point))
+
+    if address_format["type"] == "tron":
+        return base58check_encode(b"\x41" + _evm_account(point))
+
+    key_hash = _hash160(_compress(point))
+    if version in _SEGWIT_VERSIONS and address_format["hrp"]:
+        return _segwit_v0_address(address_format["hrp"], key_hash)
+    return base58check_encode(bytes([address_format["p2pkh"]]) + key_hash)
+
+
+def xpub_fingerprint(xpub):
+    """Short stable identifier for an xpub, used to share one index sequence per key."""
+    return hashlib.sha256(xpub.strip().encode()).hexdigest()[:16]
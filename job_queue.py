@@ -0,0 +1,273 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Durable payment-check job queue stored in the database
+
+Any number of worker processes can pull jobs concurrently. Workers claim rows
+with SELECT ... FOR UPDATE SKIP LOCKED, so two workers never get the same job
+and nobody blocks on rows another worker holds. A claimed job stays invisible
+for PAYMENT_JOB_VISIBILITY_TIMEOUT seconds; if its worker dies it becomes
+claimable again, and jobs that fail PAYMENT_JOB_MAX_ATTEMPTS times are
+dead-lettered (status "dead") for inspection. Idle workers publish the number
+of jobs in each status as payment_jobs gauges.
+
+Runs against PostgreSQL in production. SQLite ignores FOR UPDATE but serializes
+writers, so the same code works there for local testing.
+"""
+import os
+import time
+import socket
+import logging
+import datetime
+import threading
+from sqlalchemy.exc import IntegrityError
+from models import db, PaymentJob
+from app import app
+from config import (
+    PAYMENT_CHECK_INTERVAL,
+    PAYMENT_JOB_VISIBILITY_TIMEOUT,
+    PAYMENT_JOB_MAX_ATTEMPTS,
+    PAYMENT_JOB_MAX_AGE_HOURS,
+    PAYMENT_WORKER_CONCURRENCY
+)
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _rollback():
+    try:
+        with app.app_context():
+            db.session.rollback()
+    except:
+        pass
+
+
+def enqueue_payment_check(order_id, delay=0):
+    """
+    Queue a payment check for an order unless one is already queued or running.
+
+    A partial unique index allows one queued or running job per order, so two
+    processes enqueueing the same order at once still leave a single job.
+
+    Returns:
+        bool: True if a job is now queued for the order
+    """
+    try:
+        with app.app_context():
+            existing = PaymentJob.query.filter(
+                PaymentJob.order_id == order_id,
+                PaymentJob.status.in_(["queued", "running"])
+            ).first()
+            if existing:
+                return True
+
+            db.session.add(PaymentJob(
+                order_id=order_id,
+                status="queued",
+                max_attempts=PAYMENT_JOB_MAX_ATTEMPTS,
+                available_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+            ))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another process queued the order between our check and insert
+                db.session.rollback()
+                return True
+            metrics.increment("payment_jobs_enqueued")
+            return True
+    except Exception as e:
+        _rollback()
+        logger.error(f"Error queueing payment check for order {order_id}: {e}")
+        return False
+
+
+def claim_jobs(worker_id, limit=1, visibility_timeout=PAYMENT_JOB_VISIBILITY_TIMEOUT):
+    """
+    Claim up to limit due jobs for a worker.
+
+    Queued jobs whose available_at has passed are due, and so are running jobs
+    whose visibility timeout expired because their worker died or hung. A timed-out
+    job that has used up its attempts is dead-lettered instead of being claimed.
+
+    Returns:
+        list: Claimed job dicts
+    """
+    try:
+        with app.app_context():
+            now = datetime.datetime.utcnow()
+            jobs = PaymentJob.query.filter(
+                PaymentJob.status.in_(["queued", "running"]),
+                PaymentJob.available_at <= now
+            ).order_by(PaymentJob.available_at.asc()).limit(limit).with_for_update(skip_locked=True).all()
+
+            claimed = []
+            for job in jobs:
+                if job.status == "running":
+                    # The previous holder's lease ran out without an ack
+                    job.attempts += 1
+                    job.last_error = f"Visibility timeout expired while held by {job.locked_by}"
+                    metrics.increment("payment_jobs_timed_out")
+                    if job.attempts >= job.max_attempts:
+                        job.status = "dead"
+                        job.locked_by = None
+                        metrics.increment("payment_jobs_dead_lettered")
+                        continue
+
+                job.status = "running"
+                job.locked_by = worker_id
+                job.available_at = now + datetime.timedelta(seconds=visibility_timeout)
+                claimed.append(job)
+
+            db.session.commit()
+            return [job.to_dict() for job in claimed]
+    except Exception as e:
+        _rollback()
+        logger.error(f"Error claiming payment jobs: {e}")
+        return []
+
+
+def _update_claimed_job(job_id, worker_id, update):
+    """Apply update(job) if worker_id still holds the job. Returns False if the claim was lost."""
+    try:
+        with app.app_context():
+            job = PaymentJob.query.filter_by(id=job_id, status="running", locked_by=worker_id).with_for_update().first()
+            if not job:
+                logger.warning(f"Payment job {job_id} is no longer held by {worker_id}")
+                return False
+            update(job)
+            db.session.commit()
+            return True
+    except Exception as e:
+        _rollback()
+        logger.error(f"Error updating payment job {job_id}: {e}")
+        return False
+
+
+def complete_job(job_id, worker_id):
+    """Acknowledge a finished job."""
+    def update(job):
+        job.status = "done"
+        job.locked_by = None
+    return _update_claimed_job(job_id, worker_id, update)
+
+
+def release_job(job_id, worker_id, delay=PAYMENT_CHECK_INTERVAL):
+    """Put a job back in the queue to run again after delay seconds, without counting a failure."""
+    def update(job):
+        job.status = "queued"
+        job.locked_by = None
+        job.available_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=delay)
+    return _update_claimed_job(job_id, worker_id, update)
+
+
+def fail_job(job_id, worker_id, error):
+    """Record a failed run, retrying with exponential backoff or dead-lettering after max_attempts."""
+    def update(job):
+        job.attempts += 1
+        job.last_error = str(error)[:1000]
+        job.locked_by = None
+        if job.attempts >= job.max_attempts:
+            job.status = "dead"
+            metrics.increment("payment_jobs_dead_lettered")
+        else:
+            job.status = "queued"
+            backoff = min(PAYMENT_CHECK_INTERVAL * 2 ** job.attempts, 3600)
+            job.available_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=backoff)
+    return _update_claimed_job(job_id, worker_id, update)
+
+
+def get_queue_depths():
+    """Count jobs per status."""
+    try:
+        with app.app_context():
+            rows = db.session.query(PaymentJob.status, db.func.count(PaymentJob.id)).group_by(PaymentJob.status).all()
+            return {status: count for status, count in rows}
+    except Exception as e:
+        logger.error(f"Error counting payment jobs: {e}")
+        return {}
+
+
+def report_queue_depths():
+    """Publish the job counts per status as payment_jobs gauges."""
+    depths = get_queue_depths()
+    for status in ("queued", "running", "dead"):
+        depths.setdefault(status, 0)
+    for status, count in depths.items():
+        metrics.set_gauge("payment_jobs", count, status=status)
+    return depths
+
+
+def _order_is_stale(order):
+    """Whether an unpaid order is too old to keep polling."""
+    if not order.get("created_at"):
+        return False
+    created_at = datetime.datetime.fromisoformat(order["created_at"])
+    return datetime.datetime.utcnow() - created_at > datetime.timedelta(hours=PAYMENT_JOB_MAX_AGE_HOURS)
+
+
+def process_job(job, worker_id):
+    """Run one payment check job and ack, requeue or fail it."""
+    # Imported here so the queue can be used without loading the explorer clients
+    from data_manager import get_order
+    from payment import check_payment
+
+    order_id = job["order_id"]
+    try:
+        order = get_order(order_id)
+        if not order or order["status"] != "pending":
+            complete_job(job["id"], worker_id)
+            return
+
+        payment_status = check_payment(order_id)
+        completed = payment_status is True or (
+            isinstance(payment_status, dict) and payment_status.get("status") == "completed"
+        )
+
+        if completed:
+            metrics.increment("payment_jobs_settled")
+            complete_job(job["id"], worker_id)
+        elif _order_is_stale(order):
+            logger.info(f"Giving up polling unpaid order {order_id}")
+            complete_job(job["id"], worker_id)
+        else:
+            release_job(job["id"], worker_id)
+    except Exception as e:
+        logger.error(f"Payment job {job['id']} for order {order_id} failed: {e}")
+        metrics.increment("payment_jobs_failed")
+        fail_job(job["id"], worker_id, e)
+
+
+def run_worker(worker_id=None, poll_interval=5):
+    """Pull and process jobs forever."""
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+    logger.info(f"Payment worker {worker_id} started")
+    while True:
+        jobs = claim_jobs(worker_id)
+        if not jobs:
+            # Idle workers keep the queue depth gauges current
+            report_queue_depths()
+            time.sleep(poll_interval)
+            continue
+        for job in jobs:
+            process_job(job, worker_id)
+
+
+def start_workers(concurrency=PAYMENT_WORKER_CONCURRENCY):
+    """Start payment worker daemon threads in this process."""
+    threads = []
+    for i in range(concurrency):
+        worker_thread = threading.Thread(target=run_worker, name=f"payment-worker-{i}")
+        worker_thread.daemon = True
+        worker_thread.start()
+        threads.append(worker_thread)
+    return threads
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    for worker_thread in start_workers():
+        worker_thread.join()
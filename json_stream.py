@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Incremental JSON parsing for large block explorer responses
+"""
+import re
+import json
+import codecs
+
+# Number of bytes read from the socket at a time
+STREAM_CHUNK_SIZE = 16384
+
+_WHITESPACE = re.compile(r"\s*")
+# Characters that can continue a JSON number
+_NUMBER_TAIL = re.compile(r"[0-9.eE+\-]*")
+_DECODER = json.JSONDecoder()
+
+
+class _StreamReader:
+    """Text buffer over a byte stream that only keeps the unparsed tail in memory."""
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, min_size=1):
+        """Read at least min_size more characters (or up to EOF). Returns False at EOF."""
+        if self.eof:
+            return False
+
+        parts = [self.buffer[self.pos:]]
+        read = 0
+        while read < min_size:
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self.eof = True
+                parts.append(self._decoder.decode(b"", final=True))
+                break
+            text = self._decoder.decode(chunk)
+            parts.append(text)
+            read += len(text)
+
+        self.buffer = "".join(parts)
+        self.pos = 0
+        return read > 0 or not self.eof
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it ("" at EOF)."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
+
+    def expect(self, char):
+        """Consume the given structural character or raise ValueError."""
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in JSON stream, found '{found}'")
+        self.pos += 1
+
+    def value(self):
+        """Decode and consume one complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                obj, end = _DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Value is split across chunks; grow the buffer geometrically
+                if not self.fill(max(len(self.buffer) - self.pos, STREAM_CHUNK_SIZE)):
+                    raise
+                continue
+
+            # A number whose text runs to the buffer end may be truncated, e.g. "1" of "1.5"
+            # or "1." of "1.5e3"; decode it again once more of the stream is in
+            if isinstance(obj, (int, float)) and _NUMBER_TAIL.match(self.buffer, end).end() == len(self.buffer) \
+                    and self.fill():
+                continue
+
+            self.pos = end
+            return obj
+
+
+def iter_json_array(response, key=None, header=None, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield the items of a JSON array from a streamed HTTP response one at a time.
+
+    Only the item currently being decoded is held in memory, so callers can stop
+    iterating as soon as they have found what they are looking for. The response
+    is closed once the generator is exhausted or discarded.
+
+    Args:
+        response: A requests response opened with stream=True
+        key (str): Top-level object key holding the array, or None if the body is the array
+        header (dict): Optional dict that receives the top-level scalar fields seen
+                       before the array (e.g. Etherscan's "status" and "message")
+        chunk_size (int): Number of bytes to read from the socket at a time
+
+    Yields:
+        The decoded array items, in document order
+    """
+    try:
+        yield from _iter_array(_StreamReader(response.iter_content(chunk_size=chunk_size)), key, header)
+    finally:
+        # Runs on exhaustion and when the caller stops early, releasing the connection
+        response.close()
+
+
+def _iter_array(reader, key, header):
+    """Walk to the requested array and yield its items."""
+    if key is not None:
+        reader.expect("{")
+        while True:
+            if reader.peek() == "}":
+                return
+
+            name = reader.value()
+            reader.expect(":")
+            if name == key and reader.peek() == "[":
+                break
+
+            value = reader.value()
+            if header is not None:
+                header[name] = value
+
+            if reader.peek() == ",":
+                reader.pos += 1
+
+    reader.expect("[")
+    if reader.peek() == "]":
+        return
+
+    while True:
+        yield reader.value()
+
+        separator = reader.peek()
+        if separator == ",":
+            reader.pos += 1
+        elif separator == "]":
+            return
+        else:
+            raise ValueError(f"Malformed JSON array in stream near '{separator}'")
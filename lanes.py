@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Per-user ordered worker lanes for bot updates, in separate priority pools
+
+Updates are hashed by user onto the worker threads of a pool, each with its
+own bounded queue. One user's updates land on the same lane and run in order,
+so they never race on the user's conversation, while other users' updates run
+in parallel on the other lanes.
+
+Cheap catalog and UI taps and expensive payment taps (Check Payment, choosing
+a crypto, which creates the invoice, and showing the QR code) go to separate
+pools with their own lane counts, so a storm of payment checks queues behind
+other payment checks and browsing stays fast. While a user has updates queued
+or running in one pool, their next updates follow them there to keep order.
+
+Each pool admits a bounded number of updates (queued or running), and each
+lane queues at most its depth. Past either, the update is dropped at once,
+without holding up the dispatcher, and the user told to retry: a callback gets a
+"busy" query.answer, a message a short reply. Low-priority commands such as
+/history are shed earlier, once the catalog pool reaches
+LOW_PRIORITY_ADMISSION_LIMIT. Admitted callback queries are acknowledged
+right away (see callback_ack), before their handler gets to run.
+
+Metrics (labelled with pool and lane): lane_backlog gauge, lane_wait_seconds
+(time queued) and lane_seconds (time handling) summaries, and a lane_updates
+counter. Per pool, an admission_load gauge; an updates_shed counter labelled
+with the reason; and an update_queue_depth gauge for PTB's own queue.
+"""
+import time
+import queue
+import logging
+import threading
+from config import (
+    CRYPTOCURRENCIES,
+    CATALOG_ADMISSION_LIMIT,
+    PAYMENT_ADMISSION_LIMIT,
+    LOW_PRIORITY_ADMISSION_LIMIT
+)
+from outbox import OUTBOX, bot_of
+from callback_ack import acknowledge
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Callback data handled in the payment pool, besides the crypto codes
+PAYMENT_CALLBACKS = {"check_payment", "show_qr_code"}
+# Commands shed first when the bot is overloaded
+LOW_PRIORITY_COMMANDS = {"history"}
+
+BUSY_MESSAGE = "⏳ The bot is busy right now. Please try again in a moment."
+
+# The router install_user_lanes set up, for work that must run in order with a user's updates
+_router = None
+
+
+def update_lane_key(update):
+    """The key that orders an update: its user, else its chat, else None."""
+    if update is None or not hasattr(update, "effective_user"):
+        return None
+    if update.effective_user:
+        return update.effective_user.id
+    if update.effective_chat:
+        return update.effective_chat.id
+    return None
+
+
+def update_pool(update):
+    """Which pool an update belongs in: "payment" for the slow payment taps, else "catalog"."""
+    query = getattr(update, "callback_query", None)
+    if query and (query.data in PAYMENT_CALLBACKS or query.data in CRYPTOCURRENCIES):
+        return "payment"
+    return "catalog"
+
+
+class UserLanes:
+    """Worker threads that run callables in submission order per key."""
+
+    def __init__(self, name, lanes, depth):
+        self.name = name
+        self._queues = [queue.Queue(maxsize=depth) for _ in range(lanes)]
+        self._next_unkeyed = 0
+        for index, lane_queue in enumerate(self._queues):
+            worker_thread = threading.Thread(
+                target=self._run, args=(index, lane_queue), name=f"{name}-lane-{index}"
+            )
+            worker_thread.daemon = True
+            worker_thread.start()
+
+    def lane_for(self, key):
+        """The lane index for key; unkeyed work is spread round-robin."""
+        if key is None:
+            self._next_unkeyed = (self._next_unkeyed + 1) % len(self._queues)
+            return self._next_unkeyed
+        return hash(key) % len(self._queues)
+
+    def submit(self, key, func, *args):
+        """
+        Queue func(*args) behind earlier work for the same key.
+
+        Returns:
+            int or None: The lane index, or None if the lane was full and nothing was queued
+        """
+        index = self.lane_for(key)
+        lane_queue = self._queues[index]
+        try:
+            lane_queue.put_nowait((time.monotonic(), func, args))
+        except queue.Full:
+            return None
+        metrics.set_gauge("lane_backlog", lane_queue.qsize(), pool=self.name, lane=index)
+        return index
+
+    def backlog(self):
+        """Queued work per lane."""
+        return [lane_queue.qsize() for lane_queue in self._queues]
+
+    def _run(self, index, lane_queue):
+        while True:
+            queued_at, func, args = lane_queue.get()
+            started = time.monotonic()
+            metrics.observe("lane_wait_seconds", started - queued_at, pool=self.name, lane=index)
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Error in {self.name} lane {index}: {e}")
+            finally:
+                metrics.observe("lane_seconds", time.monotonic() - started, pool=self.name, lane=index)
+                metrics.increment("lane_updates", pool=self.name, lane=index)
+                metrics.set_gauge("lane_backlog", lane_queue.qsize(), pool=self.name, lane=index)
+
+
+class LaneRouter:
+    """
+    Route keyed work to one of several UserLanes pools, keeping a key in one pool while its work is in flight.
+
+    Each pool admits at most limits[pool] items queued or running; beyond that submit() refuses the work.
+    """
+
+    def __init__(self, pools, classify, limits=None):
+        self.pools = pools  # name -> UserLanes
+        self.classify = classify
+        self.limits = limits or {}  # name -> admission limit (0 or missing: unlimited)
+        self._lock = threading.Lock()
+        self._in_flight = {}  # key -> [pool name, queued or running count]
+        self._load = {name: 0 for name in pools}  # name -> queued or running count
+
+    def submit(self, key, item, func, *args, limit=None):
+        """
+        Queue func(*args) in the pool classify(item) picks, or wherever key's earlier work still is.
+
+        Args:
+            limit (int): A lower admission limit for this item, e.g. for low-priority work.
+
+        Returns:
+            str or None: The pool, or None if it was at its admission limit or the lane
+                         was full, and nothing was queued.
+        """
+        with self._lock:
+            entry = self._in_flight.get(key) if key is not None else None
+            pool = entry[0] if entry else self.classify(item)
+            limits = [value for value in (self.limits.get(pool), limit) if value]
+            if limits and self._load[pool] >= min(limits):
+                return None
+            if entry:
+                entry[1] += 1
+            elif key is not None:
+                self._in_flight[key] = [pool, 1]
+            self._load[pool] += 1
+            load = self._load[pool]
+        metrics.set_gauge("admission_load", load, pool=pool)
+        if self.pools[pool].submit(key, self._run, pool, key, func, args) is None:
+            self._release(pool, key)
+            return None
+        return pool
+
+    def _run(self, pool, key, func, args):
+        try:
+            func(*args)
+        finally:
+            self._release(pool, key)
+
+    def _release(self, pool, key):
+        """Take finished or refused work off the pool's load and key's in-flight count."""
+        with self._lock:
+            self._load[pool] -= 1
+            load = self._load[pool]
+            if key is not None:
+                entry = self._in_flight[key]
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._in_flight[key]
+        metrics.set_gauge("admission_load", load, pool=pool)
+
+
+def is_low_priority(update):
+    """Updates shed first under load: the LOW_PRIORITY_COMMANDS."""
+    message = getattr(update, "message", None)
+    text = (message.text or "") if message else ""
+    if not text.startswith("/"):
+        return False
+    command = text[1:].split(" ", 1)[0].split("@", 1)[0]
+    return command in LOW_PRIORITY_COMMANDS
+
+
+def answer_busy(update):
+    """Tell the user a refused update wasn't handled, without touching the lanes."""
+    try:
+        if getattr(update, "callback_query", None):
+            acknowledge(update, BUSY_MESSAGE)
+        elif getattr(update, "message", None):
+            OUTBOX.send_message(bot_of(update.message), update.message.chat_id, text=BUSY_MESSAGE)
+    except Exception as e:
+        logger.warning(f"Could not answer shed update: {e}")
+
+
+def run_in_user_lane(user_id, func, *args):
+    """
+    Run func(*args) in the user's lane, after the updates of theirs already queued.
+
+    Without lanes, updates are handled one at a time and func runs right away
+    on the calling thread.
+
+    Returns:
+        bool: False if the lane's pool was at its admission limit and func was dropped
+    """
+    if _router is None:
+        func(*args)
+        return True
+    return _router.submit(user_id, None, func, *args) is not None
+
+
+def install_user_lanes(dispatcher, catalog_lanes, catalog_depth, payment_lanes, payment_depth):
+    """
+    Make a PTB dispatcher hand each update to its user's lane instead of handling it inline.
+
+    Updates over a pool's admission limit, and low-priority ones over
+    LOW_PRIORITY_ADMISSION_LIMIT, are answered with BUSY_MESSAGE and dropped.
+
+    Returns:
+        LaneRouter or None: The router, or None when catalog_lanes is 0 and updates stay serial.
+    """
+    global _router
+    if catalog_lanes <= 0:
+        return None
+    pools = {"catalog": UserLanes("catalog", catalog_lanes, catalog_depth)}
+    if payment_lanes > 0:
+        pools["payment"] = UserLanes("payment", payment_lanes, payment_depth)
+        classify = update_pool
+    else:
+        classify = lambda update: "catalog"
+    router = _router = LaneRouter(pools, classify, {"catalog": CATALOG_ADMISSION_LIMIT, "payment": PAYMENT_ADMISSION_LIMIT})
+    process_update = dispatcher.process_update
+
+    def process_update_in_lane(update):
+        metrics.set_gauge("update_queue_depth", dispatcher.update_queue.qsize())
+        low_priority = is_low_priority(update)
+        limit = LOW_PRIORITY_ADMISSION_LIMIT if low_priority else None
+        if router.submit(update_lane_key(update), update, process_update, update, limit=limit) is None:
+            metrics.increment("updates_shed", reason="low_priority" if low_priority else "busy")
+            answer_busy(update)
+        else:
+            # Stop the button's spinner now rather than when the handler gets to run
+            acknowledge(update)
+
+    # The dispatcher's polling loop looks process_update up on the instance
+    dispatcher.process_update = process_update_in_lane
+    logger.info(f"Handling updates on {catalog_lanes} catalog and {payment_lanes} payment lanes")
+    return router
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Leader election for singleton background loops using PostgreSQL advisory locks
+
+Each loop has a name that maps to an advisory lock key. The replica that takes
+the lock holds it on a dedicated connection and re-checks it every renewal
+interval; the others retry at the same pace. When the leader exits or loses its
+connection, PostgreSQL releases the lock and a standby takes over on its next try.
+
+Other databases have no advisory locks, so there every process leads (fine for
+a single local process).
+"""
+import os
+import time
+import zlib
+import socket
+import logging
+from sqlalchemy import text
+from models import db
+from app import app
+from config import LEADER_RENEW_INTERVAL
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _lock_key(name):
+    """Stable advisory lock key for a loop name (kept within 32 bits so it shows up as pg_locks.objid)."""
+    return zlib.crc32(f"giftcard-bot:{name}".encode("utf-8"))
+
+
+class LeaderElection:
+    """Hold or wait for the advisory lock of one named singleton task."""
+
+    def __init__(self, name):
+        self.name = name
+        self.key = _lock_key(name)
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self._connection = None
+
+    @property
+    def is_leader(self):
+        return self._connection is not None
+
+    def _supported(self):
+        with app.app_context():
+            return db.engine.dialect.name == "postgresql"
+
+    def try_acquire(self):
+        """
+        Take the lock if it is free, or confirm that we still hold it.
+
+        Returns:
+            bool: True if this process is the leader
+        """
+        if self._connection is not None:
+            return self.renew()
+
+        if not self._supported():
+            return True
+
+        connection = None
+        try:
+            with app.app_context():
+                connection = db.engine.connect()
+            acquired = connection.execute(text("SELECT pg_try_advisory_lock(CAST(:key AS bigint))"), {"key": self.key}).scalar()
+            connection.commit()
+        except Exception as e:
+            logger.error(f"Error trying to take leadership of {self.name}: {e}")
+            if connection is not None:
+                connection.close()
+            return False
+
+        if not acquired:
+            connection.close()
+            return False
+
+        self._connection = connection
+        metrics.increment("leader_elected", task=self.name)
+        metrics.set_gauge("leader", 1, task=self.name)
+        logger.info(f"{self.holder} is now leader for {self.name}")
+        return True
+
+    def renew(self):
+        """Check that the session holding the lock is still alive and still holds it."""
+        if self._connection is None:
+            return False
+        try:
+            held = self._connection.execute(text(
+                "SELECT count(*) FROM pg_locks WHERE locktype = 'advisory' AND granted "
+                "AND pid = pg_backend_pid() AND objid::bigint = :key AND objsubid = 1"
+            ), {"key": self.key}).scalar()
+            self._connection.commit()
+        except Exception as e:
+            logger.error(f"Lost connection holding leadership of {self.name}: {e}")
+            held = 0
+
+        if not held:
+            self._step_down(unlock=False)
+            return False
+        return True
+
+    def release(self):
+        """Give up leadership so a standby can take over right away."""
+        if self._connection is not None:
+            self._step_down(unlock=True)
+
+    def _step_down(self, unlock):
+        connection, self._connection = self._connection, None
+        try:
+            if unlock:
+                connection.execute(text("SELECT pg_advisory_unlock(CAST(:key AS bigint))"), {"key": self.key})
+                connection.commit()
+            connection.close()
+        except Exception as e:
+            # Closing the session releases the lock anyway
+            logger.warning(f"Error releasing leadership of {self.name}: {e}")
+            connection.invalidate()
+        metrics.set_gauge("leader", 0, task=self.name)
+        logger.info(f"{self.holder} stepped down as leader for {self.name}")
+
+
+def run_as_leader(name, step, interval, renew_interval=LEADER_RENEW_INTERVAL):
+    """
+    Run step() every interval seconds, but only while this process is the leader for name.
+
+    Standbys check for a free lock every renew_interval seconds. The leader renews
+    its lease at the same pace, and also right before each step.
+    """
+    election = LeaderElection(name)
+    next_run = 0
+    try:
+        while True:
+            if election.try_acquire() and time.monotonic() >= next_run:
+                try:
+                    step()
+                except Exception as e:
+                    logger.error(f"Error in leader task {name}: {e}")
+                next_run = time.monotonic() + interval
+            time.sleep(min(renew_interval, interval))
+    finally:
+        election.release()
@@ -6,7 +6,6 @@ Main entry point for the Telegram Gift Card Store Bot
 import os
 import logging
 from dotenv import load_dotenv
-from bot import create_bot, run_bot
 
 # Import the Flask app for gunicorn
 from app import app
@@ -31,6 +30,10 @@ def start_bot():
                 logger.error(f"Environment variable {var} is not set")
                 return
         
+        # Refuse webhook settings the bot can't serve before starting any background work
+        from webhook import check_deployment
+        check_deployment()
+        
         # Log cryptocurrency addresses (truncated for security)
         from config import CRYPTOCURRENCIES
         for crypto, data in CRYPTOCURRENCIES.items():
@@ -39,8 +42,31 @@ def start_bot():
                 logger.info(f"{crypto} address configured: {address[:6]}...{address[-4:]}")
             else:
                 logger.warning(f"{crypto} address not configured")
+            if data.get("xpub"):
+                logger.info(f"{crypto} xpub configured: deriving a fresh address per order")
+        
+        # Sweep pending orders in the background with batched explorer queries
+        from config import PAYMENT_WATCHER_ENABLED
+        if PAYMENT_WATCHER_ENABLED:
+            from payment_watcher import start_payment_watcher
+            start_payment_watcher()
+        
+        # Pull queued payment checks; more replicas can run `python job_queue.py`
+        from config import PAYMENT_WORKER_CONCURRENCY
+        if PAYMENT_WORKER_CONCURRENCY > 0:
+            from job_queue import start_workers
+            start_workers(PAYMENT_WORKER_CONCURRENCY)
         
         # Create and run the bot
+        from config import BOT_RUNTIME
+        if BOT_RUNTIME == "async":
+            from async_bot import create_application, run_application
+            logger.info("Starting Telegram bot (async runtime)...")
+            run_application(create_application())
+            return
+        
+        # bot.py uses the PTB 13 Updater, so it is only imported for the threaded runtime
+        from bot import create_bot, run_bot
         logger.info("Starting Telegram bot...")
         bot = create_bot()
         run_bot(bot)
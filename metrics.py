@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process metrics registry (counters, gauges and timing summaries)
+"""
+import threading
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_summaries = {}
+
+
+def _key(name, labels):
+    """Build a registry key such as 'bulkhead_rejected{chain="BTC"}'."""
+    if not labels:
+        return name
+    label_text = ",".join(f'{label}="{value}"' for label, value in sorted(labels.items()))
+    return f"{name}{{{label_text}}}"
+
+
+def increment(name, value=1, **labels):
+    """Add to a counter."""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    """Set a gauge to its current value."""
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+
+def observe(name, value, **labels):
+    """Record one observation (e.g. a latency in seconds) in a count/sum/max summary."""
+    key = _key(name, labels)
+    with _lock:
+        summary = _summaries.setdefault(key, {"count": 0, "sum": 0.0, "max": 0.0})
+        summary["count"] += 1
+        summary["sum"] += value
+        summary["max"] = max(summary["max"], value)
+
+
+def get_counter(name, **labels):
+    """Read a counter's current value."""
+    with _lock:
+        return _counters.get(_key(name, labels), 0)
+
+
+def snapshot():
+    """Return a copy of all metrics, suitable for JSON serialization."""
+    with _lock:
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "summaries": {key: dict(summary) for key, summary in _summaries.items()}
+        }
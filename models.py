@@ -1,6 +1,6 @@
 import datetime
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, ForeignKey, Text, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, Float, Boolean, DateTime, ForeignKey, Text, JSON, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 
 db = SQLAlchemy()
@@ -194,4 +194,138 @@ class CryptoPayment(db.Model):
             'confirmations': self.confirmations,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'confirmed_at': self.confirmed_at.isoformat() if self.confirmed_at else None
-        }
\ No newline at end of file
+        }
+
+
+class ProcessedTransaction(db.Model):
+    """ProcessedTransaction model recording which order an on-chain transaction was claimed by, from the time it is first seen (pending or confirmed)."""
+    __tablename__ = 'processed_transactions'
+    __table_args__ = (
+        UniqueConstraint('chain', 'tx_hash', name='uq_processed_transactions_chain_tx_hash'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    chain = Column(String(10), nullable=False)  # Crypto code the order was paid in (BTC, USDT, etc.)
+    tx_hash = Column(String(255), nullable=False)
+    order_id = Column(String(50), ForeignKey('orders.order_id'), nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<ProcessedTransaction {self.chain}:{self.tx_hash} for Order {self.order_id}>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'chain': self.chain,
+            'tx_hash': self.tx_hash,
+            'order_id': self.order_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class PaymentAddress(db.Model):
+    """PaymentAddress model indexing per-order receiving addresses derived from an xpub."""
+    __tablename__ = 'payment_addresses'
+    __table_args__ = (
+        UniqueConstraint('xpub_id', 'derivation_index', name='uq_payment_addresses_xpub_index'),
+        UniqueConstraint('crypto', 'address', name='uq_payment_addresses_crypto_address'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    crypto = Column(String(10), nullable=False)
+    address = Column(String(255), nullable=False, index=True)
+    xpub_id = Column(String(16), nullable=False)  # Fingerprint of the xpub the address was derived from
+    derivation_index = Column(Integer, nullable=False)
+    order_id = Column(String(50), unique=True, nullable=False)  # Reserved before the order row is saved
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<PaymentAddress {self.crypto} {self.address} for Order {self.order_id}>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'crypto': self.crypto,
+            'address': self.address,
+            'xpub_id': self.xpub_id,
+            'derivation_index': self.derivation_index,
+            'order_id': self.order_id,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+
+class ChainCursor(db.Model):
+    """ChainCursor model storing the last block scanned for payments on each chain."""
+    __tablename__ = 'chain_cursors'
+    
+    chain = Column(String(10), primary_key=True)  # ETH, BSC, etc.
+    last_block = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<ChainCursor {self.chain} at {self.last_block}>"
+    
+    def to_dict(self):
+        return {
+            'chain': self.chain,
+            'last_block': self.last_block,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class PaymentJob(db.Model):
+    """PaymentJob model for the durable queue of payment checks shared by worker processes."""
+    __tablename__ = 'payment_jobs'
+    __table_args__ = (
+        # At most one live job per order, however many processes enqueue at once
+        Index('uq_payment_jobs_active_order', 'order_id', unique=True,
+              postgresql_where=text("status IN ('queued', 'running')"),
+              sqlite_where=text("status IN ('queued', 'running')")),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    order_id = Column(String(50), ForeignKey('orders.order_id'), nullable=False, index=True)
+    status = Column(String(20), default='queued', index=True)  # queued, running, done, dead
+    attempts = Column(Integer, default=0)  # Failed or timed-out runs so far
+    max_attempts = Column(Integer, default=5)
+    available_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)  # Next time the job may be claimed
+    locked_by = Column(String(100), nullable=True)  # Worker currently holding the job
+    last_error = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    
+    def __repr__(self):
+        return f"<PaymentJob {self.id} for Order {self.order_id} ({self.status})>"
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'order_id': self.order_id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'max_attempts': self.max_attempts,
+            'available_at': self.available_at.isoformat() if self.available_at else None,
+            'locked_by': self.locked_by,
+            'last_error': self.last_error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
+
+
+class ConversationState(db.Model):
+    """ConversationState model for users' in-progress bot conversations, shared by all bot processes."""
+    __tablename__ = 'conversation_states'
+    
+    user_id = Column(BigInteger, primary_key=True)  # Telegram user ID
+    data = Column(JSON, nullable=False)  # Compact record from conversation_store.Conversation.to_record
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow, index=True)
+    
+    def __repr__(self):
+        return f"<ConversationState {self.user_id}>"
+    
+    def to_dict(self):
+        return {
+            'user_id': self.user_id,
+            'data': self.data,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None
+        }
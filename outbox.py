@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Outbound Telegram queue with global and per-chat rate limits
+
+Handlers queue sends, edits and deletes here and return straight away. A
+scheduler thread releases them to a small pool of sender threads. It keeps
+each chat's calls in order with one call in flight per chat, and it respects
+a global token bucket (OUTBOX_GLOBAL_RATE calls per second) and a per-chat
+bucket (OUTBOX_CHAT_RATE per second, bursts of OUTBOX_CHAT_BURST).
+
+A RetryAfter from Telegram puts the call back at the front of its chat's
+queue and pauses that chat for retry_after seconds. When an edit of a message
+is still waiting behind an earlier edit of the same message, the newer one
+replaces it, and a delete replaces edits waiting for the message it removes.
+
+Each queued call returns a Future for its result; the futures of calls that
+were coalesced resolve with the result of the call that replaced them.
+
+Metrics: outbox_sent (by method), outbox_errors, outbox_retry_after and
+outbox_coalesced counters, an outbox_pending gauge and an outbox_wait_seconds
+summary of time spent queued.
+"""
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import OUTBOX_GLOBAL_RATE, OUTBOX_CHAT_RATE, OUTBOX_CHAT_BURST, OUTBOX_SENDERS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Seconds between sweeps of idle chats' rate limit state
+PRUNE_INTERVAL = 60
+
+
+def bot_of(telegram_object):
+    """The Bot a Telegram object (message, callback query) arrived through: get_bot() on PTB 20+, .bot before."""
+    get_bot = getattr(telegram_object, "get_bot", None)
+    return get_bot() if get_bot else telegram_object.bot
+
+
+class _Call:
+    """A queued Bot method call."""
+
+    __slots__ = ("bot", "method", "kwargs", "coalesce_key", "futures", "queued_at")
+
+    def __init__(self, bot, method, kwargs, coalesce_key):
+        self.bot = bot
+        self.method = method
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.futures = [Future()]
+        self.queued_at = time.monotonic()
+
+
+class _Chat:
+    """A chat's queued calls and rate limit state."""
+
+    __slots__ = ("pending", "tokens", "refilled_at", "paused_until", "sending", "scheduled")
+
+    def __init__(self, now):
+        self.pending = deque()
+        self.tokens = OUTBOX_CHAT_BURST
+        self.refilled_at = now
+        self.paused_until = 0
+        self.sending = False
+        self.scheduled = False
+
+    def refill(self, now):
+        self.tokens = min(OUTBOX_CHAT_BURST, self.tokens + (now - self.refilled_at) * OUTBOX_CHAT_RATE)
+        self.refilled_at = now
+
+    def ready_at(self, now):
+        """When the chat may make its next call."""
+        self.refill(now)
+        wait = 0 if self.tokens >= 1 else (1 - self.tokens) / OUTBOX_CHAT_RATE
+        return max(now + wait, self.paused_until)
+
+
+class Outbox:
+    """Rate-limited, per-chat ordered queue of Bot calls."""
+
+    def __init__(self, global_rate, senders):
+        self.global_rate = global_rate
+        self._cond = threading.Condition()
+        self._chats = {}  # chat_id -> _Chat
+        self._ready = []  # heap of (ready_at, seq, chat_id)
+        self._seq = itertools.count()
+        self._global_tokens = global_rate
+        self._global_refilled_at = time.monotonic()
+        self._pending = 0
+        self._executor = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="outbox-sender")
+        self._thread = None
+
+    def _start(self):
+        """Start the scheduler thread (caller holds the lock)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox-scheduler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def submit(self, bot, chat_id, method, coalesce_key=None, **kwargs):
+        """Queue bot.<method>(chat_id=chat_id, **kwargs). Returns a Future for its result."""
+        now = time.monotonic()
+        kwargs["chat_id"] = chat_id
+        with self._cond:
+            self._start()
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat(now)
+
+            last = chat.pending[-1] if chat.pending else None
+            if coalesce_key and last and last.coalesce_key == coalesce_key and last.method != "delete_message":
+                # The waiting call is superseded; keep its place in the queue
+                last.bot, last.method, last.kwargs = bot, method, kwargs
+                future = Future()
+                last.futures.append(future)
+                metrics.increment("outbox_coalesced")
+                return future
+
+            call = _Call(bot, method, kwargs, coalesce_key)
+            chat.pending.append(call)
+            self._pending += 1
+            metrics.set_gauge("outbox_pending", self._pending)
+            self._schedule(chat_id, chat, now)
+            return call.futures[0]
+
+    def send_message(self, bot, chat_id, **kwargs):
+        return self.submit(bot, chat_id, "send_message", **kwargs)
+
+    def send_photo(self, bot, chat_id, **kwargs):
+        return self.submit(bot, chat_id, "send_photo", **kwargs)
+
+    def edit_message_text(self, bot, chat_id, message_id, **kwargs):
+        return self.submit(bot, chat_id, "edit_message_text", ("message", message_id), message_id=message_id, **kwargs)
+
+    def edit_message_caption(self, bot, chat_id, message_id, **kwargs):
+        return self.submit(bot, chat_id, "edit_message_caption", ("message", message_id), message_id=message_id, **kwargs)
+
+    def delete_message(self, bot, chat_id, message_id):
+        return self.submit(bot, chat_id, "delete_message", ("message", message_id), message_id=message_id)
+
+    def _schedule(self, chat_id, chat, now):
+        """Put a chat with waiting calls on the ready heap (caller holds the lock)."""
+        if chat.pending and not chat.sending and not chat.scheduled:
+            chat.scheduled = True
+            heapq.heappush(self._ready, (chat.ready_at(now), next(self._seq), chat_id))
+            self._cond.notify()
+
+    def _take_global_token(self, now):
+        """Take a global token, or return how long until one is available (caller holds the lock)."""
+        self._global_tokens = min(
+            self.global_rate, self._global_tokens + (now - self._global_refilled_at) * self.global_rate
+        )
+        self._global_refilled_at = now
+        if self._global_tokens >= 1:
+            self._global_tokens -= 1
+            return 0
+        return (1 - self._global_tokens) / self.global_rate
+
+    def _prune(self, now):
+        """Forget idle chats whose buckets have refilled (caller holds the lock)."""
+        for chat_id, chat in list(self._chats.items()):
+            if chat.pending or chat.sending or chat.scheduled or chat.paused_until > now:
+                continue
+            chat.refill(now)
+            if chat.tokens >= OUTBOX_CHAT_BURST:
+                del self._chats[chat_id]
+
+    def _run(self):
+        """Scheduler loop: release calls to the senders as the rate limits allow."""
+        next_prune = 0
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                if now >= next_prune:
+                    self._prune(now)
+                    next_prune = now + PRUNE_INTERVAL
+                if not self._ready:
+                    self._cond.wait(PRUNE_INTERVAL)
+                    continue
+                ready_at, _, chat_id = self._ready[0]
+                if ready_at > now:
+                    self._cond.wait(ready_at - now)
+                    continue
+
+                chat = self._chats[chat_id]
+                # A RetryAfter may have paused the chat after it was scheduled
+                if chat.ready_at(now) > now:
+                    heapq.heapreplace(self._ready, (chat.ready_at(now), next(self._seq), chat_id))
+                    continue
+                global_wait = self._take_global_token(now)
+                if global_wait:
+                    self._cond.wait(global_wait)
+                    continue
+
+                heapq.heappop(self._ready)
+                chat.scheduled = False
+                chat.tokens -= 1
+                chat.sending = True
+                call = chat.pending.popleft()
+                self._executor.submit(self._send, chat_id, chat, call)
+
+    def _send(self, chat_id, chat, call):
+        metrics.observe("outbox_wait_seconds", time.monotonic() - call.queued_at)
+        done = True
+        try:
+            result = getattr(call.bot, call.method)(**call.kwargs)
+            metrics.increment("outbox_sent", method=call.method)
+            for future in call.futures:
+                future.set_result(result)
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                # Flood control: retry the same call once the chat's pause is over
+                done = False
+                metrics.increment("outbox_retry_after")
+                logger.warning(f"Telegram flood control on chat {chat_id}, retrying {call.method} in {retry_after}s")
+                with self._cond:
+                    chat.paused_until = time.monotonic() + float(retry_after)
+                    chat.pending.appendleft(call)
+            else:
+                metrics.increment("outbox_errors", method=call.method)
+                logger.error(f"Error sending {call.method} to chat {chat_id}: {e}")
+                for future in call.futures:
+                    future.set_exception(e)
+        finally:
+            with self._cond:
+                chat.sending = False
+                if done:
+                    self._pending -= 1
+                    metrics.set_gauge("outbox_pending", self._pending)
+                self._schedule(chat_id, chat, time.monotonic())
+
+
+OUTBOX = Outbox(OUTBOX_GLOBAL_RATE, OUTBOX_SENDERS)
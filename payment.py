@@ -9,8 +9,26 @@ import json
 import logging
 import requests
 from datetime import datetime
-from config import CRYPTOCURRENCIES, DISCOUNT_PERCENTAGE
-from data_manager import save_order, get_order, update_order_status, get_payment_status, save_crypto_payment
+from config import (
+    CRYPTOCURRENCIES, DISCOUNT_PERCENTAGE, ADDRESS_RESERVATION_ATTEMPTS, ADDRESS_GAP_LIMIT, ADDRESS_REUSE_HOURS,
+    PAYMENT_CHECK_CACHE_TTL,
+    PAYMENT_CHECK_INTERVAL, PAYMENT_TIME_GRACE, PRICE_API_TIMEOUT, BULKHEAD_TIMEOUT,
+    PAYMENT_WATCHER_ENABLED, EVM_RPC_URLS, EVM_TOKEN_CONTRACTS
+)
+from data_manager import (
+    save_order, get_order, update_order_status, get_payment_status, settle_payment,
+    get_next_derivation_index, get_last_paid_derivation_index, save_payment_address, reuse_payment_address,
+    get_order_id_for_address
+)
+from hd_wallet import supports_derivation, derive_address, xpub_fingerprint
+from explorers import UTXO_BATCH_CHAINS, supports_address_lookup, sent_after, unix_time
+from providers import fetch_address_transfers
+from tx_ledger import is_transaction_used, remember_transaction
+from singleflight import SingleFlightCache
+from bulkhead import BulkheadFull
+from deadline import deadline, request_timeout, check_deadline, DeadlineExceeded
+from settlement_relay import publish_settlement
+from job_queue import enqueue_payment_check
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +40,9 @@ CMC_API_URL = "https://pro-api.coinmarketcap.com/v1/cryptocurrency/quotes/latest
 CRYPTO_PRICE_CACHE = {}
 CACHE_DURATION = 300  # 5 minutes in seconds
 
+# Repeated "Check Payment" taps for the same order share one check and its recent result
+PAYMENT_CHECK_CACHE = SingleFlightCache("payment_check", PAYMENT_CHECK_CACHE_TTL)
+
 def get_live_crypto_price(crypto):
     """Get live cryptocurrency price from CoinMarketCap API."""
     now = datetime.now().timestamp()
@@ -51,7 +72,7 @@ def get_live_crypto_price(crypto):
     }
     
     try:
-        response = requests.get(CMC_API_URL, headers=headers, params=params)
+        response = requests.get(CMC_API_URL, headers=headers, params=params, timeout=request_timeout(PRICE_API_TIMEOUT))
         if response.status_code == 200:
             data = response.json()
             if "data" in data and symbol in data["data"]:
@@ -67,6 +88,10 @@ def get_live_crypto_price(crypto):
             return None
     except Exception as e:
         logger.error(f"Error fetching {crypto} price from CoinMarketCap: {str(e)}")
+        # An expired price beats the static fallback when the API is slow or the deadline ran out
+        if crypto in CRYPTO_PRICE_CACHE:
+            logger.warning(f"Using stale cached price for {crypto}")
+            return CRYPTO_PRICE_CACHE[crypto][0]
         return None
 
 def get_crypto_price(crypto, usd_amount):
@@ -173,6 +198,42 @@ def calculate_discounted_price(denomination):
     
     return round(usd_amount, 2)
 
+def get_payment_address(crypto, order_id):
+    """
+    Get the receiving address for a new order.
+    
+    If an xpub is configured for the cryptocurrency, a derived address is reserved
+    for the order so payments can be matched to it exactly: one given up by an
+    unpaid invoice when there is one, else the next fresh one. Otherwise the
+    shared static address is used.
+    """
+    static_address = CRYPTOCURRENCIES[crypto]["address"]
+    xpub = CRYPTOCURRENCIES[crypto].get("xpub")
+    if not xpub or not supports_derivation(crypto):
+        return static_address
+    
+    try:
+        xpub_id = xpub_fingerprint(xpub)
+        reused = reuse_payment_address(crypto, xpub_id, order_id, ADDRESS_REUSE_HOURS)
+        if reused:
+            return reused[0]
+        for attempt in range(ADDRESS_RESERVATION_ATTEMPTS):
+            index = get_next_derivation_index(xpub_id)
+            if index is None:
+                break
+            address = derive_address(crypto, xpub, index)
+            if save_payment_address(crypto, address, xpub_id, index, order_id):
+                last_paid = get_last_paid_derivation_index(xpub_id)
+                if last_paid is not None and index - last_paid > ADDRESS_GAP_LIMIT:
+                    logger.warning(f"{crypto} address index {index} is more than {ADDRESS_GAP_LIMIT} past the last paid one "
+                                   f"({last_paid}); the receiving wallet may need a larger gap limit to see it")
+                return address
+    except Exception as e:
+        logger.error(f"Error deriving {crypto} address for order {order_id}: {e}")
+    
+    logger.error(f"Could not reserve a derived {crypto} address for order {order_id}, using static address")
+    return static_address
+
 def generate_payment_invoice(user_id, country, gift_card, denomination, crypto):
     """Generate a payment invoice for the order."""
     # Generate a unique order ID
@@ -191,7 +252,7 @@ def generate_payment_invoice(user_id, country, gift_card, denomination, crypto):
     crypto_amount = get_crypto_price(crypto, discounted_price)
     
     # Get payment address for the selected cryptocurrency
-    payment_address = CRYPTOCURRENCIES[crypto]["address"]
+    payment_address = get_payment_address(crypto, order_id)
     
     # Create invoice data
     invoice = {
@@ -211,11 +272,70 @@ def generate_payment_invoice(user_id, country, gift_card, denomination, crypto):
         "status": "pending"
     }
     
-    # Save order to database
-    save_order(invoice)
+    # Save order to database; chains the watcher doesn't sweep in batches get
+    # background payment checks of their own
+    if save_order(invoice) and not _swept_by_watcher(crypto):
+        enqueue_payment_check(order_id, delay=PAYMENT_CHECK_INTERVAL)
     
     return invoice
 
+def _swept_by_watcher(crypto):
+    """Whether the payment watcher checks this chain's pending orders with batched queries."""
+    if not PAYMENT_WATCHER_ENABLED:
+        return False
+    if crypto in UTXO_BATCH_CHAINS:
+        return True
+    token = EVM_TOKEN_CONTRACTS.get(crypto)
+    return bool(token and EVM_RPC_URLS.get(token["chain"]))
+
+def apply_transfer(order_id, crypto, transfer):
+    """
+    Record a matching incoming transfer against an order, completing the order once
+    the transfer has enough confirmations.
+    
+    The payment row, order status and ledger entry are written in a single
+    database transaction by settle_payment.
+    
+    Args:
+        order_id (str): The order the transfer pays for.
+        crypto (str): The cryptocurrency code.
+        transfer (dict): Normalized transfer (tx_hash, address, amount, confirmations, optional final).
+    
+    Returns:
+        dict or bool: Payment status information, or False if the transfer is already claimed
+                      by another order or could not be recorded.
+    """
+    tx_hash = transfer["tx_hash"]
+    if not tx_hash:
+        logger.error(f"Refusing to settle order {order_id} with an empty {crypto} transaction hash")
+        return False
+    if is_transaction_used(crypto, tx_hash, order_id):
+        return False
+    
+    confirmations = int(transfer.get("confirmations", 0))
+    required_confirmations = int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1"))
+    confirmed = bool(transfer.get("final")) or confirmations >= required_confirmations
+    
+    payment_status = settle_payment(order_id, {
+        "transaction_id": tx_hash,
+        "confirmations": confirmations,
+        "status": "confirmed" if confirmed else "pending"
+    }, gift_card_code=f"GIFT-{order_id[:8]}")
+    if not payment_status:
+        return False
+    
+    # The ledger claims the recorded transaction for this order whether or not it has confirmed yet
+    if payment_status.get("transaction_id"):
+        remember_transaction(crypto, payment_status["transaction_id"], order_id)
+    # A cached "not paid yet" from before this settlement (e.g. found by the watcher) is now stale
+    PAYMENT_CHECK_CACHE.invalidate(order_id)
+    if payment_status["status"] == "completed":
+        # Push the settlement to any "Check Payment" screen waiting on this order, in any process
+        publish_settlement(order_id, payment_status)
+    else:
+        payment_status["required_confirmations"] = required_confirmations
+    return payment_status
+
 def check_payment(order_id):
     """
     Check if a payment has been received for an order.
@@ -237,6 +357,12 @@ def check_payment(order_id):
     address = order["payment_address"]
     expected_amount = float(order["crypto_amount"])
     
+    # A derived address belongs to exactly one order; once it's handed to another one, it no longer pays this one
+    owner = get_order_id_for_address(crypto, address)
+    if owner and owner != order_id:
+        logger.warning(f"Order {order_id}'s {crypto} address now belongs to order {owner}")
+        return get_payment_status(order_id) or False
+    
     # Check if the order is already completed
     if order["status"] == "completed":
         payment_status = get_payment_status(order_id)
@@ -244,577 +370,63 @@ def check_payment(order_id):
             return payment_status
         return True  # Order is completed even if payment details not found
     
-    # Configure API endpoints based on cryptocurrency
-    if crypto == "BTC":
-        try:
-            # Query blockchain.info API
-            response = requests.get(f"https://blockchain.info/rawaddr/{address}")
-            if response.status_code != 200:
-                logger.error(f"Error from blockchain.info API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            # Check recent transactions
-            for tx in data.get("txs", []):
-                # Find incoming transactions
-                for output in tx.get("out", []):
-                    if output.get("addr") == address:
-                        # Convert satoshis to BTC
-                        amount = float(output.get("value", 0)) / 100000000
-                        if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                            # Get confirmation status
-                            confirmations = tx.get("confirmations", 0)
-                            required_confirmations = int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1"))
-                            
-                            # Create transaction data
-                            tx_data = {
-                                "transaction_id": tx.get("hash", ""),
-                                "confirmations": confirmations,
-                                "status": "pending"
-                            }
-                            
-                            # Check if confirmations are enough
-                            if confirmations >= required_confirmations:
-                                tx_data["status"] = "confirmed"
-                                
-                                # Update order with gift card code
-                                gift_card_code = f"GIFT-{order_id[:8]}"
-                                update_order_status(order_id, "completed", gift_card_code)
-                            
-                            # Save transaction data
-                            save_crypto_payment(order_id, tx_data)
-                            
-                            # Return payment status info
-                            payment_status = get_payment_status(order_id)
-                            if payment_status:
-                                return payment_status
-                            
-                            # If payment status not available but confirmed, return True
-                            if tx_data["status"] == "confirmed":
-                                return True
-                                
-                            # If pending, return status object
-                            return {
-                                "order_id": order_id,
-                                "status": "pending",
-                                "confirmations": confirmations,
-                                "required_confirmations": required_confirmations,
-                                "transaction_id": tx_data["transaction_id"]
-                            }
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking BTC payment: {e}")
-            return False
-    
-    elif crypto == "ETH":
-        try:
-            # Use Etherscan API
-            api_key = os.getenv("ETHERSCAN_API_KEY", "")
-            api_url = f"https://api.etherscan.io/api?module=account&action=txlist&address={address}&apikey={api_key}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Etherscan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            if data.get("status") != "1":
-                logger.error(f"Etherscan API error: {data.get('message')}")
-                return False
-                
-            transactions = data.get("result", [])
-            
-            for tx in transactions:
-                if tx.get("to", "").lower() == address.lower():
-                    # Convert wei to ETH
-                    amount = float(tx.get("value", 0)) / 1e18
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Get confirmation status
-                        confirmations = int(tx.get("confirmations", 0))
-                        required_confirmations = int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1"))
-                        
-                        # Create transaction data
-                        tx_data = {
-                            "transaction_id": tx.get("hash", ""),
-                            "confirmations": confirmations,
-                            "status": "pending"
-                        }
-                        
-                        # Check if confirmations are enough
-                        if confirmations >= required_confirmations:
-                            tx_data["status"] = "confirmed"
-                            
-                            # Update order with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                        
-                        # Save transaction data
-                        save_crypto_payment(order_id, tx_data)
-                        
-                        # Return payment status info
-                        payment_status = get_payment_status(order_id)
-                        if payment_status:
-                            return payment_status
-                        
-                        # If payment status not available but confirmed, return True
-                        if tx_data["status"] == "confirmed":
-                            return True
-                            
-                        # If pending, return status object
-                        return {
-                            "order_id": order_id,
-                            "status": "pending",
-                            "confirmations": confirmations,
-                            "required_confirmations": required_confirmations,
-                            "transaction_id": tx_data["transaction_id"]
-                        }
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking ETH payment: {e}")
-            return False
-    
-    elif crypto == "USDT":
-        try:
-            # USDT on Ethereum (ERC-20)
-            api_key = os.getenv("ETHERSCAN_API_KEY", "")
-            contract_address = "0xdac17f958d2ee523a2206206994597c13d831ec7"  # USDT contract
-            api_url = f"https://api.etherscan.io/api?module=account&action=tokentx&contractaddress={contract_address}&address={address}&apikey={api_key}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Etherscan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            if data.get("status") != "1":
-                logger.error(f"Etherscan API error: {data.get('message')}")
-                return False
-                
-            transactions = data.get("result", [])
-            
-            for tx in transactions:
-                if tx.get("to", "").lower() == address.lower():
-                    # Convert to USDT (6 decimals)
-                    amount = float(tx.get("value", 0)) / 1e6
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Get confirmation status
-                        confirmations = int(tx.get("confirmations", 0))
-                        required_confirmations = int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1"))
-                        
-                        # Create transaction data
-                        tx_data = {
-                            "transaction_id": tx.get("hash", ""),
-                            "confirmations": confirmations,
-                            "status": "pending"
-                        }
-                        
-                        # Check if confirmations are enough
-                        if confirmations >= required_confirmations:
-                            tx_data["status"] = "confirmed"
-                            
-                            # Update order with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                        
-                        # Save transaction data
-                        save_crypto_payment(order_id, tx_data)
-                        
-                        # Return payment status info
-                        payment_status = get_payment_status(order_id)
-                        if payment_status:
-                            return payment_status
-                        
-                        # If payment status not available but confirmed, return True
-                        if tx_data["status"] == "confirmed":
-                            return True
-                            
-                        # If pending, return status object
-                        return {
-                            "order_id": order_id,
-                            "status": "pending",
-                            "confirmations": confirmations,
-                            "required_confirmations": required_confirmations,
-                            "transaction_id": tx_data["transaction_id"]
-                        }
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking USDT payment: {e}")
-            return False
-    
-    elif crypto == "LTC":
-        try:
-            # Use BlockCypher API for Litecoin
-            api_url = f"https://api.blockcypher.com/v1/ltc/main/addrs/{address}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from BlockCypher API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            # Check transactions
-            for tx in data.get("txrefs", []):
-                if not tx.get("spent", True):  # Unspent output
-                    amount = float(tx.get("value", 0)) / 1e8  # Convert satoshis to LTC
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Check confirmations
-                        if int(tx.get("confirmations", 0)) >= int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1")):
-                            # Store transaction ID
-                            tx_id = tx.get("tx_hash", "")
-                            # Update order status with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                            return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking LTC payment: {e}")
-            return False
-    
-    elif crypto == "BNB":
-        try:
-            # Use BscScan API for Binance Smart Chain
-            api_key = os.getenv("BSCSCAN_API_KEY", "")
-            api_url = f"https://api.bscscan.com/api?module=account&action=txlist&address={address}&apikey={api_key}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from BscScan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            if data.get("status") != "1":
-                logger.error(f"BscScan API error: {data.get('message')}")
-                return False
-                
-            transactions = data.get("result", [])
-            
-            for tx in transactions:
-                if tx.get("to", "").lower() == address.lower():
-                    # Convert wei to BNB
-                    amount = float(tx.get("value", 0)) / 1e18
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Check confirmations
-                        if int(tx.get("confirmations", 0)) >= int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1")):
-                            # Store transaction ID
-                            tx_id = tx.get("hash", "")
-                            # Update order status with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                            return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking BNB payment: {e}")
-            return False
-    
-    elif crypto == "SOL":
-        try:
-            # Use Solscan API for Solana
-            api_url = f"https://api.solscan.io/account/transactions?account={address}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Solscan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            # Check transactions
-            for tx in data.get("data", []):
-                if tx.get("status") == "Success":
-                    # Check if transaction is a lamport transfer to our address
-                    if tx.get("type") == "SOL_TRANSFER" and tx.get("dstAddress") == address:
-                        # Convert lamports to SOL
-                        amount = float(tx.get("lamport", 0)) / 1e9
-                        if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                            # Update order status with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                            return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking SOL payment: {e}")
-            return False
-    
-    elif crypto == "XRP":
-        try:
-            # Use XRP API for Ripple
-            api_url = f"https://api.xrpscan.com/api/v1/account/{address}/transactions"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from XRP API: {response.status_code}")
-                return False
-                
-            transactions = response.json()
-            
-            # Check transactions
-            for tx in transactions:
-                # Check if this is a payment and it's successful
-                if tx.get("type") == "Payment" and tx.get("status") == "tesSUCCESS":
-                    if tx.get("Destination") == address:
-                        amount = float(tx.get("Amount", 0)) / 1e6
-                        if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                            # Update order status with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                            return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking XRP payment: {e}")
-            return False
-    
-    elif crypto == "USDC":
-        try:
-            # USDC on Ethereum (ERC-20)
-            api_key = os.getenv("ETHERSCAN_API_KEY", "")
-            contract_address = "0xa0b86991c6218b36c1d19d4a2e9eb0ce3606eb48"  # USDC contract
-            api_url = f"https://api.etherscan.io/api?module=account&action=tokentx&contractaddress={contract_address}&address={address}&apikey={api_key}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Etherscan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            if data.get("status") != "1":
-                logger.error(f"Etherscan API error: {data.get('message')}")
-                return False
-                
-            transactions = data.get("result", [])
-            
-            for tx in transactions:
-                if tx.get("to", "").lower() == address.lower():
-                    # Convert to USDC (6 decimals)
-                    amount = float(tx.get("value", 0)) / 1e6
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Get confirmation status
-                        confirmations = int(tx.get("confirmations", 0))
-                        required_confirmations = int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1"))
-                        
-                        # Create transaction data
-                        tx_data = {
-                            "transaction_id": tx.get("hash", ""),
-                            "confirmations": confirmations,
-                            "status": "pending"
-                        }
-                        
-                        # Check if confirmations are enough
-                        if confirmations >= required_confirmations:
-                            tx_data["status"] = "confirmed"
-                            
-                            # Update order with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                        
-                        # Save transaction data
-                        save_crypto_payment(order_id, tx_data)
-                        
-                        # Return payment status info
-                        payment_status = get_payment_status(order_id)
-                        if payment_status:
-                            return payment_status
-                        
-                        # If payment status not available but confirmed, return True
-                        if tx_data["status"] == "confirmed":
-                            return True
-                            
-                        # If pending, return status object
-                        return {
-                            "order_id": order_id,
-                            "status": "pending",
-                            "confirmations": confirmations,
-                            "required_confirmations": required_confirmations,
-                            "transaction_id": tx_data["transaction_id"]
-                        }
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking USDC payment: {e}")
-            return False
-    
-    elif crypto == "ADA":
-        try:
-            # Use Cardanoscan API for Cardano
-            api_url = f"https://cardanoscan.io/api/transaction/{address}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Cardanoscan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            # Check transactions
-            for tx in data.get("transactions", []):
-                # Check outputs for payments to our address
-                for output in tx.get("outputs", []):
-                    if output.get("address") == address:
-                        # Convert lovelace to ADA
-                        amount = float(output.get("value", 0)) / 1e6
-                        if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                            # Update order status with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                            return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking ADA payment: {e}")
-            return False
-    
-    elif crypto == "DOGE":
-        try:
-            # Use Dogechain API for Dogecoin
-            api_url = f"https://dogechain.info/api/v1/address/transactions/{address}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Dogechain API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            if data.get("success") != 1:
-                logger.error(f"Dogechain API error: {data.get('error')}")
-                return False
-                
-            transactions = data.get("transactions", [])
-            
-            # Check transactions
-            for tx in transactions:
-                # Check if this is an incoming transaction
-                if tx.get("direction") == "incoming":
-                    amount = float(tx.get("value", 0))
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Check confirmations
-                        if int(tx.get("confirmations", 0)) >= int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1")):
-                            # Update order status with gift card code
-                            gift_card_code = f"GIFT-{order_id[:8]}"
-                            update_order_status(order_id, "completed", gift_card_code)
-                            return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking DOGE payment: {e}")
-            return False
-    
-    elif crypto == "TRX":
-        try:
-            # Use Tronscan API for Tron
-            api_url = f"https://apilist.tronscan.org/api/transaction?address={address}&direction=in"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Tronscan API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            # Check transactions
-            for tx in data.get("data", []):
-                # Check if this is a successful transaction to our address
-                if tx.get("toAddress") == address and tx.get("confirmed"):
-                    amount = float(tx.get("amount", 0)) / 1e6
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Update order status with gift card code
-                        gift_card_code = f"GIFT-{order_id[:8]}"
-                        update_order_status(order_id, "completed", gift_card_code)
-                        return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking TRX payment: {e}")
-            return False
-    
-    elif crypto == "BCH":
-        try:
-            # Use Bitcoin.com API for Bitcoin Cash
-            api_url = f"https://rest.bitcoin.com/v2/address/details/{address}"
-            
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                logger.error(f"Error from Bitcoin.com API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            # Check transactions
-            for tx in data.get("transactions", []):
-                # Use Blockchain.com API to get transaction details
-                tx_url = f"https://rest.bitcoin.com/v2/transaction/details/{tx}"
-                
-                tx_response = requests.get(tx_url)
-                if tx_response.status_code != 200:
-                    continue
-                    
-                tx_data = tx_response.json()
-                
-                # Check outputs
-                for output in tx_data.get("vout", []):
-                    # Check if the output is to our address
-                    if address in output.get("scriptPubKey", {}).get("addresses", []):
-                        amount = float(output.get("value", 0))
-                        if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                            # Check confirmations
-                            if int(tx_data.get("confirmations", 0)) >= int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1")):
-                                # Update order status with gift card code
-                                gift_card_code = f"GIFT-{order_id[:8]}"
-                                update_order_status(order_id, "completed", gift_card_code)
-                                return True
-            
-            return False
-        except Exception as e:
-            logger.error(f"Error checking BCH payment: {e}")
-            return False
+    # Explorer calls run on the chain's own bounded pool so a slow provider can't
+    # tie up the dispatcher threads that serve every other user; we wait at most
+    # BULKHEAD_TIMEOUT for them
+    try:
+        with deadline(BULKHEAD_TIMEOUT):
+            payment_status = _check_chain_payment(order_id, crypto, address, expected_amount, order["created_at"])
+    except (BulkheadFull, DeadlineExceeded) as e:
+        logger.warning(f"Payment check for order {order_id} skipped: {e}")
+        payment_status = False
+    
+    if payment_status is False:
+        # Nothing confirmed on chain, or the explorer failed: fall back to a transaction
+        # already recorded for this order (e.g. seen in the mempool by the watcher)
+        recorded_status = get_payment_status(order_id)
+        if recorded_status and recorded_status.get("transaction_id"):
+            return recorded_status
+    
+    return payment_status
+
+def check_payment_cached(order_id):
+    """
+    Check payment for an order, coalescing concurrent checks for the same order into one
+    and reusing the result for PAYMENT_CHECK_CACHE_TTL seconds.
     
-    elif crypto == "TON":
+    Returns the same values as check_payment.
+    """
+    return PAYMENT_CHECK_CACHE.call(order_id, check_payment, order_id)
+
+def _check_chain_payment(order_id, crypto, address, expected_amount, created_at):
+    """Query the block explorer for the order's chain. Returns the same values as check_payment."""
+    if supports_address_lookup(crypto):
         try:
-            # Use Toncenter API for TON
-            api_key = os.getenv("TONCENTER_API_KEY", "")
-            headers = {"X-API-Key": api_key} if api_key else {}
-            api_url = f"https://toncenter.com/api/v2/getTransactions?address={address}&limit=10"
-            
-            response = requests.get(api_url, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"Error from Toncenter API: {response.status_code}")
-                return False
-                
-            data = response.json()
-            
-            if not data.get("ok", False):
-                logger.error(f"Toncenter API error: {data.get('error')}")
-                return False
-                
-            transactions = data.get("result", [])
-            
-            # Check transactions
-            for tx in transactions:
-                # Check if this is an incoming transaction
-                if tx.get("in_msg", {}).get("destination") == address:
-                    # TON uses nanograms (1 TON = 1e9 nanograms)
-                    amount = float(tx.get("in_msg", {}).get("value", 0)) / 1e9
-                    if amount >= expected_amount * 0.99:  # Allow 1% tolerance
-                        # Update order status with gift card code
-                        gift_card_code = f"GIFT-{order_id[:8]}"
-                        update_order_status(order_id, "completed", gift_card_code)
-                        return True
+            def pays_order(transfer):
+                # Skip transactions that already settled another order
+                if is_transaction_used(crypto, transfer["tx_hash"], order_id):
+                    return False
+                # Transfers from before the order are earlier payments to a shared address
+                if not sent_after(transfer, created_at):
+                    return False
+                return transfer["amount"] >= expected_amount * 0.99  # Allow 1% tolerance
+            
+            # The fastest healthy provider answers, reading only as far as the first
+            # payment; a slow one is hedged to the next
+            since = unix_time(created_at) - PAYMENT_TIME_GRACE
+            for transfer in fetch_address_transfers(crypto, address, since, match=pays_order):
+                check_deadline()
+                if pays_order(transfer):
+                    # Record the payment right away; it completes once it has enough confirmations
+                    payment_status = apply_transfer(order_id, crypto, transfer)
+                    if payment_status:
+                        return payment_status
             
             return False
+        except (BulkheadFull, DeadlineExceeded):
+            raise
         except Exception as e:
-            logger.error(f"Error checking TON payment: {e}")
+            logger.error(f"Error checking {crypto} payment: {e}")
             return False
     
     # For demo purposes, if environment variables are missing, simulate payment
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Background watcher that sweeps all pending orders against chain data
+"""
+import os
+import logging
+import threading
+from collections import defaultdict
+from config import PAYMENT_CHECK_INTERVAL, PAYMENT_TIME_GRACE, EVM_RPC_URLS, EVM_LOG_WINDOW, EVM_TOKEN_CONTRACTS
+from data_manager import get_pending_orders, get_chain_cursor, save_chain_cursor, get_address_owners
+from explorers import (
+    UTXO_BATCH_CHAINS,
+    sent_after,
+    unix_time,
+    fetch_utxo_transfers_batch,
+    get_evm_block_number,
+    fetch_token_transfer_logs
+)
+from payment import apply_transfer
+from tx_ledger import is_transaction_used, seed_ledger
+from leader import run_as_leader
+
+logger = logging.getLogger(__name__)
+
+
+def _address_key(address):
+    """Normalize an address for comparison (EVM hex addresses are case-insensitive)."""
+    return address.lower() if address.startswith("0x") else address
+
+
+def match_transfers_to_orders(orders, transfers, owners=None):
+    """
+    Pair pending orders with incoming transfers to their payment addresses.
+
+    Each transfer pays for at most one order, so orders that share a static
+    address are not all settled by one payment. Only transfers sent after an
+    order was created can pay for it; older ones at a shared address are
+    earlier customers' payments. Transfers are taken oldest first, each by the
+    newest order created before it that it covers: a customer pays right after
+    creating the invoice, so an older unpaid order is most likely abandoned.
+    A transfer to a derived address can only pay the order it is reserved for.
+
+    Args:
+        orders (list): Pending order dicts, oldest first
+        owners (dict): Derived address -> order_id it is reserved for (see get_address_owners)
+
+    Returns:
+        list: (order, transfer) pairs
+    """
+    by_address = defaultdict(list)
+    for order in orders:
+        by_address[_address_key(order["payment_address"] or "")].append(order)
+
+    owners = {_address_key(address): order_id for address, order_id in (owners or {}).items()}
+
+    matched = set()
+    matches = []
+    for transfer in sorted(transfers, key=lambda transfer: (transfer.get("time") is None, transfer.get("time") or 0)):
+        address = _address_key(transfer["address"])
+        candidates = [
+            order for order in by_address.get(address, [])
+            if order["order_id"] not in matched
+            and owners.get(address, order["order_id"]) == order["order_id"]
+            and not is_transaction_used(order["crypto"], transfer["tx_hash"], order["order_id"])
+            and sent_after(transfer, order["created_at"])
+            and transfer["amount"] >= float(order["crypto_amount"]) * 0.99  # Allow 1% tolerance
+        ]
+        if candidates:
+            order = candidates[-1]
+            matched.add(order["order_id"])
+            matches.append((order, transfer))
+    return matches
+
+
+def sweep_utxo_payments(crypto):
+    """
+    Check every pending order of a UTXO chain with batched address queries.
+
+    Returns:
+        int: Number of orders completed by this sweep
+    """
+    orders = [order for order in get_pending_orders(crypto) if order.get("payment_address")]
+    if not orders:
+        return 0
+
+    # Nothing older than the oldest pending order can pay for one, so history stops there
+    since = unix_time(orders[0]["created_at"]) - PAYMENT_TIME_GRACE
+    addresses = [order["payment_address"] for order in orders]
+    transfers = fetch_utxo_transfers_batch(crypto, addresses, since)
+    owners = get_address_owners(crypto, addresses)
+
+    completed = 0
+    for order, transfer in match_transfers_to_orders(orders, transfers, owners):
+        payment_status = apply_transfer(order["order_id"], crypto, transfer)
+        if payment_status is True or (isinstance(payment_status, dict) and payment_status.get("status") == "completed"):
+            completed += 1
+
+    if completed:
+        logger.info(f"{crypto} sweep completed {completed} of {len(orders)} pending orders")
+    return completed
+
+
+def sweep_evm_token_payments(chain):
+    """
+    Check every pending token order on an EVM chain by scanning Transfer logs.
+    
+    Blocks from the chain's cursor up to the tip are scanned in EVM_LOG_WINDOW
+    windows, one eth_getLogs call per window for all tokens and all receiving
+    addresses. The cursor only advances past blocks whose transfers have enough
+    confirmations, so transfers first seen as pending are picked up again later.
+    
+    Returns:
+        int: Number of orders completed by this sweep
+    """
+    tokens = {crypto: token for crypto, token in EVM_TOKEN_CONTRACTS.items() if token["chain"] == chain}
+    if not tokens or not EVM_RPC_URLS.get(chain):
+        return 0
+    
+    tip = get_evm_block_number(chain)
+    required_confirmations = int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1"))
+    settled_block = tip - required_confirmations + 1
+    
+    orders = [
+        order for crypto in tokens for order in get_pending_orders(crypto)
+        if order.get("payment_address")
+    ]
+    cursor = get_chain_cursor(chain)
+    if not orders:
+        # Nothing to pay for; payments to new orders can only land in later blocks
+        save_chain_cursor(chain, settled_block)
+        return 0
+    if cursor is None:
+        cursor = settled_block - EVM_LOG_WINDOW
+    
+    addresses = [order["payment_address"] for order in orders]
+    owners = {crypto: get_address_owners(crypto, addresses) for crypto in tokens}
+    completed = 0
+    from_block = cursor + 1
+    while from_block <= tip:
+        to_block = min(from_block + EVM_LOG_WINDOW - 1, tip)
+        transfers = fetch_token_transfer_logs(chain, tokens, addresses, from_block, to_block, tip)
+        
+        for crypto in tokens:
+            token_orders = [order for order in orders if order["crypto"] == crypto and order["status"] == "pending"]
+            token_transfers = [transfer for transfer in transfers if transfer["crypto"] == crypto]
+            for order, transfer in match_transfers_to_orders(token_orders, token_transfers, owners[crypto]):
+                payment_status = apply_transfer(order["order_id"], crypto, transfer)
+                if payment_status is True or (isinstance(payment_status, dict) and payment_status.get("status") == "completed"):
+                    # Don't match this order again in a later window
+                    order["status"] = "completed"
+                    completed += 1
+        
+        if settled_block >= from_block:
+            save_chain_cursor(chain, min(to_block, settled_block))
+        from_block = to_block + 1
+    
+    if completed:
+        logger.info(f"{chain} log scan completed {completed} of {len(orders)} pending token orders")
+    return completed
+
+
+def sweep_all_payments():
+    """Sweep pending orders once for all batch-capable chains."""
+    for crypto in UTXO_BATCH_CHAINS:
+        try:
+            sweep_utxo_payments(crypto)
+        except Exception as e:
+            logger.error(f"Error sweeping {crypto} payments: {e}")
+    for chain in EVM_RPC_URLS:
+        try:
+            sweep_evm_token_payments(chain)
+        except Exception as e:
+            logger.error(f"Error scanning {chain} token transfers: {e}")
+
+
+def run_payment_watcher(interval=PAYMENT_CHECK_INTERVAL):
+    """Sweep pending orders forever on whichever replica holds the payment-watcher leadership."""
+    logger.info(f"Payment watcher started (every {interval}s while leader)")
+    # Transactions of settlements from before the ledger must not match pending orders
+    seed_ledger()
+    run_as_leader("payment-watcher", sweep_all_payments, interval)
+
+
+def start_payment_watcher():
+    """Run the payment watcher in a daemon thread."""
+    watcher_thread = threading.Thread(target=run_payment_watcher, name="payment-watcher")
+    watcher_thread.daemon = True
+    watcher_thread.start()
+    return watcher_thread
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    run_payment_watcher()
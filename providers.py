@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Multi-provider explorer lookups with a latency/error scoreboard and hedged requests
+
+Each chain lists its explorer providers in config.EXPLORER_PROVIDERS. A lookup
+starts with the provider the scoreboard currently ranks best. If it hasn't
+answered within that provider's p95 latency, the same lookup is sent to the
+next provider and whichever answers first wins. A provider that fails hands
+over to the next one at once. All of these calls run on the chain's bulkhead, and a
+provider's history is only read as far as the caller's match.
+
+Metrics (labelled with chain and provider): provider_calls and provider_errors
+counters, a provider_seconds summary and a provider_p95_seconds gauge, plus
+per-chain explorer_hedged (hedge requests sent) and explorer_hedge_wins
+(answers that came from a provider other than the first choice) counters.
+"""
+import math
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import wait, FIRST_COMPLETED
+from config import EXPLORER_PROVIDERS, HEDGE_DELAY_DEFAULT, HEDGE_DELAY_MIN, PROVIDER_STATS_WINDOW
+from explorers import ADDRESS_PROVIDERS, ExplorerError, iter_address_transfers
+from deadline import remaining, check_deadline
+from bulkhead import get_bulkhead, BulkheadFull
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Providers that keep failing rank as if they were this many times slower
+ERROR_PENALTY = 4
+
+
+class ProviderStats:
+    """Latencies and outcomes of a provider's most recent calls."""
+
+    def __init__(self, window=PROVIDER_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.errors = deque(maxlen=window)
+
+    def record(self, seconds, error):
+        if not error:
+            self.latencies.append(seconds)
+        self.errors.append(1 if error else 0)
+
+    def p95(self):
+        """95th percentile latency of recent successful calls, or None without history."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
+    def error_rate(self):
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def score(self):
+        """Lower is better: p95 latency inflated by the recent error rate."""
+        return (self.p95() or HEDGE_DELAY_DEFAULT) * (1 + ERROR_PENALTY * self.error_rate())
+
+
+class Scoreboard:
+    """Per-chain provider stats shared by all lookups in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, chain, provider, seconds, error):
+        with self._lock:
+            stats = self._stats.setdefault((chain, provider), ProviderStats())
+            stats.record(seconds, error)
+            p95 = stats.p95()
+        metrics.increment("provider_calls", chain=chain, provider=provider)
+        if error:
+            metrics.increment("provider_errors", chain=chain, provider=provider)
+        else:
+            metrics.observe("provider_seconds", seconds, chain=chain, provider=provider)
+        if p95 is not None:
+            metrics.set_gauge("provider_p95_seconds", round(p95, 4), chain=chain, provider=provider)
+
+    def ranked(self, chain):
+        """The chain's configured providers, best first. Providers without history keep their configured order."""
+        configured = [name for name in EXPLORER_PROVIDERS.get(chain, []) if name in ADDRESS_PROVIDERS.get(chain, {})]
+        if not configured:
+            configured = list(ADDRESS_PROVIDERS.get(chain, {}))
+        with self._lock:
+            return sorted(configured, key=lambda name: self._stats.get((chain, name), ProviderStats()).score())
+
+    def hedge_delay(self, chain, provider):
+        """How long to wait for a provider before hedging to the next one."""
+        with self._lock:
+            stats = self._stats.get((chain, provider))
+            p95 = stats.p95() if stats else None
+        return max(HEDGE_DELAY_MIN, p95 if p95 is not None else HEDGE_DELAY_DEFAULT)
+
+
+SCOREBOARD = Scoreboard()
+
+
+def _call_provider(chain, provider, address, since=None, match=None):
+    """
+    Read a provider's transfers to address, stopping after the first one match() accepts.
+
+    Returns:
+        list: The transfers read, ending with the match if there was one
+    """
+    started = time.monotonic()
+    transfers = []
+    stream = iter_address_transfers(chain, address, provider, since)
+    try:
+        for transfer in stream:
+            transfers.append(transfer)
+            if match is not None and match(transfer):
+                break
+    except Exception:
+        SCOREBOARD.record(chain, provider, time.monotonic() - started, error=True)
+        raise
+    finally:
+        # Stopping early closes the response, so the rest of the history is never downloaded
+        if hasattr(stream, "close"):
+            stream.close()
+    SCOREBOARD.record(chain, provider, time.monotonic() - started, error=False)
+    return transfers
+
+
+def fetch_address_transfers(chain, address, since=None, match=None):
+    """
+    Fetch normalized incoming transfers to an address from the chain's best provider, hedging to the others.
+
+    Provider calls, hedges included, run on the chain's bulkhead, so they count
+    against its limits like any other explorer call for the chain. Paged
+    explorers are read back to since (Unix seconds), or through the whole
+    history when it is None.
+
+    Args:
+        match (callable): Stop reading a provider's history at the first transfer this accepts
+
+    Returns:
+        list: Transfers from the first provider to answer successfully, up to and including the match
+
+    Raises:
+        ExplorerError: Every provider failed.
+        BulkheadFull: The chain's bulkhead had no room for the first call.
+        DeadlineExceeded: The caller's deadline passed before any provider answered.
+    """
+    providers = SCOREBOARD.ranked(chain)
+    if not providers:
+        raise ValueError(f"No explorer configured for {chain}")
+    bulkhead = get_bulkhead(chain)
+
+    pending = {}
+    failures = []
+    next_index = 0
+
+    def launch():
+        """Start the next provider on the bulkhead. Returns it, or None if the bulkhead is full."""
+        nonlocal next_index
+        provider = providers[next_index]
+        next_index += 1
+        try:
+            # The bulkhead runs it in a copy of our context, so the deadline caps its HTTP timeouts
+            future = bulkhead.submit(_call_provider, chain, provider, address, since, match)
+        except BulkheadFull:
+            if not pending:
+                raise
+            logger.info(f"{chain} bulkhead is full; not hedging to {provider}")
+            return None
+        pending[future] = provider
+        return provider
+
+    last_launched = launch()
+    while pending:
+        if next_index < len(providers):
+            timeout = SCOREBOARD.hedge_delay(chain, last_launched)
+            left = remaining()
+            if left is not None:
+                timeout = min(timeout, max(0, left))
+        else:
+            timeout = remaining()
+
+        done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        if not done:
+            check_deadline()
+            if next_index < len(providers):
+                metrics.increment("explorer_hedged", chain=chain)
+                hedged = launch()
+                if hedged:
+                    last_launched = hedged
+                    logger.info(f"{chain} lookup hedged to {hedged}")
+            continue
+
+        for future in done:
+            provider = pending.pop(future)
+            try:
+                transfers = future.result()
+            except Exception as e:
+                failures.append(f"{provider}: {e}")
+                logger.warning(f"{chain} provider {provider} failed: {e}")
+                # A failing provider hands over at once, without waiting out the hedge delay
+                if next_index < len(providers):
+                    last_launched = launch() or last_launched
+                continue
+            if provider != providers[0]:
+                metrics.increment("explorer_hedge_wins", chain=chain)
+            return transfers
+
+    raise ExplorerError(f"All {chain} providers failed: {'; '.join(failures)}")
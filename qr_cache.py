@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+LRU cache of payment QR codes and their Telegram file_ids
+
+The same "address?amount=" payload is shown every time a user toggles the QR
+code or checks an unpaid invoice. The rendered PNG is cached by payload, and
+once Telegram has stored an upload the photo's file_id is cached too, so
+later displays resend it by file_id with no rendering and no upload.
+
+Metrics: qr_cache_hits (labelled by the form reused: file_id or png) and
+qr_cache_misses counters.
+"""
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+from telegram import InputFile
+from config import QR_CACHE_SIZE
+from qr_render import render_qr
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class QRCodeCache:
+    """Bounded LRU map of QR payload -> [PNG bytes, Telegram file_id or None]."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, payload):
+        with self._lock:
+            entry = self._entries.get(payload)
+            if entry is not None:
+                self._entries.move_to_end(payload)
+            return entry
+
+    def _store(self, payload, entry):
+        with self._lock:
+            self._entries[payload] = entry
+            self._entries.move_to_end(payload)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def photo(self, payload):
+        """What to pass as send_photo's photo: the cached file_id, else an InputFile of the (cached) PNG."""
+        entry = self._entry(payload)
+        if entry and entry[1]:
+            metrics.increment("qr_cache_hits", form="file_id")
+            return entry[1]
+        if entry:
+            metrics.increment("qr_cache_hits", form="png")
+            png = entry[0]
+        else:
+            metrics.increment("qr_cache_misses")
+            png = render_qr(payload)
+            self._store(payload, [png, None])
+        return InputFile(BytesIO(png), filename="payment_qr.png")
+
+    def track_upload(self, payload, sent):
+        """Remember the file_id once the send_photo future resolves; forget a file_id Telegram rejected."""
+        def on_sent(future):
+            entry = self._entry(payload)
+            if entry is None:
+                return
+            if future.exception():
+                entry[1] = None
+                return
+            message = future.result()
+            if message and message.photo and not entry[1]:
+                # The largest size is the one Telegram shows in the chat
+                entry[1] = message.photo[-1].file_id
+        sent.add_done_callback(on_sent)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+QR_CODES = QRCodeCache(QR_CACHE_SIZE)
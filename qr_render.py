@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Fast payment QR rendering in a process pool
+
+utils.generate_qr_code_image draws every module through Pillow and saves a
+24-bit RGB PNG. Here only the module matrix comes from qrcode, and it is
+written straight to a 1-bit palette PNG: each matrix row is packed into bits
+once and repeated box_size times, then deflated. The output is a fraction of
+the size and takes a fraction of the CPU time (see benchmark_qr.py).
+
+Rendering is still CPU-bound Python, so render_qr() runs it on a pool of
+QR_RENDER_PROCESSES worker processes; the calling handler thread just waits
+without holding the GIL, and other users' updates keep running. If the pool
+is disabled, broken or too slow, the QR code is rendered on the calling
+thread instead.
+"""
+import zlib
+import struct
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from config import QR_RENDER_PROCESSES, QR_RENDER_TIMEOUT, QR_BOX_SIZE, QR_BORDER
+
+logger = logging.getLogger(__name__)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Palette index 0 is a light module, 1 a dark one
+PALETTE = b"\xff\xff\xff\x00\x00\x00"
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def qr_matrix(payload, border=QR_BORDER):
+    """The QR code's modules, border included, as rows of booleans (True is dark)."""
+    import qrcode
+
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=border
+    )
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return qr.get_matrix()
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+
+def encode_png(matrix, box_size=QR_BOX_SIZE):
+    """Encode a module matrix as a 1-bit palette PNG with box_size pixels per module."""
+    side = len(matrix) * box_size
+    row_bytes = (side + 7) // 8
+    scanlines = []
+    for row in matrix:
+        bits = "".join(("1" if dark else "0") * box_size for dark in row)
+        bits += "0" * (row_bytes * 8 - side)
+        # Filter type 0 (None), then the row's pixels packed most significant bit first
+        scanline = b"\x00" + int(bits, 2).to_bytes(row_bytes, "big")
+        scanlines.append(scanline * box_size)
+
+    header = struct.pack(">IIBBBBB", side, side, 1, 3, 0, 0, 0)  # 1-bit, palette colour type
+    return (
+        PNG_SIGNATURE
+        + _chunk(b"IHDR", header)
+        + _chunk(b"PLTE", PALETTE)
+        + _chunk(b"IDAT", zlib.compress(b"".join(scanlines), 9))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def render_qr_png(payload, box_size=QR_BOX_SIZE):
+    """Render a payload's QR code as PNG bytes on the current thread."""
+    return encode_png(qr_matrix(payload), box_size)
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Fork a clean server process rather than this one with its threads and connections
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            if "forkserver" in methods:
+                context.set_forkserver_preload([__name__])
+            _pool = ProcessPoolExecutor(max_workers=QR_RENDER_PROCESSES, mp_context=context)
+        return _pool
+
+
+def _discard_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def render_qr(payload, box_size=QR_BOX_SIZE):
+    """Render a payload's QR code as PNG bytes, in the process pool when it's enabled."""
+    if QR_RENDER_PROCESSES <= 0:
+        return render_qr_png(payload, box_size)
+
+    pool = _get_pool()
+    try:
+        return pool.submit(render_qr_png, payload, box_size).result(timeout=QR_RENDER_TIMEOUT)
+    except BrokenProcessPool as e:
+        logger.error(f"QR render pool broke, rendering inline: {e}")
+        _discard_pool(pool)
+    except FutureTimeout:
+        logger.warning("QR render pool is backed up, rendering inline")
+    return render_qr_png(payload, box_size)
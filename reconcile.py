@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Reconcile all orders against chain data to catch missed or double settlements
+
+Usage:
+    python reconcile.py [--crypto BTC] [--workers 4] [--report reconciliation.csv] [--fix]
+
+Orders are streamed from the database with a server-side cursor, ordered and
+grouped by chain and payment address, so each address is fetched from its
+explorer once no matter how many orders share it (UTXO chains are fetched in
+batches), and only a few batches of addresses are in memory at a time. The
+matching runs in a process pool and every discrepancy is written to a CSV report.
+Explorer histories are paged back to the oldest order at each batch of
+addresses, and transfers only count as payments for orders created before them.
+
+Issues:
+    missed_payment          Unpaid order with an unclaimed transfer, sent after it, that pays for it (fixable)
+    stale_payment_record    Completed order whose payment row is not marked confirmed (fixable)
+    settlement_not_on_chain Completed order whose settling transaction is not at its address
+    double_settlement       One transaction recorded as the payment of several orders
+"""
+import os
+import csv
+import logging
+import argparse
+from collections import defaultdict, deque
+from itertools import groupby
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from models import db, Order, CryptoPayment, ProcessedTransaction
+from app import app
+from config import ADDRESS_BATCH_SIZE, PAYMENT_TIME_GRACE
+from explorers import UTXO_BATCH_CHAINS, supports_address_lookup, fetch_utxo_transfers_batch, sent_after, unix_time
+from providers import fetch_address_transfers
+
+logger = logging.getLogger(__name__)
+
+REPORT_FIELDS = ["issue", "order_id", "crypto", "address", "order_status", "tx_hash", "amount", "detail"]
+FIXABLE_ISSUES = ("missed_payment", "stale_payment_record")
+STREAM_BATCH_SIZE = 1000
+
+
+def _address_key(address):
+    """Normalize an address for grouping (EVM hex addresses are case-insensitive)."""
+    return address.lower() if address.startswith("0x") else address
+
+
+def stream_orders(crypto=None):
+    """
+    Yield every non-cancelled order with its recorded payment and ledger transactions.
+
+    Rows come through a server-side cursor in batches of STREAM_BATCH_SIZE
+    instead of being loaded into memory at once, ordered by chain and payment
+    address so the orders sharing an address arrive together.
+    """
+    with app.app_context():
+        query = db.session.query(
+            Order.order_id, Order.crypto, Order.payment_address, Order.crypto_amount, Order.status,
+            Order.created_at, CryptoPayment.transaction_id, CryptoPayment.status, ProcessedTransaction.tx_hash
+        ).outerjoin(CryptoPayment, CryptoPayment.order_id == Order.order_id).outerjoin(
+            ProcessedTransaction, ProcessedTransaction.order_id == Order.order_id
+        ).filter(
+            Order.status != "cancelled"
+        ).order_by(
+            # EVM addresses differing only in case sort next to each other and group together
+            Order.crypto, db.func.lower(Order.payment_address), Order.payment_address, Order.order_id
+        )
+        if crypto:
+            query = query.filter(Order.crypto == crypto)
+
+        order = None
+        for row in query.execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE):
+            order_id, crypto_code, address, amount, status, created_at, payment_tx, payment_status, ledger_tx = row
+            # An order with several ledger transactions comes back as one row per transaction
+            if order is None or order["order_id"] != order_id:
+                if order is not None:
+                    yield order
+                order = {
+                    "order_id": order_id,
+                    "crypto": crypto_code,
+                    "payment_address": address or "",
+                    "crypto_amount": float(amount or 0),
+                    "status": status,
+                    "created_at": created_at.isoformat() if created_at else "",
+                    "payment_tx": payment_tx,
+                    "payment_status": payment_status,
+                    "ledger_txs": []
+                }
+            if ledger_tx and ledger_tx not in order["ledger_txs"]:
+                order["ledger_txs"].append(ledger_tx)
+        if order is not None:
+            yield order
+
+
+def iter_groups(orders):
+    """Yield (crypto, address key, orders) for each address in turn, skipping orders without a lookup-able address."""
+    lookupable = (order for order in orders if order["payment_address"] and supports_address_lookup(order["crypto"]))
+    for (crypto, address), group in groupby(lookupable, key=lambda order: (order["crypto"], _address_key(order["payment_address"]))):
+        yield crypto, address, list(group)
+
+
+def iter_group_batches(groups, batch_size=ADDRESS_BATCH_SIZE):
+    """Collect consecutive groups of one chain into batches of up to batch_size addresses for one fetch."""
+    batch = []
+    for group in groups:
+        if batch and (group[0] != batch[0][0] or len(batch) >= batch_size):
+            yield batch
+            batch = []
+        batch.append(group)
+    if batch:
+        yield batch
+
+
+def fetch_group_transfers(crypto, addresses, since=None):
+    """Fetch all incoming transfers for a set of addresses of one chain back to since, keyed by normalized address."""
+    if crypto in UTXO_BATCH_CHAINS:
+        transfers = fetch_utxo_transfers_batch(crypto, addresses, since)
+    else:
+        transfers = []
+        for address in addresses:
+            try:
+                transfers.extend(fetch_address_transfers(crypto, address, since))
+            except Exception as e:
+                logger.error(f"Error fetching {crypto} transfers for {address}: {e}")
+
+    by_address = defaultdict(list)
+    for transfer in transfers:
+        by_address[_address_key(transfer["address"])].append(transfer)
+    return by_address
+
+
+def _fetch_batch(batch):
+    """Fetch the transfers for one batch of groups, back to just before its oldest order."""
+    crypto = batch[0][0]
+    oldest = min(order["created_at"] for _, _, orders in batch for order in orders)
+    since = unix_time(oldest) - PAYMENT_TIME_GRACE if oldest else None
+    return batch, fetch_group_transfers(crypto, [orders[0]["payment_address"] for _, _, orders in batch], since)
+
+
+def _bounded_map(executor, func, items, window):
+    """Like executor.map, but only keeps window items in flight so a lazy iterable stays lazy."""
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _finding(issue, order, transfer=None, detail=""):
+    return {
+        "issue": issue,
+        "order_id": order["order_id"],
+        "crypto": order["crypto"],
+        "address": order["payment_address"],
+        "order_status": order["status"],
+        "tx_hash": transfer["tx_hash"] if transfer else (order["payment_tx"] or ""),
+        "amount": transfer["amount"] if transfer else "",
+        "detail": detail,
+        "transfer": transfer
+    }
+
+
+def _time_order(transfer):
+    """Sort key putting transfers oldest first and undated (mempool) ones last."""
+    return (transfer.get("time") is None, transfer.get("time") or 0)
+
+
+def _pays_for(transfer, order, required_confirmations):
+    """Whether a settled transfer sent after the order covers its amount."""
+    settled = transfer.get("final") or transfer["confirmations"] >= required_confirmations
+    return (settled and sent_after(transfer, order["created_at"])
+            and transfer["amount"] >= order["crypto_amount"] * 0.99)  # Allow 1% tolerance
+
+
+def reconcile_group(orders, transfers, required_confirmations=1):
+    """
+    Compare the orders sharing one address with the transfers seen at it.
+
+    Runs in a worker process, so it only works on the plain data it is given.
+    Completed orders with no recorded transaction (settled before the ledger, by
+    hand or in demo mode) are assumed to have been paid by the oldest fitting
+    transfer after them, which is then claimed, so a later unpaid order isn't
+    reported as paid by an earlier customer's payment.
+
+    Returns:
+        list: Finding dicts (see REPORT_FIELDS, plus the matched transfer)
+    """
+    findings = []
+    transfers = sorted(transfers, key=_time_order)
+    by_hash = {transfer["tx_hash"]: transfer for transfer in transfers}
+    orders = sorted(orders, key=lambda order: order["created_at"])
+
+    # Transactions already recorded as paying for an order in this group
+    claimed = defaultdict(set)
+    for order in orders:
+        for tx_hash in set(order["ledger_txs"]) | ({order["payment_tx"]} if order["payment_tx"] else set()):
+            claimed[tx_hash].add(order["order_id"])
+
+    for tx_hash, order_ids in claimed.items():
+        if len(order_ids) > 1:
+            for order in orders:
+                if order["order_id"] in order_ids:
+                    findings.append(_finding("double_settlement", order, by_hash.get(tx_hash),
+                                             f"{tx_hash} also recorded for {', '.join(sorted(order_ids - {order['order_id']}))}"))
+
+    used = set(claimed)
+    paid = set()
+    for order in orders:
+        settled_txs = [tx_hash for tx_hash in (order["ledger_txs"] or [order["payment_tx"]]) if tx_hash]
+        if order["status"] != "completed" or settled_txs:
+            continue
+        # Historical settlement without a transaction on record: claim the transfer that most likely paid it
+        for transfer in transfers:
+            if transfer["tx_hash"] not in used and _pays_for(transfer, order, required_confirmations):
+                used.add(transfer["tx_hash"])
+                break
+
+    for order in orders:
+        settled_txs = [tx_hash for tx_hash in (order["ledger_txs"] or [order["payment_tx"]]) if tx_hash]
+
+        if order["status"] == "completed":
+            if not settled_txs or not transfers:
+                continue  # Claimed above, or the explorer returned nothing
+            for tx_hash in settled_txs:
+                if tx_hash not in by_hash:
+                    findings.append(_finding("settlement_not_on_chain", order, detail=f"{tx_hash} not found at address"))
+            transfer = by_hash.get(order["payment_tx"])
+            if transfer and order["payment_status"] != "confirmed":
+                findings.append(_finding("stale_payment_record", order, transfer,
+                                         f"payment row is {order['payment_status']}"))
+            continue
+
+        # Unpaid order: its own recorded transfer may have confirmed since
+        own = by_hash.get(order["payment_tx"])
+        if own and _pays_for(own, order, required_confirmations):
+            paid.add(order["order_id"])
+            findings.append(_finding("missed_payment", order, own, f"{own['confirmations']} confirmations"))
+
+    # Otherwise an unclaimed transfer pays the newest unpaid order created before it: a customer pays
+    # right after creating the invoice, so an older unpaid order at the address was most likely abandoned
+    for transfer in transfers:
+        if transfer["tx_hash"] in used:
+            continue
+        candidates = [order for order in orders if order["status"] != "completed" and order["order_id"] not in paid
+                      and _pays_for(transfer, order, required_confirmations)]
+        if candidates:
+            order = candidates[-1]
+            used.add(transfer["tx_hash"])
+            paid.add(order["order_id"])
+            findings.append(_finding("missed_payment", order, transfer, f"{transfer['confirmations']} confirmations"))
+    return findings
+
+
+def apply_fix(finding):
+    """Repair a fixable finding. Returns True if the row was updated."""
+    from payment import apply_transfer
+    from data_manager import save_crypto_payment
+
+    if finding["issue"] == "missed_payment":
+        payment_status = apply_transfer(finding["order_id"], finding["crypto"], finding["transfer"])
+        return payment_status is True or (isinstance(payment_status, dict) and payment_status.get("status") == "completed")
+    if finding["issue"] == "stale_payment_record":
+        return save_crypto_payment(finding["order_id"], {
+            "transaction_id": finding["tx_hash"],
+            "confirmations": finding["transfer"]["confirmations"],
+            "status": "confirmed"
+        })
+    return False
+
+
+def reconcile(crypto=None, workers=4, report_path="reconciliation.csv", fix=False, required_confirmations=1):
+    """
+    Reconcile all orders and write the report.
+
+    Addresses are streamed one batch at a time: a few batches are fetched in
+    threads while the fetched ones are matched in the process pool, and only
+    fixable findings are kept in memory until the end.
+
+    Returns:
+        dict: Number of findings per issue, plus "fixed" when fix is set
+    """
+    summary = defaultdict(int)
+    fixable = []
+    orders = addresses = 0
+    with open(report_path, "w", newline="") as report, \
+            ThreadPoolExecutor(max_workers=workers) as fetchers, \
+            ProcessPoolExecutor(max_workers=workers) as matchers:
+        writer = csv.DictWriter(report, fieldnames=REPORT_FIELDS, extrasaction="ignore")
+        writer.writeheader()
+
+        batches = iter_group_batches(iter_groups(stream_orders(crypto)))
+        # Fetching is network-bound, so it runs in threads
+        for batch, fetched in _bounded_map(fetchers, _fetch_batch, batches, workers * 2):
+            results = matchers.map(
+                reconcile_group,
+                [group_orders for _, _, group_orders in batch],
+                [fetched.get(address, []) for _, address, _ in batch],
+                [required_confirmations] * len(batch)
+            )
+            for group_findings in results:
+                for finding in group_findings:
+                    writer.writerow(finding)
+                    summary[finding["issue"]] += 1
+                    if fix and finding["issue"] in FIXABLE_ISSUES:
+                        fixable.append(finding)
+            addresses += len(batch)
+            orders += sum(len(group_orders) for _, _, group_orders in batch)
+
+    logger.info(f"Reconciled {orders} orders at {addresses} addresses")
+    if fix:
+        summary["fixed"] = sum(1 for finding in fixable if apply_fix(finding))
+
+    logger.info(f"Reconciliation finished: {dict(summary)}; report written to {report_path}")
+    return dict(summary)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    parser = argparse.ArgumentParser(description="Reconcile orders against chain data")
+    parser.add_argument("--crypto", help="Only reconcile orders paid in this cryptocurrency")
+    parser.add_argument("--workers", type=int, default=4, help="Fetch threads and matching processes")
+    parser.add_argument("--report", default="reconciliation.csv", help="Path of the CSV diff report")
+    parser.add_argument("--fix", action="store_true", help="Settle missed payments and repair stale payment rows")
+    args = parser.parse_args()
+
+    reconcile(args.crypto, args.workers, args.report, args.fix,
+              int(os.getenv("PAYMENT_CONFIRMATIONS_REQUIRED", "1")))
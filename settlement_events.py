@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+In-process settlement event bus
+
+Code that settles an order (the payment watcher, job queue workers, check_payment)
+publishes the order's final payment status. Handlers subscribe a callback for
+an order they are showing and get called once, from the publishing thread,
+if the order settles before the subscription expires. Nothing waits on a
+thread in the meantime.
+
+The bus itself only reaches subscribers in the same process; settlement_relay
+carries events between processes over PostgreSQL LISTEN/NOTIFY.
+"""
+import time
+import logging
+import threading
+from collections import defaultdict
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SettlementEventBus:
+    """Per-order one-shot subscriptions to settlement events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(list)  # order_id -> [(key, callback, expires_at)]
+
+    def _prune(self, now):
+        """Drop expired subscriptions (caller holds the lock)."""
+        for order_id in list(self._subscribers):
+            alive = [entry for entry in self._subscribers[order_id] if entry[2] > now]
+            if alive:
+                self._subscribers[order_id] = alive
+            else:
+                del self._subscribers[order_id]
+
+    def subscribe(self, order_id, callback, timeout, key=None):
+        """
+        Call callback(payment_status) if order_id settles within timeout seconds.
+
+        A new subscription replaces an earlier one for the same order with the same
+        key, e.g. when a user checks the same invoice again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            entries = self._subscribers[order_id]
+            if key is not None:
+                entries[:] = [entry for entry in entries if entry[0] != key]
+            entries.append((key, callback, now + timeout))
+            metrics.set_gauge("settlement_subscribers", sum(len(pending) for pending in self._subscribers.values()))
+
+    def unsubscribe(self, order_id, key):
+        """Cancel the order's subscription with key, if it hasn't fired yet. Returns whether there was one."""
+        with self._lock:
+            entries = self._subscribers.get(order_id, [])
+            alive = [entry for entry in entries if entry[0] != key]
+            if len(alive) == len(entries):
+                return False
+            if alive:
+                self._subscribers[order_id] = alive
+            else:
+                del self._subscribers[order_id]
+            metrics.set_gauge("settlement_subscribers", sum(len(pending) for pending in self._subscribers.values()))
+        return True
+
+    def publish(self, order_id, payment_status):
+        """Deliver a settlement to the order's live subscribers. Returns how many were notified."""
+        now = time.monotonic()
+        with self._lock:
+            entries = self._subscribers.pop(order_id, [])
+        callbacks = [callback for _, callback, expires_at in entries if expires_at > now]
+
+        for callback in callbacks:
+            try:
+                callback(payment_status)
+            except Exception as e:
+                logger.error(f"Error delivering settlement of order {order_id}: {e}")
+        if callbacks:
+            metrics.increment("settlement_events_delivered", len(callbacks))
+        return len(callbacks)
+
+    def wait(self, order_id, timeout):
+        """Block until order_id settles or timeout passes. Returns the payment status or None."""
+        settled = threading.Event()
+        result = {}
+
+        def on_settled(payment_status):
+            result["status"] = payment_status
+            settled.set()
+
+        self.subscribe(order_id, on_settled, timeout)
+        settled.wait(timeout)
+        return result.get("status")
+
+
+SETTLEMENT_EVENTS = SettlementEventBus()
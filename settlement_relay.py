@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Cross-process settlement events over PostgreSQL LISTEN/NOTIFY
+
+Orders are settled by the payment watcher and job workers in the bot process
+(or job replicas), but in webhook mode the Check Payment screen waiting for the
+settlement was subscribed in a gunicorn worker. publish_settlement delivers to
+the local SETTLEMENT_EVENTS bus and also NOTIFYs the settlement channel. Every
+process that subscribes starts a listener thread that republishes notifications
+to its own bus. Subscriptions fire once, so a process hearing its own
+notification back does nothing the second time.
+
+Notifications sent while a listener is reconnecting are lost; those users fall
+back to checking again. Other databases have no NOTIFY, so there events stay
+in-process.
+"""
+import json
+import time
+import select
+import logging
+import threading
+from sqlalchemy import text
+from models import db
+from app import app
+from settlement_events import SETTLEMENT_EVENTS
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "order_settled"
+RECONNECT_DELAY = 5  # seconds between listener reconnection attempts
+
+_lock = threading.Lock()
+_listener = None
+_supported = None
+
+
+def _notify_supported():
+    """Whether the database is PostgreSQL (checked once per process)."""
+    global _supported
+    if _supported is None:
+        with app.app_context():
+            _supported = db.engine.dialect.name == "postgresql"
+    return _supported
+
+
+def publish_settlement(order_id, payment_status):
+    """Deliver a settlement to this process's subscribers and notify the other processes."""
+    delivered = SETTLEMENT_EVENTS.publish(order_id, payment_status)
+    if not _notify_supported():
+        return delivered
+    payload = json.dumps({"order_id": order_id, "payment_status": payment_status})
+    try:
+        with app.app_context():
+            with db.engine.connect() as connection:
+                connection.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+                connection.commit()
+        metrics.increment("settlement_notify_sent")
+    except Exception as e:
+        logger.error(f"Error notifying other processes of the settlement of order {order_id}: {e}")
+    return delivered
+
+
+def _deliver(payload):
+    try:
+        event = json.loads(payload)
+        SETTLEMENT_EVENTS.publish(event["order_id"], event["payment_status"])
+    except Exception as e:
+        logger.error(f"Error handling settlement notification {payload!r}: {e}")
+
+
+def _listen():
+    """Relay notifications to the local bus, reconnecting after errors."""
+    while True:
+        connection = None
+        try:
+            with app.app_context():
+                connection = db.engine.raw_connection()
+            listener = connection.driver_connection
+            listener.autocommit = True
+            listener.cursor().execute(f"LISTEN {CHANNEL}")
+            logger.info(f"Listening for settlements on {CHANNEL}")
+            while True:
+                if not select.select([listener], [], [], 60)[0]:
+                    continue
+                listener.poll()
+                while listener.notifies:
+                    metrics.increment("settlement_notify_received")
+                    _deliver(listener.notifies.pop(0).payload)
+        except Exception as e:
+            logger.error(f"Settlement listener lost its connection: {e}")
+            if connection is not None:
+                connection.invalidate()
+        time.sleep(RECONNECT_DELAY)
+
+
+def start_settlement_listener():
+    """Start this process's listener thread on first use; a no-op on databases without NOTIFY."""
+    global _listener
+    if _listener is not None:
+        return
+    with _lock:
+        if _listener is not None or not _notify_supported():
+            return
+        _listener = threading.Thread(target=_listen, name="settlement-listener")
+        _listener.daemon = True
+        _listener.start()
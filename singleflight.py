@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Single-flight call coalescing with a short-TTL result cache
+"""
+import time
+import threading
+import metrics
+from deadline import remaining, DeadlineExceeded
+
+
+class _Call:
+    """A call in progress that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlightCache:
+    """
+    Coalesce concurrent calls for the same key into one, and reuse the result for ttl seconds.
+
+    Metrics (prefixed with name): <name>_cache_hits, <name>_cache_misses,
+    <name>_shared_calls counters and a <name>_cache_hit_ratio gauge that counts
+    both cached and shared results as hits.
+    """
+
+    def __init__(self, name, ttl, max_entries=10000):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._results = {}
+        self._in_flight = {}
+        self._hits = 0
+        self._requests = 0
+
+    def _record(self, outcome):
+        with self._lock:
+            self._requests += 1
+            if outcome != "cache_misses":
+                self._hits += 1
+            ratio = self._hits / self._requests
+        metrics.increment(f"{self.name}_{outcome}")
+        metrics.set_gauge(f"{self.name}_cache_hit_ratio", round(ratio, 4))
+
+    def _prune(self, now):
+        """Drop expired results once the cache grows past max_entries (caller holds the lock)."""
+        if len(self._results) <= self.max_entries:
+            return
+        for key in [key for key, (_, stored_at) in self._results.items() if now - stored_at >= self.ttl]:
+            del self._results[key]
+
+    def call(self, key, func, *args, **kwargs):
+        """
+        Return func(*args, **kwargs), sharing the result with concurrent and recent callers for the same key.
+
+        Exceptions are passed to every waiting caller but are not cached. A caller
+        sharing another's call waits no longer than its own deadline and then
+        raises DeadlineExceeded; the call itself carries on for the others.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._results.get(key)
+            if cached and now - cached[1] < self.ttl:
+                outcome = "cache_hits"
+            else:
+                in_flight = self._in_flight.get(key)
+                if in_flight:
+                    outcome = "shared_calls"
+                else:
+                    outcome = "cache_misses"
+                    in_flight = self._in_flight[key] = _Call()
+
+        self._record(outcome)
+        if outcome == "cache_hits":
+            return cached[0]
+
+        if outcome == "shared_calls":
+            if not in_flight.done.wait(timeout=remaining()):
+                metrics.increment("deadline_exceeded")
+                raise DeadlineExceeded(f"Deadline exceeded waiting for {self.name} call")
+            if in_flight.error:
+                raise in_flight.error
+            return in_flight.result
+
+        try:
+            in_flight.result = func(*args, **kwargs)
+        except Exception as e:
+            in_flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if in_flight.error is None:
+                    stored_at = time.monotonic()
+                    self._results[key] = (in_flight.result, stored_at)
+                    self._prune(stored_at)
+            in_flight.done.set()
+        return in_flight.result
+
+    def invalidate(self, key):
+        """Forget the cached result for a key."""
+        with self._lock:
+            self._results.pop(key, None)
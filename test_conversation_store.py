@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the in-memory conversation store's expiry
+"""
+import time
+from conversation_store import ConversationStore
+
+
+def start(store, user_id):
+    conversation = store.load(user_id)
+    conversation.state = "country_selection"
+    store.save(conversation)
+
+
+def test_idle_conversation_expires():
+    store = ConversationStore(max_size=10, ttl=0.2)
+    start(store, 1)
+    time.sleep(0.3)
+    assert store.load(1).state is None
+
+
+def test_loading_keeps_a_conversation_alive():
+    store = ConversationStore(max_size=10, ttl=0.3)
+    start(store, 1)
+    for _ in range(3):
+        time.sleep(0.15)
+        assert store.load(1).state == "country_selection"
+
+
+def test_least_recently_used_is_dropped_first():
+    store = ConversationStore(max_size=2, ttl=60)
+    start(store, 1)
+    start(store, 2)
+    store.load(1)
+    start(store, 3)
+    assert store.load(1).state == "country_selection"
+    assert store.load(2).state is None
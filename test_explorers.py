@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the lazy single-address explorer adapters, with canned HTTP responses
+"""
+import json
+import pytest
+import explorers
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200):
+        self.body = json.dumps(data).encode("utf-8")
+        self.data = data
+        self.status_code = status_code
+        self.closed = False
+
+    def json(self):
+        return self.data
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8")
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def http(monkeypatch):
+    """Serve canned responses by URL and record the requests made."""
+    routes = {}
+    requests_made = []
+
+    def get(url, params=None, **kwargs):
+        requests_made.append((url, dict(params or {})))
+        return routes[url](params or {})
+
+    monkeypatch.setattr(explorers.requests, "get", get)
+    return routes, requests_made
+
+
+def btc_tx(index, address, height=None):
+    return {"hash": f"tx{index}", "time": 2000 - index, "block_height": height,
+            "out": [{"addr": address, "value": 1000 * (index + 1)}, {"addr": "change", "value": 5}]}
+
+
+def test_blockchain_info_stops_reading_at_the_callers_match(http):
+    routes, requests_made = http
+    pages = []
+
+    def multiaddr(params):
+        txs = [btc_tx(params["offset"] + i, "bc1qpay") for i in range(explorers.MULTIADDR_PAGE_SIZE)]
+        pages.append(FakeResponse({"txs": txs, "info": {}}))
+        return pages[-1]
+
+    routes["https://blockchain.info/multiaddr"] = multiaddr
+    transfers = explorers.ADDRESS_PROVIDERS["BTC"]["blockchain.info"]("bc1qpay")
+    first = next(transfers)
+    transfers.close()
+
+    assert first == {"tx_hash": "tx0", "address": "bc1qpay", "amount": 1e-05, "confirmations": 0, "time": 2000.0}
+    # One page requested, closed early, and no tip lookup for unconfirmed transactions
+    assert [url for url, _ in requests_made] == ["https://blockchain.info/multiaddr"]
+    assert pages[0].closed
+
+
+def test_blockchain_info_pages_back_to_since(http):
+    routes, requests_made = http
+    size = explorers.MULTIADDR_PAGE_SIZE
+
+    def multiaddr(params):
+        offset = params["offset"]
+        count = size if offset < 2 * size else 3
+        return FakeResponse({"txs": [btc_tx(offset + i, "bc1qpay", height=100) for i in range(count)]})
+
+    routes["https://blockchain.info/multiaddr"] = multiaddr
+    routes["https://blockchain.info/q/getblockcount"] = lambda params: FakeResponse(104)
+
+    everything = list(explorers.ADDRESS_PROVIDERS["BTC"]["blockchain.info"]("bc1qpay"))
+    assert len(everything) == 2 * size + 3
+    assert {transfer["confirmations"] for transfer in everything} == {5}
+    # The tip is looked up once, not per page
+    assert sum(url.endswith("getblockcount") for url, _ in requests_made) == 1
+
+    requests_made.clear()
+    recent = list(explorers.ADDRESS_PROVIDERS["BTC"]["blockchain.info"]("bc1qpay", since=2000 - size - 10))
+    assert [params["offset"] for url, params in requests_made if url.endswith("multiaddr")] == [0, size]
+    assert len(recent) == 2 * size
+
+
+def test_blockcypher_merges_a_transaction_split_across_pages(http):
+    routes, requests_made = http
+    url = "https://api.blockcypher.com/v1/ltc/main/addrs/Laddr"
+
+    def addrs(params):
+        if "before" not in params:
+            return FakeResponse({"address": "Laddr", "hasMore": True, "txrefs": [
+                {"tx_hash": "new", "tx_output_n": 0, "value": 1e8, "block_height": 20, "confirmations": 1},
+                {"tx_hash": "split", "tx_output_n": 0, "value": 1e8, "block_height": 10, "confirmations": 11},
+            ]})
+        assert params["before"] == 11
+        return FakeResponse({"address": "Laddr", "hasMore": False, "txrefs": [
+            {"tx_hash": "split", "tx_output_n": 0, "value": 1e8, "block_height": 10, "confirmations": 11},
+            {"tx_hash": "split", "tx_output_n": 1, "value": 5e7, "block_height": 10, "confirmations": 11},
+        ]})
+
+    routes[url] = addrs
+    transfers = list(explorers.ADDRESS_PROVIDERS["LTC"]["blockcypher"]("Laddr"))
+    assert [(transfer["tx_hash"], transfer["amount"]) for transfer in transfers] == [("new", 1.0), ("split", 1.5)]
+    assert len(requests_made) == 2
+
+
+def test_bch_history_is_paged_lazily(http):
+    routes, requests_made = http
+
+    def transactions(params):
+        page = params["page"]
+        return FakeResponse({"pagesTotal": 3, "txs": [
+            {"txid": f"tx{page}", "blocktime": 3000 - page * 1000, "confirmations": 2,
+             "vout": [{"value": "0.5", "scriptPubKey": {"addresses": ["qpay"]}}]}
+        ]})
+
+    routes["https://rest.bitcoin.com/v2/address/transactions/qpay"] = transactions
+    transfers = explorers.ADDRESS_PROVIDERS["BCH"]["bitcoin.com"]("qpay")
+    assert next(transfers)["tx_hash"] == "tx0"
+    assert len(requests_made) == 1
+
+    requests_made.clear()
+    assert [t["tx_hash"] for t in explorers.ADDRESS_PROVIDERS["BCH"]["bitcoin.com"]("qpay", since=1500)] == \
+        ["tx0", "tx1", "tx2"]
+    assert [params["page"] for _, params in requests_made] == [0, 1, 2]
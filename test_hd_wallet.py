@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for watch-only BIP32 address derivation against published test vectors
+"""
+import pytest
+from hd_wallet import (
+    parse_extended_public_key, derive_address, derive_public_point, supports_derivation, xpub_fingerprint,
+    base58check_encode, base58check_decode, keccak256, _derive_child, _compress, _hash160, _eip55
+)
+
+# BIP84 test vector: account key m/84'/0'/0' of the "abandon ... about" mnemonic
+BIP84_ZPUB = "zpub6rFR7y4Q2AijBEqTUquhVz398htDFrtymD9xYYfG1m4wAcvPhXNfE3EfH1r1ADqtfSdVCToUG868RvUUkgDKf31mGDtKsAYz2oz2AGutZYs"
+# Account key m/44'/0'/0' of the same mnemonic
+BIP44_XPUB = "xpub6BosfCnifzxcFwrSzQiqu2DBVTshkCXacvNsWGYJVVhhawA7d4R5WSWGFNbi8Aw6ZRc1brxMyWMzG3DSSSSoekkudhUd9yLb6qx39T9nMdj"
+# BIP32 test vector 2: master public key and its child m/0
+BIP32_MASTER = "xpub661MyMwAqRbcFW31YEwpkMuc5THy2PSt5bDMsktWQcFF8syAmRUapSCGu8ED9W6oDMSgv6Zz8idoc4a6mr8BDzTJY47LJhkJ8UB7WEGuduB"
+BIP32_CHILD_0 = "xpub69H7F5d8KSRgmmdJg2KhpAK8SR3DjMwAdkxj3ZuxV27CprR9LgpeyGmXUbC6wb7ERfvrnKZjXoUmmDznezpbZb7ap6r1D3tgFxHmwMkQTPH"
+
+
+def test_bip32_public_child_derivation():
+    master = parse_extended_public_key(BIP32_MASTER)
+    chain_code, point = _derive_child(master["chain_code"], master["point"], 0)
+    parent_fingerprint = _hash160(_compress(master["point"]))[:4]
+    serialized = bytes.fromhex("0488b21e") + b"\x01" + parent_fingerprint + (0).to_bytes(4, "big") + chain_code + _compress(point)
+    assert base58check_encode(serialized) == BIP32_CHILD_0
+
+
+def test_bip84_native_segwit_addresses():
+    assert derive_address("BTC", BIP84_ZPUB, 0) == "bc1qcr8te4kr609gcawutmrza0j4xv80jy8z306fyu"
+    assert derive_address("BTC", BIP84_ZPUB, 1) == "bc1qnjg0jd8228aq7egyzacy8cys3knf9xvrerkf9g"
+
+
+def test_bip44_legacy_address():
+    assert derive_address("BTC", BIP44_XPUB, 0) == "1LqBGSKuX5yYUonjxT5qGfpUsXKYYWeabA"
+
+
+def test_addresses_are_distinct_per_index_and_chain():
+    addresses = [derive_address("BTC", BIP44_XPUB, index) for index in range(5)]
+    assert len(set(addresses)) == 5
+    _, external = derive_public_point(BIP44_XPUB, 0, change=0)
+    _, internal = derive_public_point(BIP44_XPUB, 0, change=1)
+    assert external != internal
+
+
+def test_evm_and_tron_address_formats():
+    evm = derive_address("ETH", BIP44_XPUB, 0)
+    assert evm.startswith("0x") and len(evm) == 42
+    # Tokens on the same key share the address
+    assert derive_address("USDT", BIP44_XPUB, 0) == evm
+    tron = derive_address("TRX", BIP44_XPUB, 0)
+    assert tron.startswith("T")
+    # TRON addresses carry the same 20-byte account as the EVM address
+    assert base58check_decode(tron)[1:].hex() == evm[2:].lower()
+
+
+def test_eip55_checksum():
+    # Example from EIP-55
+    assert _eip55(bytes.fromhex("5aaeb6053f3e94c9b9a09f33669435e7ef1beaed")) == "0x5aAeb6053F3E94C9b9A09f33669435E7Ef1BeAed"
+
+
+def test_keccak256_empty_input():
+    assert keccak256(b"").hex() == "c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470"
+
+
+def test_base58check_round_trip_and_checksum():
+    payload = b"\x00" + bytes(range(20))
+    encoded = base58check_encode(payload)
+    assert base58check_decode(encoded) == payload
+    corrupted = encoded[:-1] + ("1" if encoded[-1] != "1" else "2")
+    with pytest.raises(ValueError):
+        base58check_decode(corrupted)
+
+
+def test_hardened_index_is_rejected():
+    with pytest.raises(ValueError):
+        derive_address("BTC", BIP44_XPUB, 0x80000000)
+
+
+def test_unsupported_crypto():
+    assert not supports_derivation("SOL")
+    with pytest.raises(ValueError):
+        derive_address("SOL", BIP44_XPUB, 0)
+
+
+def test_fingerprint_is_stable():
+    assert xpub_fingerprint(BIP44_XPUB) == xpub_fingerprint(" " + BIP44_XPUB + "\n")
+    assert xpub_fingerprint(BIP44_XPUB) != xpub_fingerprint(BIP84_ZPUB)
+    assert len(xpub_fingerprint(BIP44_XPUB)) == 16
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the durable payment-check job queue, run against SQLite
+"""
+import datetime
+import pytest
+from sqlalchemy.exc import IntegrityError
+from app import app
+from models import db, PaymentJob
+import metrics
+from job_queue import (
+    enqueue_payment_check, claim_jobs, complete_job, release_job, fail_job, report_queue_depths
+)
+
+
+def jobs():
+    with app.app_context():
+        return [(job.order_id, job.status) for job in PaymentJob.query.order_by(PaymentJob.id).all()]
+
+
+def test_enqueue_keeps_one_live_job_per_order(database):
+    assert enqueue_payment_check("order-1")
+    assert enqueue_payment_check("order-1")
+    assert jobs() == [("order-1", "queued")]
+
+
+def test_unique_index_rejects_a_second_live_job(database):
+    enqueue_payment_check("order-1")
+    with app.app_context():
+        db.session.add(PaymentJob(order_id="order-1", status="queued"))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+
+def test_finished_order_can_be_queued_again(database):
+    enqueue_payment_check("order-1")
+    job = claim_jobs("worker-a")[0]
+    assert complete_job(job["id"], "worker-a")
+    assert enqueue_payment_check("order-1")
+    assert jobs() == [("order-1", "done"), ("order-1", "queued")]
+
+
+def test_claimed_job_is_invisible_to_other_workers(database):
+    enqueue_payment_check("order-1")
+    assert [job["order_id"] for job in claim_jobs("worker-a")] == ["order-1"]
+    assert claim_jobs("worker-b") == []
+
+
+def test_expired_lease_is_reclaimed(database):
+    enqueue_payment_check("order-1")
+    job = claim_jobs("worker-a", visibility_timeout=-1)[0]
+    reclaimed = claim_jobs("worker-b")
+    assert [(j["id"], j["locked_by"], j["attempts"]) for j in reclaimed] == [(job["id"], "worker-b", 1)]
+    # The first worker lost its claim and can no longer ack the job
+    assert not complete_job(job["id"], "worker-a")
+
+
+def test_release_requeues_without_counting_a_failure(database):
+    enqueue_payment_check("order-1")
+    job = claim_jobs("worker-a")[0]
+    assert release_job(job["id"], "worker-a", delay=0)
+    again = claim_jobs("worker-a")[0]
+    assert again["attempts"] == 0
+
+
+def test_repeated_failures_dead_letter_the_job(database):
+    enqueue_payment_check("order-1")
+    with app.app_context():
+        PaymentJob.query.update({"max_attempts": 2})
+        db.session.commit()
+    for _ in range(2):
+        job = claim_jobs("worker-a")[0]
+        assert fail_job(job["id"], "worker-a", "explorer down")
+        with app.app_context():
+            PaymentJob.query.update({"available_at": datetime.datetime(2000, 1, 1)})
+            db.session.commit()
+    assert jobs() == [("order-1", "dead")]
+    assert claim_jobs("worker-a") == []
+
+
+def test_queue_depths_are_exported(database):
+    enqueue_payment_check("order-1")
+    enqueue_payment_check("order-2")
+    claim_jobs("worker-a")
+    assert report_queue_depths() == {"queued": 1, "running": 1, "dead": 0}
+    gauges = metrics.snapshot()["gauges"]
+    assert gauges['payment_jobs{status="queued"}'] == 1
+    assert gauges['payment_jobs{status="running"}'] == 1
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for incremental JSON array parsing across chunk boundaries
+"""
+import json
+import pytest
+from json_stream import iter_json_array
+
+
+class FakeResponse:
+    """Stands in for a streamed requests response, serving the body in fixed-size chunks."""
+
+    def __init__(self, body):
+        self.body = body.encode("utf-8")
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.body), chunk_size):
+            yield self.body[start:start + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+def parse(body, chunk_size, key=None, header=None):
+    return list(iter_json_array(FakeResponse(body), key, header, chunk_size=chunk_size))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 4, 5, 7, 64])
+@pytest.mark.parametrize("body", [
+    "[1.5]",
+    "[1e5, 2.25E-3]",
+    "[-0.125, 10, 3.0e+2, 7]",
+    "[12345678901234567890, 0.1]",
+])
+def test_numbers_split_across_chunks(body, chunk_size):
+    assert parse(body, chunk_size) == json.loads(body)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 16])
+def test_objects_and_multibyte_text_split_across_chunks(chunk_size):
+    body = json.dumps([{"hash": "ab", "value": 150000, "memo": "café ₿"}, {"hash": "cd", "value": 0.5}],
+                      ensure_ascii=False)
+    assert parse(body, chunk_size) == json.loads(body)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 5, 64])
+def test_keyed_array_collects_header(chunk_size):
+    header = {}
+    body = '{"status": "1", "message": "OK", "result": [{"value": "1.5"}, 2.5e1]}'
+    assert parse(body, chunk_size, "result", header) == [{"value": "1.5"}, 25.0]
+    assert header == {"status": "1", "message": "OK"}
+
+
+def test_empty_array_and_missing_key():
+    assert parse("[]", 1) == []
+    assert parse('{"status": "0"}', 2, "result") == []
+
+
+def test_malformed_array_raises():
+    with pytest.raises(ValueError):
+        parse("[1.5 2]", 1)
+
+
+def test_response_closed_when_caller_stops_early():
+    response = FakeResponse("[1, 2, 3]")
+    items = iter_json_array(response, chunk_size=1)
+    assert next(items) == 1
+    items.close()
+    assert response.closed
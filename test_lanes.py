@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for per-user lanes and pool admission
+"""
+import threading
+from lanes import UserLanes, LaneRouter
+
+
+def blocked_lanes(name, lanes=1, depth=1):
+    """UserLanes whose workers are stuck on a first job until the returned event is set."""
+    pool = UserLanes(name, lanes, depth)
+    started = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        started.set()
+        release.wait(5)
+
+    pool.submit("holder", hold)
+    started.wait(5)
+    return pool, release
+
+
+def test_same_key_runs_in_order():
+    pool = UserLanes("test_order", lanes=4, depth=100)
+    seen = []
+    done = threading.Event()
+    for i in range(50):
+        pool.submit("user", seen.append, i)
+    pool.submit("user", done.set)
+    assert done.wait(5)
+    assert seen == list(range(50))
+
+
+def test_full_lane_refuses_without_blocking():
+    pool, release = blocked_lanes("test_full")
+    try:
+        assert pool.submit("user", lambda: None) == 0
+        assert pool.submit("user", lambda: None) is None
+    finally:
+        release.set()
+
+
+def test_router_rolls_back_counts_when_lane_is_full():
+    pool, release = blocked_lanes("test_router_full")
+    router = LaneRouter({"catalog": pool}, lambda item: "catalog")
+    try:
+        assert router.submit("user", None, lambda: None) == "catalog"
+        assert router.submit("user", None, lambda: None) is None
+        # Only the queued item counts; the refused one left no trace
+        assert router._load["catalog"] == 1
+        assert router._in_flight["user"] == ["catalog", 1]
+        assert router.submit("other", None, lambda: None) is None
+        assert "other" not in router._in_flight
+    finally:
+        release.set()
+
+
+def test_router_sheds_over_admission_limit():
+    pool, release = blocked_lanes("test_admission", lanes=1, depth=10)
+    router = LaneRouter({"catalog": pool}, lambda item: "catalog", {"catalog": 2})
+    try:
+        assert router.submit("a", None, lambda: None) == "catalog"
+        assert router.submit("b", None, lambda: None) == "catalog"
+        assert router.submit("c", None, lambda: None) is None
+        assert router.submit("a", None, lambda: None, limit=1) is None
+    finally:
+        release.set()
+
+
+def test_key_follows_its_pool_while_in_flight():
+    catalog, release_catalog = blocked_lanes("test_follow_catalog", depth=10)
+    payment = UserLanes("test_follow_payment", 1, 10)
+    router = LaneRouter({"catalog": catalog, "payment": payment}, lambda item: item)
+    try:
+        assert router.submit("user", "catalog", lambda: None) == "catalog"
+        assert router.submit("user", "payment", lambda: None) == "catalog"
+    finally:
+        release_catalog.set()
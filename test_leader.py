@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for advisory-lock leader election, with a stand-in PostgreSQL connection
+"""
+import types
+import pytest
+import leader
+from leader import LeaderElection, run_as_leader, _lock_key
+
+
+class FakeLocks:
+    """Advisory locks shared by FakeConnections, like one PostgreSQL server."""
+
+    def __init__(self):
+        self.holders = {}  # key -> connection
+
+
+class FakeConnection:
+    def __init__(self, locks):
+        self.locks = locks
+        self.closed = False
+        self.broken = False
+
+    def execute(self, statement, params):
+        if self.broken:
+            raise ConnectionError("server closed the connection")
+        sql, key = str(statement), params["key"]
+        holder = self.locks.holders.get(key)
+        if "pg_try_advisory_lock" in sql:
+            if holder is None:
+                self.locks.holders[key] = self
+            return types.SimpleNamespace(scalar=lambda: self.locks.holders[key] is self)
+        if "pg_locks" in sql:
+            return types.SimpleNamespace(scalar=lambda: 1 if holder is self else 0)
+        if "pg_advisory_unlock" in sql:
+            if holder is self:
+                del self.locks.holders[key]
+            return types.SimpleNamespace(scalar=lambda: True)
+        raise AssertionError(sql)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        self.closed = True
+        # Ending the session releases its advisory locks
+        for key, holder in list(self.locks.holders.items()):
+            if holder is self:
+                del self.locks.holders[key]
+
+    def invalidate(self):
+        self.close()
+
+
+@pytest.fixture
+def postgres(monkeypatch):
+    """Make elections use fake PostgreSQL connections sharing one lock table."""
+    locks = FakeLocks()
+    monkeypatch.setattr(LeaderElection, "_supported", lambda self: True)
+    monkeypatch.setattr(leader, "db", types.SimpleNamespace(
+        engine=types.SimpleNamespace(connect=lambda: FakeConnection(locks))
+    ))
+    return locks
+
+
+def test_lock_key_is_stable_and_fits_32_bits():
+    assert _lock_key("payment-watcher") == _lock_key("payment-watcher")
+    assert _lock_key("payment-watcher") != _lock_key("reconcile")
+    assert 0 <= _lock_key("payment-watcher") < 2 ** 32
+
+
+def test_only_one_process_leads(postgres):
+    first, second = LeaderElection("watcher"), LeaderElection("watcher")
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    assert first.try_acquire()  # Renewing keeps the lock
+    first.release()
+    assert second.try_acquire()
+    assert not first.is_leader
+
+
+def test_leader_steps_down_when_its_connection_dies(postgres):
+    election = LeaderElection("watcher")
+    assert election.try_acquire()
+    election._connection.broken = True
+    assert not election.renew()
+    assert not election.is_leader
+
+
+def test_run_as_leader_releases_on_exit(postgres):
+    class Stop(BaseException):
+        pass
+
+    steps = []
+
+    def step():
+        steps.append(1)
+        raise Stop()
+
+    with pytest.raises(Stop):
+        run_as_leader("watcher", step, interval=0.01, renew_interval=0.01)
+    assert steps == [1]
+    assert postgres.holders == {}
+    assert LeaderElection("watcher").try_acquire()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the rate-limited outbound Telegram queue
+"""
+import threading
+import types
+import pytest
+import metrics
+from outbox import Outbox, bot_of
+
+
+class RetryAfter(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Retry in {retry_after}")
+        self.retry_after = retry_after
+
+
+class FakeBot:
+    """Records calls; a call can be held until released, or fail with queued errors."""
+
+    def __init__(self):
+        self.calls = []
+        self.errors = []
+        self.hold = None
+        self.held = threading.Event()
+
+    def _call(self, method, **kwargs):
+        if self.hold is not None and not self.held.is_set():
+            self.held.set()
+            self.hold.wait(5)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.calls.append((method, kwargs.get("text"), kwargs.get("message_id")))
+        return f"{method}:{kwargs.get('text')}"
+
+    def send_message(self, **kwargs):
+        return self._call("send_message", **kwargs)
+
+    def edit_message_text(self, **kwargs):
+        return self._call("edit_message_text", **kwargs)
+
+    def delete_message(self, **kwargs):
+        return self._call("delete_message", **kwargs)
+
+
+def test_calls_to_a_chat_run_in_order():
+    outbox, bot = Outbox(global_rate=1000, senders=4), FakeBot()
+    futures = [outbox.send_message(bot, 1, text=str(i)) for i in range(3)]
+    assert [future.result(5) for future in futures] == ["send_message:0", "send_message:1", "send_message:2"]
+    assert [text for _, text, _ in bot.calls] == ["0", "1", "2"]
+
+
+def test_waiting_edit_of_a_message_is_replaced_by_the_newer_one():
+    outbox, bot = Outbox(global_rate=1000, senders=2), FakeBot()
+    bot.hold = threading.Event()
+    first = outbox.send_message(bot, 1, text="invoice")
+    assert bot.held.wait(5)
+    older = outbox.edit_message_text(bot, 1, 42, text="pending")
+    newer = outbox.edit_message_text(bot, 1, 42, text="paid")
+    bot.hold.set()
+    assert first.result(5) == "send_message:invoice"
+    # Both futures resolve with the call that was made
+    assert older.result(5) == newer.result(5) == "edit_message_text:paid"
+    assert bot.calls == [("send_message", "invoice", None), ("edit_message_text", "paid", 42)]
+
+
+def test_edit_after_a_waiting_delete_is_not_merged_into_it():
+    outbox, bot = Outbox(global_rate=1000, senders=2), FakeBot()
+    bot.hold = threading.Event()
+    outbox.send_message(bot, 1, text="invoice")
+    assert bot.held.wait(5)
+    deleted = outbox.delete_message(bot, 1, 42)
+    edited = outbox.edit_message_text(bot, 1, 42, text="paid")
+    bot.hold.set()
+    deleted.result(5)
+    edited.result(5)
+    assert [method for method, _, _ in bot.calls] == ["send_message", "delete_message", "edit_message_text"]
+
+
+def test_flood_control_retries_the_same_call():
+    outbox, bot = Outbox(global_rate=1000, senders=2), FakeBot()
+    bot.errors.append(RetryAfter(0.05))
+    retries = metrics.get_counter("outbox_retry_after")
+    assert outbox.send_message(bot, 1, text="hello").result(5) == "send_message:hello"
+    assert metrics.get_counter("outbox_retry_after") == retries + 1
+    assert bot.calls == [("send_message", "hello", None)]
+
+
+def test_errors_reach_the_caller_and_later_calls_still_go_out():
+    outbox, bot = Outbox(global_rate=1000, senders=2), FakeBot()
+    bot.errors.append(ValueError("message to edit not found"))
+    failed = outbox.edit_message_text(bot, 1, 42, text="paid")
+    sent = outbox.send_message(bot, 1, text="paid")
+    with pytest.raises(ValueError):
+        failed.result(5)
+    assert sent.result(5) == "send_message:paid"
+
+
+def test_bot_of_prefers_get_bot():
+    bot = object()
+    assert bot_of(types.SimpleNamespace(get_bot=lambda: bot, bot=None)) is bot
+    assert bot_of(types.SimpleNamespace(bot=bot)) is bot
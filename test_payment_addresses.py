@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for derived payment address reservation and reuse
+"""
+import datetime
+from app import app
+from models import db, PaymentAddress
+from data_manager import (
+    save_order, save_payment_address, reuse_payment_address, get_order_id_for_address, get_address_owners,
+    settle_payment, cancel_order, get_order, get_next_derivation_index, get_last_paid_derivation_index
+)
+
+
+def reserve(order_id, index, age_hours=48, status="pending"):
+    address = f"bc1qderived{index}"
+    assert save_payment_address("BTC", address, "xpub-1", index, order_id)
+    assert save_order({
+        "order_id": order_id, "user_id": 1, "country": "USA", "gift_card": "Apple", "denomination": "$100",
+        "original_price": 100.0, "discounted_price": 85.0, "crypto": "BTC", "crypto_amount": 0.001,
+        "payment_address": address, "status": status
+    })
+    with app.app_context():
+        PaymentAddress.query.filter_by(order_id=order_id).update(
+            {"created_at": datetime.datetime.utcnow() - datetime.timedelta(hours=age_hours)})
+        db.session.commit()
+    return address
+
+
+def test_lookup_by_address(database):
+    address = reserve("order-1", 0)
+    assert get_order_id_for_address("BTC", address) == "order-1"
+    assert get_order_id_for_address("LTC", address) is None
+    assert get_address_owners("BTC", [address, "bc1qstatic"]) == {address: "order-1"}
+    assert get_next_derivation_index("xpub-1") == 1
+
+
+def test_abandoned_invoice_gives_up_its_address(database):
+    address = reserve("abandoned", 0)
+    assert reuse_payment_address("BTC", "xpub-1", "new", 24) == (address, 0)
+    assert get_order_id_for_address("BTC", address) == "new"
+    # The old invoice can no longer be settled by a late payment
+    assert get_order("abandoned")["status"] == "cancelled"
+    assert settle_payment("abandoned", {"transaction_id": "tx-1", "status": "confirmed"})["status"] == "cancelled"
+
+
+def test_recent_or_paid_invoices_keep_their_address(database):
+    reserve("recent", 0, age_hours=1)
+    reserve("detected", 1)
+    settle_payment("detected", {"transaction_id": "tx-1", "confirmations": 0, "status": "pending"})
+    reserve("paid", 2)
+    settle_payment("paid", {"transaction_id": "tx-2", "status": "confirmed"})
+    assert reuse_payment_address("BTC", "xpub-1", "new", 24) is None
+    assert get_last_paid_derivation_index("xpub-1") == 2
+
+
+def test_cancelled_invoice_address_is_reused_lowest_index_first(database):
+    reserve("first", 0)
+    reserve("second", 1)
+    cancel_order("second")
+    assert reuse_payment_address("BTC", "xpub-1", "new", 24) == ("bc1qderived0", 0)
+    assert reuse_payment_address("BTC", "xpub-1", "newer", 24) == ("bc1qderived1", 1)
+    assert reuse_payment_address("BTC", "xpub-1", "newest", 24) is None
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for settle_payment and the processed-transaction ledger
+"""
+from app import app
+from models import db, Order, CryptoPayment, ProcessedTransaction
+from data_manager import save_order, settle_payment, cancel_order, get_order, backfill_processed_transactions
+
+
+def make_order(order_id, crypto="BTC", address="bc1qstatic"):
+    assert save_order({
+        "order_id": order_id,
+        "user_id": 1,
+        "country": "USA",
+        "gift_card": "Apple",
+        "denomination": "$100",
+        "original_price": 100.0,
+        "discounted_price": 85.0,
+        "crypto": crypto,
+        "crypto_amount": 0.001,
+        "payment_address": address,
+        "status": "pending"
+    })
+    return order_id
+
+
+def ledger():
+    with app.app_context():
+        return {(row.chain, row.tx_hash): row.order_id for row in ProcessedTransaction.query.all()}
+
+
+def test_pending_transaction_is_recorded_and_claimed(database):
+    make_order("order-1")
+    status = settle_payment("order-1", {"transaction_id": "tx-1", "confirmations": 0, "status": "pending"})
+    assert status["status"] == "pending"
+    assert status["transaction_id"] == "tx-1"
+    assert ledger() == {("BTC", "tx-1"): "order-1"}
+
+
+def test_confirmed_transaction_completes_order(database):
+    make_order("order-1")
+    status = settle_payment("order-1", {"transaction_id": "tx-1", "confirmations": 3, "status": "confirmed"},
+                            gift_card_code="GIFT-1")
+    assert status["status"] == "completed"
+    assert status["payment_status"] == "confirmed"
+    assert get_order("order-1")["gift_card_code"] == "GIFT-1"
+
+
+def test_pending_then_confirmed_keeps_one_claim(database):
+    make_order("order-1")
+    settle_payment("order-1", {"transaction_id": "tx-1", "confirmations": 0, "status": "pending"})
+    status = settle_payment("order-1", {"transaction_id": "tx-1", "confirmations": 1, "status": "confirmed"})
+    assert status["status"] == "completed"
+    assert ledger() == {("BTC", "tx-1"): "order-1"}
+
+
+def test_transaction_claimed_by_another_order_is_rejected(database):
+    make_order("order-1")
+    make_order("order-2")
+    settle_payment("order-1", {"transaction_id": "tx-1", "confirmations": 0, "status": "pending"})
+    assert settle_payment("order-2", {"transaction_id": "tx-1", "confirmations": 0, "status": "pending"}) is False
+    assert settle_payment("order-2", {"transaction_id": "tx-1", "confirmations": 2, "status": "confirmed"}) is False
+    assert get_order("order-2")["status"] == "pending"
+
+
+def test_same_hash_on_another_chain_is_independent(database):
+    make_order("order-1", crypto="BTC")
+    make_order("order-2", crypto="LTC", address="ltc1qstatic")
+    assert settle_payment("order-1", {"transaction_id": "tx-1", "status": "confirmed"})["status"] == "completed"
+    assert settle_payment("order-2", {"transaction_id": "tx-1", "status": "confirmed"})["status"] == "completed"
+
+
+def test_cancelled_order_is_not_completed(database):
+    make_order("order-1")
+    cancel_order("order-1")
+    status = settle_payment("order-1", {"transaction_id": "tx-1", "confirmations": 6, "status": "confirmed"})
+    assert status["status"] == "cancelled"
+    assert get_order("order-1")["status"] == "cancelled"
+    assert ledger() == {}
+
+
+def test_completed_order_keeps_its_transaction(database):
+    make_order("order-1")
+    settle_payment("order-1", {"transaction_id": "tx-1", "status": "confirmed"})
+    status = settle_payment("order-1", {"transaction_id": "tx-2", "status": "confirmed"})
+    assert status["transaction_id"] == "tx-1"
+    assert ledger() == {("BTC", "tx-1"): "order-1"}
+
+
+def test_unknown_order(database):
+    assert settle_payment("missing", {"transaction_id": "tx-1", "status": "confirmed"}) is None
+
+
+def test_backfill_claims_historical_settlements(database):
+    make_order("order-1")
+    make_order("order-2")
+    make_order("order-3")
+    with app.app_context():
+        # Settled before the ledger existed: only the payment rows know the transactions
+        CryptoPayment.query.filter_by(order_id="order-1").update({"transaction_id": "tx-1", "status": "confirmed"})
+        CryptoPayment.query.filter_by(order_id="order-2").update({"transaction_id": "tx-2"})
+        Order.query.filter_by(order_id="order-2").update({"status": "completed"})
+        CryptoPayment.query.filter_by(order_id="order-3").update({"transaction_id": "tx-3"})
+        db.session.commit()
+
+    assert backfill_processed_transactions() == 2
+    assert ledger() == {("BTC", "tx-1"): "order-1", ("BTC", "tx-2"): "order-2"}
+    assert backfill_processed_transactions() == 0
+    assert settle_payment("order-3", {"transaction_id": "tx-1", "status": "confirmed"}) is False
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for single-flight call coalescing and its result cache
+"""
+import threading
+import pytest
+from singleflight import SingleFlightCache
+from deadline import deadline, DeadlineExceeded
+
+
+def test_result_reused_within_ttl():
+    cache = SingleFlightCache("test_reuse", ttl=60)
+    calls = []
+    assert cache.call("order", lambda: calls.append(1) or "paid") == "paid"
+    assert cache.call("order", lambda: calls.append(1) or "other") == "paid"
+    assert len(calls) == 1
+
+
+def test_invalidate_forces_a_fresh_call():
+    cache = SingleFlightCache("test_invalidate", ttl=60)
+    assert cache.call("order", lambda: False) is False
+    cache.invalidate("order")
+    assert cache.call("order", lambda: "paid") == "paid"
+
+
+def test_errors_are_not_cached():
+    cache = SingleFlightCache("test_errors", ttl=60)
+
+    def fail():
+        raise RuntimeError("explorer down")
+
+    with pytest.raises(RuntimeError):
+        cache.call("order", fail)
+    assert cache.call("order", lambda: "paid") == "paid"
+
+
+def test_concurrent_callers_share_one_call():
+    cache = SingleFlightCache("test_shared", ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "paid"
+
+    results = []
+    first = threading.Thread(target=lambda: results.append(cache.call("order", slow)))
+    first.start()
+    started.wait(5)
+    second = threading.Thread(target=lambda: results.append(cache.call("order", slow)))
+    second.start()
+    release.set()
+    first.join(5)
+    second.join(5)
+    assert results == ["paid", "paid"]
+    assert len(calls) == 1
+
+
+def test_waiter_gives_up_at_its_deadline():
+    cache = SingleFlightCache("test_deadline", ttl=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow():
+        started.set()
+        release.wait(5)
+        return "paid"
+
+    owner = threading.Thread(target=lambda: cache.call("order", slow))
+    owner.start()
+    started.wait(5)
+    try:
+        with deadline(0.05):
+            with pytest.raises(DeadlineExceeded):
+                cache.call("order", slow)
+    finally:
+        release.set()
+        owner.join(5)
+    # The shared call still finished and cached its result for later callers
+    assert cache.call("order", lambda: "other") == "paid"
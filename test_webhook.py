@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the webhook deployment checks
+"""
+import pytest
+import webhook
+
+
+@pytest.fixture
+def webhook_mode(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", "https://bot.example.com")
+    monkeypatch.setattr(webhook, "WEBHOOK_SECRET", "secret")
+    monkeypatch.setattr(webhook, "BOT_RUNTIME", "threaded")
+    monkeypatch.setattr(webhook, "CONVERSATION_BACKEND", "memory")
+    return monkeypatch
+
+
+def test_single_worker_may_keep_conversations_in_memory(webhook_mode):
+    webhook.check_deployment(workers=1)
+
+
+def test_several_workers_need_database_conversations(webhook_mode):
+    with pytest.raises(RuntimeError, match="CONVERSATION_BACKEND=database"):
+        webhook.check_deployment(workers=4)
+    webhook_mode.setattr(webhook, "CONVERSATION_BACKEND", "database")
+    webhook.check_deployment(workers=4)
+
+
+def test_async_runtime_is_refused_in_webhook_mode(webhook_mode):
+    webhook_mode.setattr(webhook, "BOT_RUNTIME", "async")
+    with pytest.raises(RuntimeError, match="BOT_RUNTIME=async"):
+        webhook.check_deployment()
+
+
+def test_polling_deployments_are_not_checked(monkeypatch):
+    monkeypatch.setattr(webhook, "WEBHOOK_URL", "")
+    monkeypatch.setattr(webhook, "BOT_RUNTIME", "async")
+    webhook.check_deployment(workers=4)
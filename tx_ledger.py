@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Processed-transaction ledger with an in-memory LRU prefilter
+"""
+import logging
+import threading
+from collections import OrderedDict
+from config import PROCESSED_TX_CACHE_SIZE
+from data_manager import get_processed_transactions, backfill_processed_transactions
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessedTransactionCache:
+    """Bounded LRU map of (chain, tx_hash) -> order_id for transactions already claimed by an order."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chain, tx_hash):
+        """Return the order_id that the transaction settled, or None if it isn't cached."""
+        key = (chain, tx_hash)
+        with self._lock:
+            order_id = self._entries.get(key)
+            if order_id is not None:
+                self._entries.move_to_end(key)
+            return order_id
+
+    def add(self, chain, tx_hash, order_id):
+        """Remember a settled transaction, evicting the least recently used entry if full."""
+        key = (chain, tx_hash)
+        with self._lock:
+            self._entries[key] = order_id
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_cache = ProcessedTransactionCache(PROCESSED_TX_CACHE_SIZE)
+_loaded = False
+_load_lock = threading.Lock()
+
+
+def load_processed_transactions():
+    """Warm the in-memory cache with the most recent ledger rows. Safe to call more than once."""
+    global _loaded
+    with _load_lock:
+        if _loaded:
+            return
+        rows = get_processed_transactions(limit=PROCESSED_TX_CACHE_SIZE)
+        # Rows come newest first; insert oldest first so the newest end up most recently used
+        for chain, tx_hash, order_id in reversed(rows):
+            _cache.add(chain, tx_hash, order_id)
+        _loaded = True
+        logger.info(f"Loaded {len(rows)} processed transactions into memory")
+
+
+def seed_ledger():
+    """Backfill the ledger from settlements recorded before it existed, then reload the in-memory cache."""
+    global _loaded
+    added = backfill_processed_transactions()
+    if added:
+        logger.info(f"Backfilled {added} historical transactions into the ledger")
+    with _load_lock:
+        _loaded = False
+    load_processed_transactions()
+
+
+def is_transaction_used(chain, tx_hash, order_id):
+    """
+    Check in O(1), without touching the database, whether a transaction is known to
+    be claimed by an order other than order_id.
+
+    A False result only means the transaction is not in memory; the ledger's unique
+    constraint, checked by settle_payment, is still the authority.
+    """
+    if not _loaded:
+        load_processed_transactions()
+    settled_order_id = _cache.get(chain, tx_hash)
+    return settled_order_id is not None and settled_order_id != order_id
+
+
+def remember_transaction(chain, tx_hash, order_id):
+    """Add a transaction that was written to the ledger elsewhere (e.g. by settle_payment) to the in-memory cache."""
+    _cache.add(chain, tx_hash, order_id)
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Telegram webhook ingestion for the Flask app
+
+With WEBHOOK_URL set, Telegram posts updates to WEBHOOK_PATH on the web app
+instead of the bot polling for them. Each web process builds the dispatcher
+from bot.create_bot on its first update and queues incoming updates on the
+dispatcher's update_queue, so the route answers Telegram as soon as an update
+is queued. The dispatcher hands updates to its per-user lanes as usual.
+
+Requests must carry WEBHOOK_SECRET in the X-Telegram-Bot-Api-Secret-Token
+header, which Telegram sends once the webhook is registered with it. Webhook
+mode stays off without a secret: the route would otherwise accept forged
+updates, e.g. admin button presses, from anyone who can reach it.
+
+Every gunicorn worker has its own dispatcher, lanes and in-memory conversation
+store, and Telegram may deliver a user's next update to any of them, so with
+more than one worker conversations must live in the database
+(CONVERSATION_BACKEND=database). check_deployment refuses to start otherwise;
+gunicorn.conf.py runs it before any worker is forked. Settlements found by the
+bot process reach the workers through settlement_relay. Webhook mode serves the
+threaded runtime only.
+"""
+import hmac
+import logging
+import threading
+from config import WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_PATH, BOT_RUNTIME, CONVERSATION_BACKEND
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+_lock = threading.Lock()
+_updater = None
+
+
+def webhook_enabled():
+    """Whether updates should arrive by webhook rather than polling: WEBHOOK_URL and WEBHOOK_SECRET are both set."""
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        logger.error("WEBHOOK_URL is set without WEBHOOK_SECRET; webhook mode stays disabled")
+        return False
+    return bool(WEBHOOK_URL)
+
+
+def check_deployment(workers=1):
+    """
+    Refuse webhook setups that would split or drop users' conversations.
+
+    Args:
+        workers (int): Web processes serving the webhook route
+
+    Raises:
+        RuntimeError: if webhook mode is combined with the async runtime, or with
+                      several workers sharing in-memory conversations
+    """
+    if not webhook_enabled():
+        return
+    if BOT_RUNTIME == "async":
+        raise RuntimeError("BOT_RUNTIME=async only polls for updates; unset WEBHOOK_URL or use BOT_RUNTIME=threaded")
+    if workers > 1 and CONVERSATION_BACKEND != "database":
+        raise RuntimeError(
+            f"Webhook mode with {workers} workers needs CONVERSATION_BACKEND=database; "
+            f"each worker would otherwise keep its own copy of users' conversations"
+        )
+
+
+def webhook_url():
+    return WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH
+
+
+def set_webhook(bot):
+    """Point Telegram at this app's webhook route unless it already is."""
+    url = webhook_url()
+    try:
+        if bot.get_webhook_info().url == url:
+            return True
+        bot.set_webhook(url=url, secret_token=WEBHOOK_SECRET)
+        logger.info(f"Webhook registered at {url}")
+        return True
+    except Exception as e:
+        logger.error(f"Error registering webhook at {url}: {e}")
+        return False
+
+
+def get_updater():
+    """The process's Updater, created with its dispatcher thread on first use."""
+    global _updater
+    with _lock:
+        if _updater is None:
+            from bot import create_bot
+            updater = create_bot()
+            dispatcher_thread = threading.Thread(target=updater.dispatcher.start, name="webhook-dispatcher")
+            dispatcher_thread.daemon = True
+            dispatcher_thread.start()
+            set_webhook(updater.bot)
+            _updater = updater
+    return _updater
+
+
+def secret_is_valid(header_value):
+    """Constant-time check of the secret token header. Without a configured secret every request is refused."""
+    if not WEBHOOK_SECRET:
+        return False
+    return hmac.compare_digest((header_value or "").encode(), WEBHOOK_SECRET.encode())
+
+
+def enqueue_update(data):
+    """
+    Queue a webhook payload for the dispatcher.
+
+    Returns:
+        bool: True if the payload was a valid update and was queued
+    """
+    from telegram import Update
+
+    updater = get_updater()
+    update = Update.de_json(data, updater.bot)
+    if update is None:
+        return False
+    updater.dispatcher.update_queue.put(update)
+    metrics.increment("webhook_updates")
+    metrics.set_gauge("webhook_queue_depth", updater.dispatcher.update_queue.qsize())
+    return True